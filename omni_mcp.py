@@ -4,19 +4,39 @@ Unified MCP server implementation for multimodal engineering workflows.
 The service integrates office-document automation, raster/vector graphics,
 media transcoding, and 3D/CAD tool orchestration under a single tool API.
 """
+import abc
+import asyncio
+import atexit
+import codecs
+import contextlib
+import copy
+import csv
+import functools
 import glob
+import hashlib
+import inspect
+import io
 import json
+import locale
+import multiprocessing
 import os
 import re
 import shutil
+import signal
+import sqlite3
 import subprocess
 import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional, Sequence, Tuple
-from mcp.server.fastmcp import FastMCP
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+from mcp.server.fastmcp import Context, FastMCP
 mcp = FastMCP("omni_mcp")
 # ========== CONFIG ==========
-BLENDER = r"D:\Blender\blender.exe"
+BLENDER = os.environ.get("OMNI_BLENDER") or r"D:\Blender\blender.exe"
 WD = Path(tempfile.gettempdir()) / "omni_mcp"
 WD.mkdir(exist_ok=True)
 CF = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
@@ -27,8 +47,13 @@ def _find(*candidates: str) -> Optional[str]:
             if os.path.isfile(resolved):
                 return resolved
     return None
-MATLAB = _find(r"C:\Program Files\MATLAB\*\bin\matlab.exe", r"D:\MATLAB\*\bin\matlab.exe") or "matlab"
+MATLAB = (
+    os.environ.get("OMNI_MATLAB")
+    or _find(r"C:\Program Files\MATLAB\*\bin\matlab.exe", r"D:\MATLAB\*\bin\matlab.exe")
+    or "matlab"
+)
 FFMPEG = _find(r"C:\Users\*\AppData\Local\Microsoft\WinGet\Packages\*ffmpeg*\ffmpeg*.exe") or "ffmpeg"
+FFPROBE = FFMPEG.replace("ffmpeg", "ffprobe") if "ffmpeg" in FFMPEG.lower() else "ffprobe"
 GIMP = (
     _find(r"D:\GIMP*\bin\gimp-console-*.exe", r"C:\Program Files\GIMP*\bin\gimp-console-*.exe")
     or _find(r"D:\GIMP*\bin\gimp-*.exe", r"C:\Program Files\GIMP*\bin\gimp-*.exe")
@@ -45,6 +70,29 @@ FREECAD = (
     or "FreeCADCmd"
 )
 GODOT = _find(r"D:\Godot*\Godot*.exe", r"C:\Godot*\Godot*.exe") or "godot"
+SOFFICE = _find(r"C:\Program Files\LibreOffice\program\soffice.exe", r"D:\LibreOffice\program\soffice.exe") or "soffice"
+# Worker pools: subprocess/document tools run on threads, CPU-bound renderers on processes.
+IO_WORKERS = int(os.environ.get("OMNI_IO_WORKERS") or min(32, (os.cpu_count() or 1) + 4))
+CPU_WORKERS = int(os.environ.get("OMNI_CPU_WORKERS") or max(1, (os.cpu_count() or 2) - 1))
+_POOLS: Dict[str, Executor] = {}
+# Warm Blender sessions: max live workers, idle seconds before eviction, startup/reload budget.
+BLENDER_WORKERS = int(os.environ.get("OMNI_BLENDER_WORKERS") or 2)
+BLENDER_IDLE = float(os.environ.get("OMNI_BLENDER_IDLE") or 600)
+BLENDER_START_TIMEOUT = float(os.environ.get("OMNI_BLENDER_START_TIMEOUT") or 120)
+# Warm MATLAB sessions: max live engines, idle seconds before eviction, startup budget.
+MATLAB_SESSIONS = int(os.environ.get("OMNI_MATLAB_SESSIONS") or 1)
+MATLAB_IDLE = float(os.environ.get("OMNI_MATLAB_IDLE") or 1800)
+MATLAB_START_TIMEOUT = float(os.environ.get("OMNI_MATLAB_START_TIMEOUT") or 180)
+# Render cache for deterministic generators: default for `cache=`, store location, size cap.
+RENDER_CACHE = os.environ.get("OMNI_RENDER_CACHE", "0").lower() in ("1", "true", "yes", "on")
+CACHE_DIR = Path(os.environ.get("OMNI_CACHE_DIR") or WD / "_cache")
+CACHE_MAX_MB = float(os.environ.get("OMNI_CACHE_MAX_MB") or 512)
+# Open-document sessions: idle seconds before a session is flushed and closed, max open documents.
+DOC_IDLE = float(os.environ.get("OMNI_DOC_IDLE") or 300)
+DOC_SESSIONS = int(os.environ.get("OMNI_DOC_SESSIONS") or 16)
+# ffprobe metadata index (keyed by path, size and mtime) and concurrent ffprobe processes per batch.
+PROBE_DB = Path(os.environ.get("OMNI_PROBE_DB") or CACHE_DIR / "probe.sqlite")
+PROBE_WORKERS = int(os.environ.get("OMNI_PROBE_WORKERS") or 8)
 def R(path: str) -> Path:
     """Resolve a relative path under the MCP working directory."""
     p = Path(path)
@@ -52,34 +100,653 @@ def R(path: str) -> Path:
 def J(ok: bool = True, **payload) -> str:
     """Serialize MCP responses with UTF-8 safe settings."""
     return json.dumps({"ok": ok, **payload}, ensure_ascii=False, default=str)
-def _run(
+class _Capture:
+    """Bounded head/tail capture of one subprocess stream (head=None keeps everything)."""
+    def __init__(self, head: Optional[int], tail: int) -> None:
+        self.head, self.tail = head, tail
+        self._head: list = []
+        self._head_len = 0
+        self._tail = ""
+        self.total = 0
+    def feed(self, text: str) -> None:
+        self.total += len(text)
+        if self.head is None or self._head_len < self.head:
+            room = len(text) if self.head is None else self.head - self._head_len
+            self._head.append(text[:room])
+            self._head_len += len(text[:room])
+            text = text[room:]
+        if text and self.tail:
+            self._tail = (self._tail + text)[-self.tail:]
+    def text(self) -> str:
+        head = "".join(self._head)
+        if self.total <= self._head_len + len(self._tail) or not head:
+            return head + self._tail
+        return head + "\n...(truncated)...\n" + self._tail
+def _kill_tree(proc: asyncio.subprocess.Process) -> None:
+    """Kill a subprocess together with every child it spawned."""
+    if proc.returncode is not None:
+        return
+    try:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                           capture_output=True, creationflags=CF)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.kill()
+async def _pump(
+    stream: asyncio.StreamReader,
+    capture: _Capture,
+    name: str,
+    on_line: Optional[Callable[[str, str], Any]],
+) -> None:
+    """Decode a pipe chunk by chunk into `capture`, forwarding complete lines to `on_line`."""
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace"),
+        translate=True,
+    )
+    pending = ""
+    while True:
+        data = await stream.read(65536)
+        text = decoder.decode(data, final=not data)
+        capture.feed(text)
+        if on_line is not None:
+            *lines, pending = (pending + text).split("\n")
+            if not data and pending:
+                lines.append(pending)
+            for line in lines:
+                res = on_line(name, line)
+                if inspect.isawaitable(res):
+                    await res
+        if not data:
+            return
+async def _run(
     cmd: Sequence[str] | str,
     timeout: int = 120,
     shell: bool = False,
     cwd: Optional[str] = None,
+    input: Optional[str] = None,
+    clamp: bool = True,
+    on_line: Optional[Callable[[str, str], Any]] = None,
 ) -> Tuple[str, str, int]:
-    """Run a subprocess and clamp output length for MCP transport stability."""
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        timeout=timeout,
-        shell=shell,
+    """Run a subprocess on the event loop and clamp output length for MCP transport stability.
+
+    stdout/stderr are decoded incrementally into bounded buffers (unbounded when
+    `clamp` is False); `on_line(stream, line)` sees each line as it arrives. The
+    process runs in its own group, which is killed on timeout or cancellation.
+    """
+    kw = dict(
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
         cwd=cwd or str(WD),
         creationflags=CF,
-        errors="replace",
-        stdin=subprocess.DEVNULL,
+        start_new_session=os.name != "nt",
     )
-    stdout = result.stdout or ""
-    stderr = result.stderr or ""
-    if len(stdout) > 4000:
-        stdout = stdout[:2000] + "\n...(truncated)...\n" + stdout[-2000:]
-    if len(stderr) > 2000:
-        stderr = stderr[-2000:]
-    return stdout, stderr, result.returncode
+    if shell:
+        proc = await asyncio.create_subprocess_shell(cmd, **kw)
+    else:
+        proc = await asyncio.create_subprocess_exec(*cmd, **kw)
+    out = _Capture(2000, 2000) if clamp else _Capture(None, 0)
+    err = _Capture(0, 2000) if clamp else _Capture(None, 0)
+    async def feed_stdin() -> None:
+        try:
+            proc.stdin.write(input.encode(locale.getpreferredencoding(False), errors="replace"))
+            await proc.stdin.drain()
+            proc.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    jobs = [_pump(proc.stdout, out, "stdout", on_line), _pump(proc.stderr, err, "stderr", on_line)]
+    if input is not None:
+        jobs.append(feed_stdin())
+    waiter = asyncio.gather(*jobs, proc.wait())
+    # Consume the gather result even when we are cancelled mid-flight.
+    waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+    try:
+        await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        _kill_tree(proc)
+        raise subprocess.TimeoutExpired(cmd, timeout) from None
+    except asyncio.CancelledError:
+        _kill_tree(proc)
+        raise
+    return out.text(), err.text(), proc.returncode
+def _scratch() -> tempfile.TemporaryDirectory:
+    """Private per-invocation directory under WD for generated scripts."""
+    return tempfile.TemporaryDirectory(prefix="run_", dir=WD, ignore_cleanup_errors=True)
+_FRAME = b"\x1e@omni "
+class _PipeWorker(abc.ABC):
+    """Long-lived external process answering JSON-lines requests on stdin with prefixed
+    JSON frames on stdout; every other output line is collected as the call's log."""
+    start_timeout = 120.0
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.busy = False
+        self.last_used = time.monotonic()
+        self.runs = 0
+        self.restarts = -1
+        self._seq = 0
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+    @abc.abstractmethod
+    def command(self) -> list:
+        """argv that starts the worker process."""
+    async def start(self) -> None:
+        """(Re)spawn the process and wait for its ready frame."""
+        self.close()
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            cwd=str(WD), creationflags=CF, start_new_session=os.name != "nt", limit=1 << 24,
+        )
+        self.restarts += 1
+        await self._reply(0, self.start_timeout, _Capture(0, 2000))
+    def close(self) -> None:
+        if self.alive:
+            _kill_tree(self.proc)
+        self.proc = None
+    async def _reply(self, rid: int, timeout: float, log: _Capture) -> dict:
+        async def read() -> dict:
+            enc = locale.getpreferredencoding(False)
+            while True:
+                line = await self.proc.stdout.readline()
+                if not line:
+                    raise RuntimeError(f"worker exited (code {await self.proc.wait()})")
+                if line.startswith(_FRAME):
+                    msg = json.loads(line[len(_FRAME):].decode(enc, errors="replace"))
+                    if msg.get("id") == rid:
+                        return msg
+                else:
+                    log.feed(line.decode(enc, errors="replace").replace("\r\n", "\n"))
+        try:
+            return await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            # A running request cannot be interrupted in place; the worker is sacrificed.
+            self.close()
+            raise subprocess.TimeoutExpired(self.command()[0], timeout) from None
+        except BaseException as e:
+            self.close()
+            if isinstance(e, RuntimeError):
+                raise RuntimeError(f"{e}\n{log.text()}") from None
+            raise
+    async def call(self, op: str, timeout: float, **req) -> Tuple[dict, str]:
+        """Send one request, starting the process first if it is not running."""
+        if not self.alive:
+            await self.start()
+        self._seq += 1
+        log = _Capture(2000, 2000)
+        self.proc.stdin.write((json.dumps({"id": self._seq, "op": op, **req}) + "\n").encode())
+        await self.proc.stdin.drain()
+        msg = await self._reply(self._seq, timeout, log)
+        return msg, log.text()
+class _WorkerPool:
+    """Keyed pool of _PipeWorker processes, bounded in size, with idle eviction.
+
+    One worker serves one key, so calls for the same key run in order against the
+    same session. A crashed or timed-out worker is respawned on the next call.
+    """
+    def __init__(self, factory: Callable[[str], _PipeWorker], size: int, idle: float) -> None:
+        self.factory, self.size, self.idle = factory, size, idle
+        self.workers: Dict[str, _PipeWorker] = {}
+        self._cond = asyncio.Condition()
+        self._reaper: Optional[asyncio.Task] = None
+    async def _checkout(self, key: str) -> _PipeWorker:
+        async with self._cond:
+            while True:
+                w = self.workers.get(key)
+                if w is None and len(self.workers) >= self.size:
+                    idle = [x for x in self.workers.values() if not x.busy]
+                    if idle:
+                        self._evict(min(idle, key=lambda x: x.last_used))
+                if w is None and len(self.workers) < self.size:
+                    w = self.workers[key] = self.factory(key)
+                if w is not None and not w.busy:
+                    w.busy = True
+                    return w
+                await self._cond.wait()
+    async def _checkin(self, w: _PipeWorker) -> None:
+        async with self._cond:
+            w.busy = False
+            w.last_used = time.monotonic()
+            self._cond.notify_all()
+    def _evict(self, w: _PipeWorker) -> None:
+        self.workers.pop(w.key, None)
+        w.close()
+    async def _reap(self) -> None:
+        while self.workers:
+            await asyncio.sleep(max(1.0, self.idle / 4))
+            async with self._cond:
+                now = time.monotonic()
+                for w in [x for x in self.workers.values() if not x.busy and now - x.last_used > self.idle]:
+                    self._evict(w)
+                self._cond.notify_all()
+    async def run(self, key: str, method: str, *args) -> Any:
+        """Check out the worker for `key` and await `worker.<method>(*args)` on it."""
+        w = await self._checkout(key)
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+        try:
+            return await getattr(w, method)(*args)
+        finally:
+            await self._checkin(w)
+    async def shutdown(self, key: Optional[str] = None) -> int:
+        """Close idle workers (all of them, or only the one for `key`)."""
+        async with self._cond:
+            victims = [w for w in self.workers.values() if not w.busy and key in (None, w.key)]
+            for w in victims:
+                self._evict(w)
+            self._cond.notify_all()
+            return len(victims)
+    def status(self) -> list:
+        now = time.monotonic()
+        return [{"key": w.key, "alive": w.alive, "busy": w.busy, "runs": w.runs,
+                 "restarts": max(w.restarts, 0), "idle_s": round(now - w.last_used, 1)}
+                for w in self.workers.values()]
+def _pool(kind: str) -> Executor:
+    """Return the shared executor for `kind` ("io" threads or "cpu" processes)."""
+    ex = _POOLS.get(kind)
+    if ex is None:
+        if kind == "cpu":
+            # spawn keeps workers independent of the server's threads and event loop.
+            ex = ProcessPoolExecutor(CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            ex = ThreadPoolExecutor(IO_WORKERS, thread_name_prefix="omni_io")
+        _POOLS[kind] = ex
+    return ex
+async def _submit(kind: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Await a blocking call on the `kind` pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_pool(kind), functools.partial(fn, *args, **kwargs))
+    except BrokenProcessPool:
+        # A crashed worker poisons the whole pool; drop it so the next call starts fresh.
+        _POOLS.pop(kind, None)
+        raise
+async def _map_pool(kind: str, fn: Callable[..., Any], argsets: Sequence[tuple],
+                    on_result: Optional[Callable[[Any], Any]] = None) -> list:
+    """Run fn(*args) for every argument tuple on the `kind` pool; results in completion order.
+
+    `on_result` is awaited for each result as it arrives. If a call or the callback raises
+    (or the caller is cancelled), calls that have not started are cancelled and running
+    ones are waited for before the error propagates, so no work outlives the caller."""
+    loop = asyncio.get_running_loop()
+    cfs: list = []
+    futs: list = []
+    out = []
+    try:
+        ex = _pool(kind)
+        for args in argsets:
+            cfs.append(ex.submit(fn, *args))
+            futs.append(asyncio.wrap_future(cfs[-1], loop=loop))
+        for fut in asyncio.as_completed(futs):
+            r = await fut
+            out.append(r)
+            if on_result is not None:
+                await on_result(r)
+        return out
+    except BrokenProcessPool:
+        _POOLS.pop(kind, None)
+        raise
+    finally:
+        for cf in cfs:
+            cf.cancel()
+        await asyncio.gather(*futs, return_exceptions=True)
+def _call_tool(name: str, args: tuple, kwargs: dict) -> Any:
+    """Process-pool trampoline: look up a tool's blocking body by name inside the worker."""
+    return inspect.unwrap(globals()[name])(*args, **kwargs)
+def _offload(kind: str = "io") -> Callable[[Callable[..., str]], Callable[..., Any]]:
+    """Expose a blocking tool body as an async tool that runs on the `kind` pool."""
+    def decorator(fn: Callable[..., str]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs) -> str:
+            try:
+                if kind == "cpu":
+                    return await _submit("cpu", _call_tool, fn.__name__, args, kwargs)
+                return await _submit(kind, fn, *args, **kwargs)
+            except BrokenProcessPool as e:
+                return J(False, err=f"worker crashed: {e}")
+        return wrapper
+    return decorator
+async def _notify(ctx: Optional[Context], done: float, total: Optional[float] = None,
+                  warnings: Sequence[str] = (), message: Optional[str] = None) -> None:
+    """Best-effort MCP progress / warning notifications; no request context means no-op."""
+    if ctx is None:
+        return
+    try:
+        await ctx.report_progress(done, total, message)
+        for w in warnings:
+            await ctx.warning(w)
+    except ValueError:
+        pass
+@functools.lru_cache(maxsize=1024)
+def _file_sha256(path: str, size: int, mtime_ns: int) -> str:
+    """Content hash of a file, memoised per (path, size, mtime) version."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+class _RenderCache:
+    """Content-addressed artifact store under CACHE_DIR/<tool>/, LRU-bounded by total bytes.
+
+    Entries are plain files named by key, each with a `.meta` sidecar holding the tool's
+    original JSON result; a hit refreshes the entry's mtime, so eviction removes the least
+    recently used entries first."""
+    def __init__(self, root: Path, max_bytes: float) -> None:
+        self.root, self.max_bytes = root, max_bytes
+        self.hits = self.misses = self.stores = self.evictions = 0
+        self._bytes: Optional[int] = None
+        self._lock = threading.Lock()
+    def _entries(self) -> list:
+        return [p for p in self.root.glob("*/*") if p.is_file() and not p.name.endswith((".tmp", ".meta"))]
+    @staticmethod
+    def _meta(entry: Path) -> Path:
+        return entry.with_name(entry.name + ".meta")
+    def _drop(self, entry: Path) -> None:
+        entry.unlink(missing_ok=True)
+        self._meta(entry).unlink(missing_ok=True)
+    def _size(self) -> int:
+        if self._bytes is None:
+            self._bytes = sum(p.stat().st_size for p in self._entries())
+        return self._bytes
+    def _file_digest(self, p: Path) -> str:
+        st = p.stat()
+        return _file_sha256(str(p), st.st_size, st.st_mtime_ns)
+    @functools.cached_property
+    def _source(self) -> str:
+        # Any change to the server code invalidates every entry.
+        return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+    def key(self, tool: str, args: dict, suffix: str) -> str:
+        """Hash of tool, normalised arguments, output extension and referenced input files."""
+        inputs: Dict[str, str] = {}
+        def norm(v: Any) -> Any:
+            if isinstance(v, str):
+                if v.lstrip()[:1] in ("[", "{"):
+                    try:
+                        return norm(json.loads(v))
+                    except ValueError:
+                        pass
+                if v and len(v) < 1024 and "\n" not in v:
+                    try:
+                        if R(v).is_file():
+                            inputs[v] = self._file_digest(R(v))
+                    except (OSError, ValueError):
+                        pass
+                return v
+            if isinstance(v, dict):
+                return {k: norm(x) for k, x in v.items()}
+            if isinstance(v, (list, tuple)):
+                return [norm(x) for x in v]
+            return v
+        blob = json.dumps({"tool": tool, "args": norm(args), "suffix": suffix,
+                           "inputs": inputs, "src": self._source}, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+    def fetch(self, tool: str, key: str, suffix: str, dest: Path) -> Optional[dict]:
+        """Copy the entry for `key` to `dest` and return the stored tool result; None on a miss."""
+        src = self.root / tool / (key + suffix)
+        try:
+            payload = json.loads(self._meta(src).read_text(encoding="utf-8"))
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            # Copy, not hardlink: tools rewrite outputs in place, which would corrupt a shared inode.
+            shutil.copyfile(src, dest)
+            os.utime(src)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return payload
+    def store(self, tool: str, key: str, suffix: str, src: Path, payload: str) -> None:
+        """Add `src` with its tool result `payload` as the entry for `key`, then evict down
+        to the size cap."""
+        e = self.root / tool / (key + suffix)
+        e.parent.mkdir(parents=True, exist_ok=True)
+        tmp = e.with_name(f"{e.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.copyfile(src, tmp)
+        with self._lock:
+            size = self._size() - (e.stat().st_size if e.exists() else 0)
+            # The sidecar goes first: an artifact is never visible without its result.
+            self._meta(e).write_text(payload, encoding="utf-8")
+            os.replace(tmp, e)
+            self._bytes = size + e.stat().st_size
+            self.stores += 1
+            if self._bytes > self.max_bytes:
+                for p in sorted(self._entries(), key=lambda p: p.stat().st_mtime):
+                    if self._bytes <= self.max_bytes:
+                        break
+                    self._bytes -= p.stat().st_size
+                    self._drop(p)
+                    self.evictions += 1
+    def clear(self, tool: str = "") -> int:
+        """Drop every entry (or only those of `tool`); returns the number removed."""
+        with self._lock:
+            victims = [p for p in self._entries() if not tool or p.parent.name == tool]
+            for p in victims:
+                self._drop(p)
+            self._bytes = None
+            return len(victims)
+    def stats(self) -> dict:
+        with self._lock:
+            ents = self._entries()
+            self._bytes = sum(p.stat().st_size for p in ents)
+            tools: Dict[str, int] = {}
+            for p in ents:
+                tools[p.parent.name] = tools.get(p.parent.name, 0) + 1
+            return {"dir": str(self.root), "entries": len(ents), "bytes": self._bytes,
+                    "max_bytes": int(self.max_bytes), "tools": tools, "hits": self.hits,
+                    "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+_CACHE = _RenderCache(CACHE_DIR, CACHE_MAX_MB * 1024 * 1024)
+def _cached(out: str = "path") -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Add a `cache` flag to an async generator tool; when set, serve repeat calls from _CACHE.
+
+    `out` names the output-path argument: it is left out of the key (only its extension
+    counts) and receives a copy of the stored artifact on a hit."""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        sig = inspect.signature(fn)
+        name = fn.__name__
+        @functools.wraps(fn)
+        async def wrapper(*args, cache: bool = RENDER_CACHE, **kwargs) -> str:
+            if not cache:
+                return await fn(*args, **kwargs)
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            dest = R(params.pop(out))
+            suffix = dest.suffix.lower()
+            key = await _submit("io", _CACHE.key, name, params, suffix)
+            hit = await _submit("io", _CACHE.fetch, name, key, suffix, dest)
+            if hit is not None:
+                # The stored result describes the original output; point it at this call's.
+                if "path" in hit:
+                    hit["path"] = str(dest)
+                return J(**{**hit, "cached": True})
+            before = dest.stat().st_mtime_ns if dest.exists() else None
+            res = await fn(*args, **kwargs)
+            # Only store artifacts this call actually (re)wrote.
+            if json.loads(res).get("ok") and dest.is_file() and dest.stat().st_mtime_ns != before:
+                await _submit("io", _CACHE.store, name, key, suffix, dest, res)
+            return res
+        # FastMCP builds the tool schema from this signature; expose `cache` next to the real params.
+        flag = inspect.Parameter("cache", inspect.Parameter.KEYWORD_ONLY, default=RENDER_CACHE, annotation=bool)
+        wrapper.__signature__ = sig.replace(parameters=[*sig.parameters.values(), flag])
+        return wrapper
+    return decorator
+def _load_doc(path: str, src: Any = None) -> Any:
+    """Parse an Office document into its python-pptx / python-docx / openpyxl object.
+
+    `src` (a file object) supplies the bytes instead of `path`, which still picks the type."""
+    ext = Path(path).suffix.lower()
+    if ext == ".pptx":
+        from pptx import Presentation
+        return Presentation(src or path)
+    if ext == ".docx":
+        from docx import Document
+        return Document(src or path)
+    if ext in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+        return load_workbook(src or path, keep_vba=ext == ".xlsm")
+    raise ValueError(f"unsupported document type: {ext}")
+class _DocSession:
+    """One parsed document kept in memory between edit calls."""
+    def __init__(self, handle: str, path: str) -> None:
+        self.handle, self.path = handle, path
+        self.lock = threading.RLock()
+        self.obj: Any = None
+        self.stamp: Optional[tuple] = None
+        self.dirty = False
+        self.edits = 0
+        self.last_used = time.monotonic()
+        self.err = ""
+        self.broken = ""
+    def _disk(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    def doc(self) -> Any:
+        """The in-memory document, (re)loaded when the file changed on disk under a clean session."""
+        if self.broken:
+            raise RuntimeError(f"session {self.handle} holds a partially applied edit ({self.broken}); "
+                               "close it with save=false to discard its pending edits")
+        disk = self._disk()
+        if self.obj is not None and disk != self.stamp:
+            if self.dirty:
+                raise RuntimeError(f"{self.path} changed on disk while session {self.handle} has "
+                                   "uncommitted edits; commit with force=true or close with save=false")
+            self.obj = None
+        if self.obj is None:
+            self.obj, self.stamp = _load_doc(self.path), disk
+        return self.obj
+    def save(self, force: bool = False) -> bool:
+        """Write pending edits back to `path` (atomically); False when there was nothing to write."""
+        if not self.dirty or self.obj is None:
+            return False
+        if self.broken:
+            raise RuntimeError(f"refusing to save {self.path}: partially applied after {self.broken}")
+        if not force and self._disk() != self.stamp:
+            raise RuntimeError(f"{self.path} changed on disk since it was opened")
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        self.obj.save(tmp)
+        os.replace(tmp, self.path)
+        self.stamp, self.dirty, self.err = self._disk(), False, ""
+        return True
+class _DocSessions:
+    """Handle -> _DocSession registry with idle flush, LRU capping and flush at exit."""
+    def __init__(self, idle: float, size: int) -> None:
+        self.idle, self.size = idle, size
+        self.sessions: Dict[str, _DocSession] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+    def open(self, path: str) -> _DocSession:
+        p = str(Path(path).resolve())
+        with self._lock:
+            sess = next((x for x in self.sessions.values() if x.path == p), None)
+            if sess is None:
+                if not os.path.isfile(p):
+                    raise FileNotFoundError(p)
+                while len(self.sessions) >= self.size:
+                    lru = min(self.sessions.values(), key=lambda x: x.last_used)
+                    self._close(lru, save=True)
+                sess = _DocSession(f"doc_{hashlib.sha1(p.encode('utf-8')).hexdigest()[:10]}", p)
+                self.sessions[sess.handle] = sess
+            if self._reaper is None or not self._reaper.is_alive():
+                self._reaper = threading.Thread(target=self._reap, name="omni_docs", daemon=True)
+                self._reaper.start()
+        with sess.lock:
+            sess.doc()
+            sess.last_used = time.monotonic()
+        return sess
+    def get(self, handle: str) -> _DocSession:
+        sess = self.sessions.get(handle)
+        if sess is None:
+            raise ValueError(f"no open document session: {handle}")
+        return sess
+    def _close(self, sess: _DocSession, save: bool) -> None:
+        with sess.lock:
+            if save:
+                sess.save()
+            self.sessions.pop(sess.handle, None)
+            sess.obj = None
+    def close(self, handle: str, save: bool = True) -> None:
+        with self._lock:
+            self._close(self.get(handle), save)
+    def flush(self) -> None:
+        """Save every dirty session; failures are kept on the session for status()."""
+        for sess in list(self.sessions.values()):
+            with sess.lock:
+                try:
+                    sess.save()
+                except Exception as e:
+                    sess.err = str(e)
+    def _reap(self) -> None:
+        while self.sessions:
+            time.sleep(min(self.idle / 4, 30))
+            now = time.monotonic()
+            with self._lock:
+                for sess in [x for x in self.sessions.values() if now - x.last_used > self.idle]:
+                    if not sess.lock.acquire(blocking=False):
+                        continue
+                    try:
+                        self._close(sess, save=True)
+                    except Exception as e:
+                        # Keep the edits in memory rather than lose them; status() shows why.
+                        sess.err, sess.last_used = str(e), now
+                    finally:
+                        sess.lock.release()
+    def status(self) -> list:
+        now = time.monotonic()
+        return [{"handle": x.handle, "path": x.path, "dirty": x.dirty, "edits": x.edits,
+                 "idle_s": round(now - x.last_used, 1), **({"err": x.err} if x.err else {})}
+                for x in self.sessions.values()]
+_DOCS = _DocSessions(DOC_IDLE, DOC_SESSIONS)
+atexit.register(_DOCS.flush)
+@contextlib.contextmanager
+def _doc_open(path: str, handle: str = "", detach: bool = False):
+    """Yield the parsed document for an edit tool: from session `handle`, or freshly from `path`.
+
+    Session edits stay in memory (the caller must not save). With `detach` the caller gets a
+    private copy of the session's current state (for writing elsewhere) and the session is
+    left untouched. A failed edit on a session with no earlier pending edits drops the
+    half-edited copy so the next call reloads from disk; with earlier pending edits the
+    session is marked broken and refuses to save until it is closed with save=false."""
+    if not handle:
+        yield _load_doc(path)
+        return
+    sess = _DOCS.get(handle)
+    if path and str(Path(path).resolve()) != sess.path:
+        raise ValueError(f"session {handle} is open on {sess.path}, not {path}")
+    if detach:
+        with sess.lock:
+            if sess.dirty:
+                buf = io.BytesIO()
+                sess.doc().save(buf)
+                buf.seek(0)
+                doc = _load_doc(sess.path, buf)
+            else:
+                doc = _load_doc(sess.path)
+            sess.last_used = time.monotonic()
+        yield doc
+        return
+    with sess.lock:
+        was_dirty = sess.dirty
+        try:
+            yield sess.doc()
+        except BaseException as e:
+            if not was_dirty:
+                sess.obj = None
+            elif not sess.broken:
+                sess.broken = sess.err = f"failed edit: {e}"
+            raise
+        sess.dirty = True
+        sess.edits += 1
+        sess.last_used = time.monotonic()
 # --- PPTX SUBSYSTEM: Presentation I/O and editing ---
 @mcp.tool(name="pptx_create")
-async def pptx_create(path:str,slides:str="[]",template:str="")->str:
+@_offload("io")
+def pptx_create(path:str,slides:str="[]",template:str="")->str:
     """创建PPT
     slides: JSON数组, 每项:
       {"title":"","content":"","layout":1,"notes":"",
@@ -131,7 +798,8 @@ async def pptx_create(path:str,slides:str="[]",template:str="")->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="pptx_read")
-async def pptx_read(path:str)->str:
+@_offload("io")
+def pptx_read(path:str)->str:
     """读取PPT全部文本"""
     from pptx import Presentation
     try:
@@ -149,7 +817,8 @@ async def pptx_read(path:str)->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="pptx_edit")
-async def pptx_edit(path:str,ops:str="[]")->str:
+@_offload("io")
+def pptx_edit(path:str,ops:str="[]",handle:str="")->str:
     """编辑PPT
     ops: JSON数组:
       {"slide":1,"placeholder":0,"text":"新文本"}
@@ -158,65 +827,67 @@ async def pptx_edit(path:str,ops:str="[]")->str:
       {"slide":1,"add_textbox":"文本","left":1,"top":1,"width":4,"height":1,"font_size":14}
       {"slide":1,"add_shape":"rect","left":1,"top":1,"width":3,"height":2,"fill":"0070C0"}
       {"slide":1,"delete":true}
-    slide从1开始"""
-    from pptx import Presentation
+    slide从1开始
+    handle: doc_session打开的会话句柄; 提供时在内存中的文档上修改, 不写盘, 由doc_session commit或空闲超时统一保存"""
     from pptx.util import Inches,Pt
     from pptx.dml.color import RGBColor
     from pptx.enum.shapes import MSO_SHAPE
     try:
         p=str(R(path))
-        prs=Presentation(p)
-        for op in json.loads(ops):
-            si=op["slide"]-1
-            sl=prs.slides[si]
-            if op.get("delete"):
-                rId=prs.slides._sldIdLst[si].rId
-                prs.part.drop_rel(rId)
-                del prs.slides._sldIdLst[si]
-            elif "text" in op:
-                ph=sl.placeholders[op.get("placeholder",0)]
-                ph.text=op["text"]
-                if op.get("font_size") or op.get("bold") or op.get("font_color"):
-                    for para in ph.text_frame.paragraphs:
-                        for run in para.runs:
-                            if op.get("font_size"):
-                                run.font.size=Pt(op["font_size"])
-                            if op.get("bold"):
-                                run.font.bold=True
-                            if op.get("font_color"):
-                                run.font.color.rgb=RGBColor.from_string(op["font_color"])
-            elif "add_image" in op:
-                kw={"width":Inches(op.get("width",5))}
-                if op.get("height"):
-                    kw["height"]=Inches(op["height"])
-                sl.shapes.add_picture(str(R(op["add_image"])),
-                    Inches(op.get("left",1)),Inches(op.get("top",1)),**kw)
-            elif "add_textbox" in op:
-                from pptx.util import Inches as In
-                txBox=sl.shapes.add_textbox(In(op.get("left",1)),In(op.get("top",1)),
-                    In(op.get("width",4)),In(op.get("height",1)))
-                tf=txBox.text_frame
-                tf.text=op["add_textbox"]
-                if op.get("font_size"):
-                    for r in tf.paragraphs[0].runs:
-                        r.font.size=Pt(op["font_size"])
-            elif "add_shape" in op:
-                shapes_map={"rect":MSO_SHAPE.RECTANGLE,"oval":MSO_SHAPE.OVAL,
-                           "triangle":MSO_SHAPE.ISOSCELES_TRIANGLE,"arrow":MSO_SHAPE.RIGHT_ARROW,
-                           "star":MSO_SHAPE.STAR_5_POINT,"diamond":MSO_SHAPE.DIAMOND}
-                st=shapes_map.get(op["add_shape"],MSO_SHAPE.RECTANGLE)
-                sh=sl.shapes.add_shape(st,Inches(op.get("left",1)),Inches(op.get("top",1)),
-                    Inches(op.get("width",3)),Inches(op.get("height",2)))
-                if op.get("fill"):
-                    sh.fill.solid()
-                    sh.fill.fore_color.rgb=RGBColor.from_string(op["fill"])
-        prs.save(p)
-        return J(path=p)
+        with _doc_open(p,handle) as prs:
+            for op in json.loads(ops):
+                si=op["slide"]-1
+                sl=prs.slides[si]
+                if op.get("delete"):
+                    rId=prs.slides._sldIdLst[si].rId
+                    prs.part.drop_rel(rId)
+                    del prs.slides._sldIdLst[si]
+                elif "text" in op:
+                    ph=sl.placeholders[op.get("placeholder",0)]
+                    ph.text=op["text"]
+                    if op.get("font_size") or op.get("bold") or op.get("font_color"):
+                        for para in ph.text_frame.paragraphs:
+                            for run in para.runs:
+                                if op.get("font_size"):
+                                    run.font.size=Pt(op["font_size"])
+                                if op.get("bold"):
+                                    run.font.bold=True
+                                if op.get("font_color"):
+                                    run.font.color.rgb=RGBColor.from_string(op["font_color"])
+                elif "add_image" in op:
+                    kw={"width":Inches(op.get("width",5))}
+                    if op.get("height"):
+                        kw["height"]=Inches(op["height"])
+                    sl.shapes.add_picture(str(R(op["add_image"])),
+                        Inches(op.get("left",1)),Inches(op.get("top",1)),**kw)
+                elif "add_textbox" in op:
+                    from pptx.util import Inches as In
+                    txBox=sl.shapes.add_textbox(In(op.get("left",1)),In(op.get("top",1)),
+                        In(op.get("width",4)),In(op.get("height",1)))
+                    tf=txBox.text_frame
+                    tf.text=op["add_textbox"]
+                    if op.get("font_size"):
+                        for r in tf.paragraphs[0].runs:
+                            r.font.size=Pt(op["font_size"])
+                elif "add_shape" in op:
+                    shapes_map={"rect":MSO_SHAPE.RECTANGLE,"oval":MSO_SHAPE.OVAL,
+                               "triangle":MSO_SHAPE.ISOSCELES_TRIANGLE,"arrow":MSO_SHAPE.RIGHT_ARROW,
+                               "star":MSO_SHAPE.STAR_5_POINT,"diamond":MSO_SHAPE.DIAMOND}
+                    st=shapes_map.get(op["add_shape"],MSO_SHAPE.RECTANGLE)
+                    sh=sl.shapes.add_shape(st,Inches(op.get("left",1)),Inches(op.get("top",1)),
+                        Inches(op.get("width",3)),Inches(op.get("height",2)))
+                    if op.get("fill"):
+                        sh.fill.solid()
+                        sh.fill.fore_color.rgb=RGBColor.from_string(op["fill"])
+            if not handle:
+                prs.save(p)
+        return J(path=p,saved=not handle)
     except Exception as e:
         return J(False,err=str(e))
 # --- DOCX SUBSYSTEM: Document generation and replacement ---
 @mcp.tool(name="docx_create")
-async def docx_create(path:str,content:str="[]",template:str="",
+@_offload("io")
+def docx_create(path:str,content:str="[]",template:str="",
                       preset:str="")->str:
     """创建Word文档
     content: JSON数组,每个元素是以下类型之一:
@@ -360,7 +1031,8 @@ async def docx_create(path:str,content:str="[]",template:str="",
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="docx_read")
-async def docx_read(path:str)->str:
+@_offload("io")
+def docx_read(path:str)->str:
     """读取Word文档全部内容(段落+表格+图片数)"""
     from docx import Document
     try:
@@ -374,58 +1046,357 @@ async def docx_read(path:str)->str:
                  sections=len(doc.sections),total_paras=len(doc.paragraphs))
     except Exception as e:
         return J(False,err=str(e))
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+def _docx_stories(doc: Any) -> list:
+    """Root elements of every text story: body plus each section's own headers and footers."""
+    roots = [doc.element.body]
+    for sec in doc.sections:
+        for hf in (sec.header, sec.first_page_header, sec.even_page_header,
+                   sec.footer, sec.first_page_footer, sec.even_page_footer):
+            if not hf.is_linked_to_previous:
+                roots.append(hf._element)
+    return roots
+def _docx_replace_all(doc: Any, reps: Dict[str, str]) -> Dict[str, int]:
+    """Replace every key of `reps` in a python-docx Document (body, headers, footers)."""
+    return _docx_replace_xml(_docx_stories(doc), reps)
+def _docx_replace_xml(roots: Sequence[Any], reps: Dict[str, str]) -> Dict[str, int]:
+    """Replace every key of `reps` under the WordprocessingML `roots` in one scan per paragraph.
+
+    Keys are compiled into a single longest-first alternation and matched against the
+    paragraph's concatenated w:t text, so placeholders Word split over several runs are
+    found. Each match's replacement goes into the run where it starts (keeping that run's
+    formatting) and the matched remainder is cut from the following runs. Paragraphs in
+    nested tables, text boxes, headers and footers are all reached by walking every w:p."""
+    from docx.oxml.ns import qn
+    counts = dict.fromkeys(reps, 0)
+    keys = sorted((k for k in reps if k), key=len, reverse=True)
+    if not keys:
+        return counts
+    pat = re.compile("|".join(map(re.escape, keys)))
+    W_P, W_R, W_T, SPACE = qn("w:p"), qn("w:r"), qn("w:t"), qn("xml:space")
+    for root in roots:
+        for p in root.iter(W_P):
+            # Text of this paragraph only: skip runs of paragraphs nested inside it (text boxes).
+            ts = [t for r in p.iter(W_R) if next(r.iterancestors(W_P)) is p for t in r.iter(W_T)]
+            text = "".join(t.text or "" for t in ts)
+            hits = list(pat.finditer(text))
+            if not hits:
+                continue
+            # Word keeps a legacy copy of text boxes under mc:Fallback; rewrite it but count once.
+            if not any(a.tag == _MC_FALLBACK for a in p.iterancestors()):
+                for m in hits:
+                    counts[m.group(0)] += 1
+            # Splice right to left: a match only edits text at or after its own start, so the
+            # original offsets of everything before it stay valid.
+            lens = [len(t.text or "") for t in ts]
+            starts = [sum(lens[:i]) for i in range(len(ts))]
+            for m in reversed(hits):
+                s, e = m.span()
+                first = True
+                for t, a, n in zip(ts, starts, lens):
+                    if a >= e:
+                        break
+                    if not n or a + n <= s:
+                        continue
+                    cur = t.text
+                    t.text = cur[:max(s - a, 0)] + (reps[m.group(0)] if first else "") + cur[min(e - a, n):]
+                    t.set(SPACE, "preserve")
+                    first = False
+    return counts
 @mcp.tool(name="docx_replace")
-async def docx_replace(path:str,replacements:str="{}",output:str="")->str:
-    """Word文档查找替换
+@_offload("io")
+def docx_replace(path:str,replacements:str="{}",output:str="",handle:str="")->str:
+    """Word文档查找替换: 所有键合并为一个匹配器, 每个段落只扫描一次
     replacements: JSON对象 {"旧文本":"新文本","{{name}}":"张三"}
-    output: 输出路径,空则覆盖原文件"""
-    from docx import Document
+    output: 输出路径,空则覆盖原文件
+    handle: doc_session打开的会话句柄; 提供时在内存中的文档上修改, 不写盘, 由doc_session commit或空闲超时统一保存;
+      同时给出output时, 在会话当前内容的副本上替换并写入output, 会话本身不变
+    覆盖正文、嵌套表格、文本框、页眉页脚; 被Word拆分到多个run中的占位符也能匹配(替换文本沿用首个run的格式)
+    返回 replaced 总替换次数, counts 每个键的命中次数, missing 未命中的键"""
     try:
         p=str(R(path))
-        doc=Document(p)
-        reps=json.loads(replacements) if isinstance(replacements,str) else replacements
-        for para in doc.paragraphs:
-            for old,new in reps.items():
-                if old in para.text:
-                    for run in para.runs:
-                        if old in run.text:
-                            run.text=run.text.replace(old,new)
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        for old,new in reps.items():
-                            if old in para.text:
-                                for run in para.runs:
-                                    if old in run.text:
-                                        run.text=run.text.replace(old,new)
-        op=str(R(output)) if output else p
-        doc.save(op)
-        return J(path=op,replaced=len(reps))
+        with _doc_open(p,handle,detach=bool(output)) as doc:
+            reps=json.loads(replacements) if isinstance(replacements,str) else replacements
+            counts=_docx_replace_all(doc,{k:str(v) for k,v in reps.items()})
+            op=str(R(output)) if output else p
+            if output or not handle:
+                doc.save(op)
+        return J(path=op,replaced=sum(counts.values()),counts=counts,
+                 missing=[k for k,n in counts.items() if not n],saved=bool(output or not handle))
+    except Exception as e:
+        return J(False,err=str(e))
+_DOCX_STORY = re.compile(r"word/(document|header\d*|footer\d*)\.xml")
+@functools.lru_cache(maxsize=4)
+def _docx_template(path: str, stamp: tuple) -> tuple:
+    """(zip entries, parsed story parts) of a .docx template, cached per worker and file version."""
+    from lxml import etree
+    with zipfile.ZipFile(path) as z:
+        entries = [(info, z.read(info)) for info in z.infolist()]
+    stories = {info.filename: etree.fromstring(data) for info, data in entries
+               if _DOCX_STORY.fullmatch(info.filename)}
+    return entries, stories
+def _docx_records(src: Any):
+    """Yield merge records: an inline list, or dicts streamed from a CSV / JSONL file."""
+    if not isinstance(src, str):
+        yield from src
+        return
+    if src.lstrip().startswith("["):
+        yield from json.loads(src)
+        return
+    p = R(src)
+    with open(p, newline="", encoding="utf-8-sig") as f:
+        if p.suffix.lower() in (".jsonl", ".ndjson"):
+            yield from (json.loads(line) for line in f if line.strip())
+        else:
+            yield from csv.DictReader(f)
+_NAME_UNSAFE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+def _docx_merge_name(name: str, rec: dict, i: int, od: Path) -> Path:
+    """Render the output path of merge record `i`; field values cannot add path components
+    and the result must stay under `od`."""
+    safe = {k: v if isinstance(v, (int, float)) else _NAME_UNSAFE.sub("_", "" if v is None else str(v)).strip(" .") or "_"
+            for k, v in rec.items()}
+    p = (od / name.format_map({**safe, "n": i + 1, "i": i})).resolve()
+    if not p.is_relative_to(od.resolve()):
+        raise ValueError(f"output name escapes output_dir: {p}")
+    return p
+def _docx_merge_shard(template: str, jobs: Sequence[Tuple[int, dict, str]], placeholder: str,
+                      text_pdf: bool) -> list:
+    """Render mail-merge `jobs` (pool worker): clone the parsed template parts per record,
+    fill them, and write a new package reusing every untouched zip entry's bytes."""
+    from lxml import etree
+    st = os.stat(template)
+    entries, stories = _docx_template(template, (st.st_mtime_ns, st.st_size))
+    out = []
+    for i, rec, op in jobs:
+        try:
+            reps = {placeholder.replace("key", str(k)): "" if v is None else str(v) for k, v in rec.items()}
+            parts = {name: copy.deepcopy(root) for name, root in stories.items()}
+            counts = _docx_replace_xml(list(parts.values()), reps)
+            with zipfile.ZipFile(op, "w", zipfile.ZIP_DEFLATED) as z:
+                for info, data in entries:
+                    root = parts.get(info.filename)
+                    z.writestr(info, data if root is None else
+                               etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True))
+            item = {"i": i, "path": op, "replaced": sum(counts.values())}
+            if text_pdf:
+                # Text-only PDF through pdf_create: one paragraph per body w:p.
+                from docx.oxml.ns import qn
+                body = parts["word/document.xml"]
+                paras = ["".join(t.text or "" for t in p.iter(qn("w:t"))) for p in body.iter(qn("w:p"))]
+                pp = str(Path(op).with_suffix(".pdf"))
+                content = [{"type": "text", "text": t} if t else {"type": "spacer", "h": 8} for t in paras]
+                r = json.loads(inspect.unwrap(pdf_create)(path=pp, content=json.dumps(content)))
+                if r["ok"]:
+                    item["pdf"] = pp
+                else:
+                    item["pdf_err"] = r["err"]
+            out.append(item)
+        except Exception as e:
+            out.append({"i": i, "err": str(e)})
+    return out
+@mcp.tool(name="docx_merge_batch")
+async def docx_merge_batch(template:str,records:str="[]",output_dir:str="",name:str="merge_{n}.docx",
+                           placeholder:str="{{key}}",pdf:str="",workers:int=0,ctx:Context=None)->str:
+    """批量邮件合并: 一个docx模板 + N条记录 → N个文档, 模板只解析一次, 多进程并行写出
+    records: JSON数组 [{"name":"张三","amount":100},...] 或 CSV/JSONL文件路径(CSV首行为字段名)
+    name: 输出文件名模板, 可用 {n}(从1开始的序号) 与记录字段, 如 "contract_{n}_{name}.docx"
+    placeholder: 占位符格式, key替换为字段名, 默认 {{key}} 即字段name对应模板中的 {{name}}
+    pdf: 同时输出PDF: ""=不输出 | soffice=LibreOffice转换(保留版式) | text=经pdf_create生成纯文本PDF
+    workers: 并行进程数, 0=OMNI_CPU_WORKERS
+    进度通过MCP进度通知推送, 失败记录以日志消息推送; 单条失败不影响其余记录
+    文件名中的字段值会去掉路径分隔符等非法字符, 结果必须位于output_dir内; 重名时依次追加 _2, _3...
+    返回 files, errors: [{"i":0,"err":"..."}]"""
+    try:
+        tp=str(R(template))
+        od=R(output_dir) if output_dir else WD
+        od.mkdir(parents=True,exist_ok=True)
+        jobs,bad,seen=[],[],set()
+        for i,rec in enumerate(_docx_records(records)):
+            try:
+                op=base=_docx_merge_name(name,rec,i,od)
+                k=2
+                while os.path.normcase(str(op)) in seen:
+                    op=base.with_name(f"{base.stem}_{k}{base.suffix}")
+                    k+=1
+                seen.add(os.path.normcase(str(op)))
+                op.parent.mkdir(parents=True,exist_ok=True)
+                jobs.append((i,rec,str(op)))
+            except Exception as e:
+                bad.append({"i":i,"err":f"name: missing field {e}" if isinstance(e,KeyError) else f"name: {e}"})
+        if not jobs and not bad:
+            return J(False,err="records为空")
+        n=max(1,min(workers or CPU_WORKERS,len(jobs)))
+        # 小分片让进度更平滑, 每片内模板只在各进程首次使用时解析
+        size=max(1,min(50,len(jobs)//(n*4) or 1))
+        shards=[jobs[j:j+size] for j in range(0,len(jobs),size)]
+        t0=time.perf_counter()
+        total=len(jobs)+len(bad)
+        res,done=list(bad),len(bad)
+        if bad:
+            await _notify(ctx,done,total,[f"record {r['i']}: {r['err']}" for r in bad])
+        async def collect(part):
+            nonlocal done
+            res.extend(part)
+            done+=len(part)
+            await _notify(ctx,done,total,[f"record {r['i']}: {r['err']}" for r in part if "err" in r])
+        await _map_pool("cpu",_docx_merge_shard,[(tp,sh,placeholder,pdf=="text") for sh in shards],collect)
+        res.sort(key=lambda r:r["i"])
+        files=[r["path"] for r in res if "path" in r]
+        pdfs=[r["pdf"] for r in res if "pdf" in r]
+        errors=[{"i":r["i"],"err":r.get("err") or r.get("pdf_err")} for r in res if "err" in r or "pdf_err" in r]
+        if pdf=="soffice" and files:
+            # 一次soffice调用转换一批文件, 避免每个文件重复启动LibreOffice
+            for j in range(0,len(files),200):
+                batch=files[j:j+200]
+                try:
+                    o,e,c=await _run([SOFFICE,"--headless","--convert-to","pdf","--outdir",str(od),*batch],timeout=600)
+                    why=f"soffice failed (code {c}): {e[-300:]}"
+                except (OSError,subprocess.TimeoutExpired) as ex:
+                    why=f"soffice failed: {ex}"
+                for f in batch:
+                    pp=str(Path(f).with_suffix(".pdf"))
+                    if os.path.isfile(pp):
+                        pdfs.append(pp)
+                    else:
+                        errors.append({"path":f,"err":why})
+        return J(not errors,files=files,pdfs=pdfs,count=len(files),failed=len(errors),errors=errors,
+                 time_s=round(time.perf_counter()-t0,3))
+    except BrokenProcessPool as e:
+        return J(False,err=f"worker crashed: {e}")
     except Exception as e:
         return J(False,err=str(e))
 # --- XLSX SUBSYSTEM: Workbook operations and charting ---
+_CSV_NUM = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?")
+def _csv_value(v: str) -> Any:
+    """Numeric CSV text to int/float; leading zeros and over-long IDs stay text."""
+    if not _CSV_NUM.fullmatch(v) or len(v) > 15:
+        return v
+    return int(v) if v.lstrip("-").isdigit() else float(v)
+def _xlsx_rows(s: dict):
+    """Yield a sheet spec's rows: inline `data` first, then rows streamed from `source`.
+
+    `source` is a CSV file, or JSONL (.jsonl/.ndjson) whose lines are arrays or objects;
+    for objects the first record's keys become the header row and the column order."""
+    yield from s.get("data", [])
+    if not s.get("source"):
+        return
+    src = R(s["source"])
+    with open(src, newline="", encoding=s.get("encoding", "utf-8-sig")) as f:
+        if src.suffix.lower() in (".jsonl", ".ndjson"):
+            keys = None
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                if isinstance(rec, dict):
+                    if keys is None:
+                        keys = list(rec)
+                        if s.get("header", True):
+                            yield keys
+                    yield [rec.get(k) for k in keys]
+                else:
+                    yield rec
+        else:
+            infer = s.get("infer_types", True)
+            for row in csv.reader(f, delimiter=s.get("delimiter", ",")):
+                yield [_csv_value(v) for v in row] if infer else row
+def _xlsx_style(st: dict) -> tuple:
+    """(Font, PatternFill or None) for one xlsx_create `styles` entry."""
+    from openpyxl.styles import Font, PatternFill
+    font = Font(bold=st.get("bold", False), color=st.get("font_color", "000000"),
+                size=st.get("font_size", 11))
+    fill = PatternFill(start_color=st["bg"], end_color=st["bg"], fill_type="solid") if st.get("bg") else None
+    return font, fill
+def _xlsx_bulk_sheet(wb: Any, s: dict) -> int:
+    """Stream one sheet spec into a write-only workbook; returns the number of rows written.
+
+    Layout (widths, freeze) is set before the first row, styled and merge-anchor cells are
+    emitted as WriteOnlyCell while their row streams past, the rest is plain values. Like
+    the in-memory path, whole-column/row style ranges ("A:A", "1:1") are unbounded, bounded
+    style ranges also style their empty cells, and rows holding only merge values or
+    styled cells below the data are appended after it."""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter, range_boundaries
+    inf = float("inf")
+    ws = wb.create_sheet(s.get("name", "Sheet"))
+    for i, w in enumerate(s.get("widths", []), 1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+    if s.get("freeze"):
+        ws.freeze_panes = s["freeze"]
+    styles = []
+    for st in s.get("styles", []):
+        mc, mr, xc, xr = range_boundaries(st["range"])
+        styles.append(((mc or 1, mr or 1, xc or inf, xr or inf), _xlsx_style(st)))
+    anchors = {}
+    for m in s.get("merge", []):
+        ws.merged_cells.add(m["range"])
+        if m.get("value"):
+            mc, mr, _, _ = range_boundaries(m["range"])
+            anchors.setdefault(mr or 1, {})[mc or 1] = m["value"]
+    last = max([*anchors, *(b[0][3] for b in styles if b[0][3] != inf)], default=0)
+    data = [0, 0]  # rows, widest row of the data itself (the auto_filter extent)
+    def rows():
+        for row in _xlsx_rows(s):
+            data[0] += 1
+            data[1] = max(data[1], len(row))
+            yield row
+        yield from ([] for _ in range(data[0], last))
+    n = 0
+    for n, row in enumerate(rows(), 1):
+        live = [b for b in styles if b[0][1] <= n <= b[0][3]]
+        if live or n in anchors:
+            cells = list(row)
+            pad = max([c for c in anchors.get(n, {})] + [b[0][2] for b in live if b[0][2] != inf], default=0)
+            cells.extend([None] * (pad - len(cells)))
+            for c, v in anchors.get(n, {}).items():
+                cells[c - 1] = v
+            row = []
+            for c, v in enumerate(cells, 1):
+                hit = [sty for (mc, mr, xc, xr), sty in live if mc <= c <= xc]
+                if not hit:
+                    row.append(v)
+                    continue
+                cell = WriteOnlyCell(ws, value=v)
+                cell.font, fill = hit[-1]
+                if fill:
+                    cell.fill = fill
+                row.append(cell)
+        ws.append(row)
+    if s.get("auto_filter") and data[0]:
+        ws.auto_filter.ref = f"A1:{get_column_letter(max(data[1], 1))}{data[0]}"
+    return n
 @mcp.tool(name="xlsx_create")
-async def xlsx_create(path:str,sheets:str='[{"name":"Sheet1","data":[]}]')->str:
+@_offload("io")
+def xlsx_create(path:str,sheets:str='[{"name":"Sheet1","data":[]}]',bulk:bool=False)->str:
     """创建Excel工作簿
     sheets: JSON数组(注意是数组!), 每个元素代表一个工作表:
     [{
       "name": "Sheet1",
       "data": [["表头A","表头B"],["数据1","数据2"]],  ← 二维数组,第一行通常是表头
+      "source": "telemetry.csv",  ← 可选,从CSV或JSONL(.jsonl)文件流式读取行,追加在data之后
       "widths": [15,20],        ← 可选,各列宽度
       "freeze": "A2",           ← 可选,冻结窗格
       "auto_filter": true,      ← 可选,自动筛选
       "merge": [{"range":"A1:C1","value":"合并标题"}],  ← 可选
       "styles": [{"range":"A1:D1","bold":true,"bg":"FFFF00","font_color":"000000","font_size":11}]  ← 可选
     }]
+    source可选项: "delimiter":","  "encoding":"utf-8-sig"  "infer_types":true(CSV数字文本转为数值)
+      "header":true(JSONL为对象时以首条记录的键作表头)
+    bulk: 大数据量模式,使用只写工作表逐行写盘,内存占用不随行数增长;含source的表自动启用
     ⚠ 常见错误: 不要用 headers+rows, 所有数据统一放在 data 二维数组中"""
     from openpyxl import Workbook
     from openpyxl.utils import get_column_letter
-    from openpyxl.styles import Font,PatternFill,Alignment
     try:
+        specs=json.loads(sheets)
+        p=str(R(path))
+        if bulk or any(s.get("source") for s in specs):
+            wb=Workbook(write_only=True)
+            rows={s.get("name","Sheet"):_xlsx_bulk_sheet(wb,s) for s in specs}
+            wb.save(p)
+            return J(path=p,rows=rows)
         wb=Workbook()
         wb.remove(wb.active)
-        for s in json.loads(sheets):
+        for s in specs:
             ws=wb.create_sheet(s.get("name","Sheet"))
             for row in s.get("data",[]):
                 ws.append(row)
@@ -440,107 +1411,175 @@ async def xlsx_create(path:str,sheets:str='[{"name":"Sheet1","data":[]}]')->str:
                 if m.get("value"):
                     ws[m["range"].split(":")[0]]=m["value"]
             for st in s.get("styles",[]):
-                font=Font(bold=st.get("bold",False),
-                         color=st.get("font_color","000000"),
-                         size=st.get("font_size",11))
-                fill=PatternFill(start_color=st.get("bg","FFFFFF"),
-                                end_color=st.get("bg","FFFFFF"),
-                                fill_type="solid") if st.get("bg") else None
+                font,fill=_xlsx_style(st)
                 for row in ws[st["range"]]:
                     for cell in (row if isinstance(row,tuple) else [row]):
                         cell.font=font
                         if fill:
                             cell.fill=fill
-        p=str(R(path))
         wb.save(p)
         return J(path=p)
     except Exception as e:
         return J(False,err=str(e))
+def _xlsx_columns(spec: str) -> list:
+    """Parse a column projection like "A,C:E,7" into sorted 1-based column indexes."""
+    from openpyxl.utils import column_index_from_string
+    def idx(x: str) -> int:
+        x = x.strip()
+        return int(x) if x.isdigit() else column_index_from_string(x.upper())
+    cols: set = set()
+    for part in spec.split(","):
+        if ":" in part:
+            a, b = part.split(":", 1)
+            cols.update(range(idx(a), idx(b) + 1))
+        elif part.strip():
+            cols.add(idx(part))
+    return sorted(cols)
 @mcp.tool(name="xlsx_read")
-async def xlsx_read(path:str,sheet:str="",cell_range:str="")->str:
-    """读取Excel。sheet空=第一个。cell_range如'A1:C10'"""
+@_offload("io")
+def xlsx_read(path:str,sheet:str="",cell_range:str="",offset:int=0,limit:int=0,
+              columns:str="",max_cells:int=0)->str:
+    """读取Excel(只读流式模式, 仅解析返回的行)。sheet空=第一个。cell_range如'A1:C10'
+    offset/limit: 行分页, 跳过前offset行后最多返回limit行, limit=0=读到末尾; 返回next_offset, null=已读完
+    columns: 列投影(工作表列号), 如 'A,C:E' 或 '1,3', 空=全部列; 返回col_index为各列列号
+    max_cells: 单次最多返回的单元格数, 超出时在整行边界截断并返回 truncated:true
+    rows: 区域内总行数; 已读到末尾时为实际行数, 否则为估计值(取自工作表尺寸记录, 不逐行统计)"""
     from openpyxl import load_workbook
+    from openpyxl.utils import range_boundaries
     try:
-        wb=load_workbook(str(R(path)),data_only=True)
-        ws=wb[sheet] if sheet else wb.active
-        if cell_range:
-            data=[[c.value for c in row] for row in ws[cell_range]]
-        else:
-            data=[[c.value for c in row] for row in ws.iter_rows()]
-        return J(sheet=ws.title,data=data,rows=len(data),
-                 cols=ws.max_column,sheets=wb.sheetnames)
+        wb=load_workbook(str(R(path)),read_only=True,data_only=True)
+        try:
+            ws=wb[sheet] if sheet else wb.active
+            dim_r,dim_c=ws.max_row,ws.max_column
+            mc,mr,xc,xr=range_boundaries(cell_range) if cell_range else (1,1,None,None)
+            mc,mr=mc or 1,mr or 1
+            # 尺寸记录(<dimension>)可能不准确, 开放的边界不依赖它, 一直读到实际数据末尾
+            open_c=xc is None
+            if xr is None or open_c:
+                ws.reset_dimensions()
+            proj=[c for c in _xlsx_columns(columns) if mc<=c and (xc is None or c<=xc)] if columns else None
+            if columns and not proj:
+                return J(False,err=f"columns不在读取区域内: {columns}")
+            if proj:
+                mc,xc=proj[0],proj[-1]
+                pick=[c-mc for c in proj]
+            start=mr+offset
+            # 多读一行以判断后面是否还有数据
+            stop=start+limit if limit else xr
+            if xr and stop:
+                stop=min(stop,xr)
+            data=[]
+            cells=0
+            truncated=more=False
+            for row in ws.iter_rows(min_row=start,max_row=stop,min_col=mc,max_col=xc,values_only=True):
+                if limit and len(data)==limit:
+                    more=True
+                    break
+                if proj:
+                    row=[row[i] if i<len(row) else None for i in pick]
+                if max_cells and data and cells+len(row)>max_cells:
+                    truncated=more=True
+                    break
+                data.append(list(row))
+                cells+=len(row)
+            width=max((len(r) for r in data),default=0)
+            if open_c and not proj:
+                data=[r+[None]*(width-len(r)) for r in data]
+            end=offset+len(data)
+            if xr:
+                total=xr-mr+1
+            elif more:
+                total=max((dim_r or 0)-mr+1,end+1)
+            else:
+                total=end
+            res=dict(sheet=ws.title,data=data,rows=total,returned=len(data),
+                     cols=max(dim_c or 0,mc-1+width) if open_c and not proj else dim_c,sheets=wb.sheetnames,
+                     next_offset=end if more else None)
+            if proj:
+                res["col_index"]=proj
+            if truncated:
+                res["truncated"]=True
+            return J(**res)
+        finally:
+            wb.close()
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="xlsx_write")
-async def xlsx_write(path:str,sheet:str="",writes:str="[]")->str:
+@_offload("io")
+def xlsx_write(path:str,sheet:str="",writes:str="[]",handle:str="")->str:
     """写入Excel单元格
     writes: JSON数组:
       {"cell":"A1","value":"hello"}
       {"cell":"A1","formula":"=SUM(B1:B10)"}
       {"row":1,"col":1,"value":42}
-      {"range":"A1:A10","values":[1,2,3,4,5,6,7,8,9,10]}"""
-    from openpyxl import load_workbook
+      {"range":"A1:A10","values":[1,2,3,4,5,6,7,8,9,10]}
+    handle: doc_session打开的会话句柄; 提供时在内存中的文档上修改, 不写盘, 由doc_session commit或空闲超时统一保存"""
     try:
         p=str(R(path))
-        wb=load_workbook(p)
-        ws=wb[sheet] if sheet else wb.active
-        for w in json.loads(writes):
-            if "formula" in w:
-                ws[w["cell"]]=w["formula"]
-            elif "range" in w and "values" in w:
-                from openpyxl.utils import range_boundaries
-                mc,mr,xc,xr=range_boundaries(w["range"])
-                vals=w["values"]
-                idx=0
-                for r in range(mr,xr+1):
-                    for c in range(mc,xc+1):
-                        if idx<len(vals):
-                            ws.cell(row=r,column=c,value=vals[idx])
-                            idx+=1
-            elif "cell" in w:
-                ws[w["cell"]]=w["value"]
-            else:
-                ws.cell(row=w["row"],column=w["col"],value=w["value"])
-        wb.save(p)
-        return J(path=p)
+        with _doc_open(p,handle) as wb:
+            ws=wb[sheet] if sheet else wb.active
+            for w in json.loads(writes):
+                if "formula" in w:
+                    ws[w["cell"]]=w["formula"]
+                elif "range" in w and "values" in w:
+                    from openpyxl.utils import range_boundaries
+                    mc,mr,xc,xr=range_boundaries(w["range"])
+                    vals=w["values"]
+                    idx=0
+                    for r in range(mr,xr+1):
+                        for c in range(mc,xc+1):
+                            if idx<len(vals):
+                                ws.cell(row=r,column=c,value=vals[idx])
+                                idx+=1
+                elif "cell" in w:
+                    ws[w["cell"]]=w["value"]
+                else:
+                    ws.cell(row=w["row"],column=w["col"],value=w["value"])
+            if not handle:
+                wb.save(p)
+        return J(path=p,saved=not handle)
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="xlsx_chart")
-async def xlsx_chart(path:str,sheet:str="",chart_config:str="{}")->str:
+@_offload("io")
+def xlsx_chart(path:str,sheet:str="",chart_config:str="{}",handle:str="")->str:
     """在Excel中插入图表
     chart_config: {"type":"bar"|"line"|"pie"|"scatter"|"area",
       "title":"图表标题","data_range":"A1:B10","categories_range":"A1:A10",
-      "position":"D1","width":15,"height":10}"""
-    from openpyxl import load_workbook
+      "position":"D1","width":15,"height":10}
+    handle: doc_session打开的会话句柄; 提供时在内存中的文档上修改, 不写盘, 由doc_session commit或空闲超时统一保存"""
     from openpyxl.chart import BarChart,LineChart,PieChart,ScatterChart,AreaChart,Reference
     try:
         p=str(R(path))
-        wb=load_workbook(p)
-        ws=wb[sheet] if sheet else wb.active
-        cfg=json.loads(chart_config) if isinstance(chart_config,str) else chart_config
-        ct=cfg.get("type","bar")
-        charts={"bar":BarChart,"line":LineChart,"pie":PieChart,"scatter":ScatterChart,"area":AreaChart}
-        chart=charts.get(ct,BarChart)()
-        chart.title=cfg.get("title","")
-        chart.width=cfg.get("width",15)
-        chart.height=cfg.get("height",10)
-        dr=cfg.get("data_range","B1:B10")
-        from openpyxl.utils import range_boundaries
-        mc,mr,xc,xr=range_boundaries(dr)
-        data=Reference(ws,min_col=mc,min_row=mr,max_col=xc,max_row=xr)
-        chart.add_data(data,titles_from_data=True)
-        if cfg.get("categories_range"):
-            cc,cr,xcc,xcr=range_boundaries(cfg["categories_range"])
-            cats=Reference(ws,min_col=cc,min_row=cr,max_col=xcc,max_row=xcr)
-            chart.set_categories(cats)
-        ws.add_chart(chart,cfg.get("position","D1"))
-        wb.save(p)
-        return J(path=p)
+        with _doc_open(p,handle) as wb:
+            ws=wb[sheet] if sheet else wb.active
+            cfg=json.loads(chart_config) if isinstance(chart_config,str) else chart_config
+            ct=cfg.get("type","bar")
+            charts={"bar":BarChart,"line":LineChart,"pie":PieChart,"scatter":ScatterChart,"area":AreaChart}
+            chart=charts.get(ct,BarChart)()
+            chart.title=cfg.get("title","")
+            chart.width=cfg.get("width",15)
+            chart.height=cfg.get("height",10)
+            dr=cfg.get("data_range","B1:B10")
+            from openpyxl.utils import range_boundaries
+            mc,mr,xc,xr=range_boundaries(dr)
+            data=Reference(ws,min_col=mc,min_row=mr,max_col=xc,max_row=xr)
+            chart.add_data(data,titles_from_data=True)
+            if cfg.get("categories_range"):
+                cc,cr,xcc,xcr=range_boundaries(cfg["categories_range"])
+                cats=Reference(ws,min_col=cc,min_row=cr,max_col=xcc,max_row=xcr)
+                chart.set_categories(cats)
+            ws.add_chart(chart,cfg.get("position","D1"))
+            if not handle:
+                wb.save(p)
+        return J(path=p,saved=not handle)
     except Exception as e:
         return J(False,err=str(e))
 # --- PDF SUBSYSTEM: Generation, parsing, and post-processing ---
 @mcp.tool(name="pdf_create")
-async def pdf_create(path:str,content:str="[]",page_size:str="A4")->str:
+@_cached()
+@_offload("cpu")
+def pdf_create(path:str,content:str="[]",page_size:str="A4")->str:
     """创建PDF
     content: JSON数组:
       {"type":"title","text":"","size":24}
@@ -549,7 +1588,8 @@ async def pdf_create(path:str,content:str="[]",page_size:str="A4")->str:
       {"type":"table","data":[["a","b"],["c","d"]],"col_widths":[200,200]}
       {"type":"spacer","h":20}
       {"type":"line","x1":50,"y1":0,"x2":550,"y2":0,"color":"#000000","width":1}
-      {"type":"break"}"""
+      {"type":"break"}
+    cache: true=参数与输入文件相同时直接复制缓存产物,跳过重新生成(统计/清理见render_cache)"""
     from reportlab.lib.pagesizes import A4,letter
     from reportlab.platypus import SimpleDocTemplate,Paragraph,Spacer,Image,Table,TableStyle,PageBreak
     from reportlab.lib.styles import getSampleStyleSheet,ParagraphStyle
@@ -659,115 +1699,517 @@ async def pdf_create(path:str,content:str="[]",page_size:str="A4")->str:
         return J(path=p)
     except Exception as e:
         return J(False,err=str(e))
+def _page_spec(spec: str, total: int) -> Sequence[int]:
+    """Parse a 0-based page selection like "0,3,10-50,90-" (empty = every page).
+
+    Ranges are inclusive, an open range runs to the last page, and pages past the
+    end of the document are dropped."""
+    if not spec.strip():
+        return range(total)
+    out: list = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            a, b = part.split("-", 1)
+            out.extend(range(int(a), min(int(b) + 1 if b.strip() else total, total)))
+        elif int(part) < total:
+            out.append(int(part))
+    return out
+def _pdf_text_pages(doc: Any, pages: Sequence[int], max_chars: int = 0):
+    """Yield {"page", "text"} for `pages` only, loading and decoding one page at a time."""
+    for i in pages:
+        text = doc.load_page(i).get_text()
+        item = {"page": i, "text": text}
+        if max_chars and len(text) > max_chars:
+            item.update(text=text[:max_chars], chars=len(text), truncated=True)
+        yield item
 @mcp.tool(name="pdf_read")
-async def pdf_read(path:str,pages:str="")->str:
-    """读取PDF文本。pages如'0,1,2'(从0开始),空=全部"""
+@_offload("io")
+def pdf_read(path:str,pages:str="",cursor:int=0,limit:int=0,max_chars:int=0)->str:
+    """读取PDF文本(只解析所选页)
+    pages: 页码(从0开始), 如 '0,1,2' 或 '10-50' 或 '90-'(到末页), 空=全部
+    cursor/limit: 在所选页中分页, 从第cursor个开始取limit页, limit=0=取到末尾;
+      返回next_cursor, 为null表示已读完
+    max_chars: 每页最多返回字符数, 0=不限; 被截断的页带 truncated:true 与原始字符数chars"""
     import fitz
     try:
-        doc=fitz.open(str(R(path)))
-        total=len(doc)
-        ps=[int(x) for x in pages.split(",") if x.strip()] if pages else list(range(total))
-        out=[{"page":i,"text":doc[i].get_text()} for i in ps if i<total]
-        doc.close()
-        return J(pages=out,total=total)
+        with fitz.open(str(R(path))) as doc:
+            total=doc.page_count
+            sel=_page_spec(pages,total)
+            end=min(cursor+limit,len(sel)) if limit else len(sel)
+            out=list(_pdf_text_pages(doc,sel[cursor:end],max_chars))
+        return J(pages=out,total=total,selected=len(sel),next_cursor=end if end<len(sel) else None)
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="pdf_merge")
-async def pdf_merge(files:str="[]",output:str="merged.pdf")->str:
-    """合并多个PDF"""
+@_offload("io")
+def pdf_merge(files:str="[]",output:str="merged.pdf",batch:int=0,garbage:int=1,deflate:bool=True)->str:
+    """合并多个PDF, 源文件逐个打开、插入后立即关闭
+    batch: 流式模式, 每合并batch个源文件即写盘(首次完整保存, 之后增量追加)并释放内存中的页面,
+      内存占用与batch大小而非总页数相关; 0=全部合并后一次保存
+    garbage: 保存时的垃圾回收级别0-4(流式模式仅作用于首次保存)  deflate: 压缩流
+    返回 pages 总页数 与 pages_per_s 吞吐量"""
     import fitz
     try:
         flist=json.loads(files)
         if not flist:
             return J(False,err="files数组为空")
+        p=str(R(output))
+        t0=time.perf_counter()
         out=fitz.open()
-        for f in flist:
-            fp=str(R(f))
-            src=fitz.open(fp)
-            out.insert_pdf(src)
-            src.close()
-        if len(out)==0:
+        saved=False
+        def flush():
+            nonlocal out,saved
+            if saved:
+                out.saveIncr()
+            else:
+                out.save(p,garbage=garbage,deflate=deflate)
+                saved=True
+            # 重新打开时页面按需加载, 已写盘的页面不再驻留内存
+            out.close()
+            out=fitz.open(p)
+        for n,f in enumerate(flist,1):
+            with fitz.open(str(R(f))) as src:
+                out.insert_pdf(src)
+            if batch and n%batch==0:
+                flush()
+        if out.page_count==0:
             return J(False,err="合并后文档无页面")
-        p=str(R(output))
-        out.save(p)
+        if not saved:
+            out.save(p,garbage=garbage,deflate=deflate)
+        elif len(flist)%batch:
+            out.saveIncr()
+        pages=out.page_count
         out.close()
-        return J(path=p)
+        dt=time.perf_counter()-t0
+        return J(path=p,files=len(flist),pages=pages,time_s=round(dt,3),pages_per_s=round(pages/dt,1) if dt else None)
     except Exception as e:
         return J(False,err=str(e))
+def _pdf_page_count(path: str) -> int:
+    """Page count of a PDF (opens the file; run it on a pool, not the event loop)."""
+    import fitz
+    with fitz.open(path) as doc:
+        return doc.page_count
+def _pdf_split_shard(path: str, jobs: Sequence[Tuple[int, int, str]]) -> int:
+    """Write each (first, last, out) page range of `path` to `out` from one shared source handle."""
+    import fitz
+    pages = 0
+    with fitz.open(path) as doc:
+        for first, last, op in jobs:
+            with fitz.open() as nd:
+                nd.insert_pdf(doc, from_page=first, to_page=last)
+                nd.save(op)
+                pages += nd.page_count
+    return pages
 @mcp.tool(name="pdf_split")
-async def pdf_split(path:str,page_ranges:str="",output_dir:str="")->str:
-    """拆分PDF
+async def pdf_split(path:str,page_ranges:str="",output_dir:str="",workers:int=0)->str:
+    """拆分PDF, 输出文件分片后在多个进程中并行写出(每个进程只打开一次源文件)
     page_ranges: "0-2,3-5,6-10" 按范围拆分, 空=每页一个文件
-    output_dir: 输出目录"""
-    import fitz
+    output_dir: 输出目录
+    workers: 并行进程数, 0=OMNI_CPU_WORKERS, 1=单进程顺序写出"""
     try:
-        doc=fitz.open(str(R(path)))
+        src=str(R(path))
+        total=await _submit("io",_pdf_page_count,src)
         od=Path(output_dir) if output_dir else WD
         od.mkdir(parents=True,exist_ok=True)
-        outs=[]
+        jobs=[]
         if page_ranges:
             for rng in page_ranges.split(","):
                 parts=rng.strip().split("-")
                 s,e=int(parts[0]),int(parts[-1])
-                nd=fitz.open()
-                for i in range(s,min(e+1,len(doc))):
-                    nd.insert_pdf(doc,from_page=i,to_page=i)
-                op=str(od/f"split_{s}-{e}.pdf")
-                nd.save(op)
-                nd.close()
-                outs.append(op)
+                if s<total:
+                    jobs.append((s,min(e,total-1),str(od/f"split_{s}-{e}.pdf")))
         else:
-            for i in range(len(doc)):
-                nd=fitz.open()
-                nd.insert_pdf(doc,from_page=i,to_page=i)
-                op=str(od/f"page_{i+1}.pdf")
-                nd.save(op)
-                nd.close()
-                outs.append(op)
-        doc.close()
-        return J(files=outs,count=len(outs))
+            jobs=[(i,i,str(od/f"page_{i+1}.pdf")) for i in range(total)]
+        t0=time.perf_counter()
+        n=max(1,min(workers or CPU_WORKERS,len(jobs)))
+        shards=[jobs[j*len(jobs)//n:(j+1)*len(jobs)//n] for j in range(n)]
+        pages=sum(await _map_pool("cpu",_pdf_split_shard,[(src,sh) for sh in shards]))
+        dt=time.perf_counter()-t0
+        return J(files=[j[2] for j in jobs],count=len(jobs),pages=pages,time_s=round(dt,3),
+                 pages_per_s=round(pages/dt,1) if dt else None)
+    except BrokenProcessPool as e:
+        return J(False,err=f"worker crashed: {e}")
     except Exception as e:
         return J(False,err=str(e))
+def _pdf_stamp_file(src: str, dst: str, text: str, font_size: int, color: Sequence[float],
+                    rotation: int) -> dict:
+    """Watermark one PDF (pool worker) by overlaying a shared one-page stamp on every page.
+
+    The stamp is drawn once per distinct page size; show_pdf_page grafts its content
+    into the output a single time and every page references that same form XObject."""
+    import fitz
+    t0 = time.perf_counter()
+    stamps: Dict[tuple, Any] = {}
+    tl = fitz.get_text_length(text, fontsize=font_size)
+    with fitz.open(src) as doc:
+        for page in doc:
+            r = page.rect
+            key = (round(r.width, 2), round(r.height, 2))
+            st = stamps.get(key)
+            if st is None:
+                st = stamps[key] = fitz.open()
+                sp = st.new_page(width=r.width, height=r.height)
+                c = fitz.Point(r.width / 2, r.height / 2)
+                sp.insert_text((c.x - tl / 2, c.y + font_size / 3), text, fontsize=font_size,
+                               color=color, morph=(c, fitz.Matrix(rotation)))
+            page.show_pdf_page(r, st, 0, overlay=True)
+        pages = doc.page_count
+        # Saving over the source needs a full rewrite to a temp file first.
+        tmp = dst + ".tmp" if os.path.abspath(dst) == os.path.abspath(src) else dst
+        doc.save(tmp, garbage=1, deflate=True)
+    if tmp != dst:
+        os.replace(tmp, dst)
+    for st in stamps.values():
+        st.close()
+    return {"path": dst, "pages": pages, "bytes": os.path.getsize(dst),
+            "time_s": round(time.perf_counter() - t0, 3)}
 @mcp.tool(name="pdf_watermark")
 async def pdf_watermark(path:str,text:str="WATERMARK",output:str="",
                         font_size:int=50,color:str="0.8 0.8 0.8",rotation:int=45)->str:
-    """给PDF添加文字水印"""
-    import fitz
+    """给PDF添加文字水印: 水印只绘制一次, 作为共享XObject叠加到每一页
+    path: PDF路径, 可用通配符批量处理(如 'invoices/*.pdf'), 多个文件在多个进程中并行处理
+    output: 单个文件时为输出路径; 批量时为输出目录(保持原文件名); 空=覆盖原文件
+    rotation: 任意角度(逆时针)"""
     try:
-        doc=fitz.open(str(R(path)))
-        for page in doc:
-            r=page.rect
-            cx,cy=r.width/2,r.height/2
-            page.insert_text((cx-100,cy),text,fontsize=font_size,
-                           color=[float(x) for x in color.split()],rotate=rotation)
-        op=str(R(output)) if output else str(R(path))
-        doc.save(op)
-        doc.close()
-        return J(path=op)
+        src=str(R(path))
+        files=sorted(glob.glob(src)) if glob.has_magic(src) else [src]
+        if not files:
+            return J(False,err=f"无匹配文件: {path}")
+        col=[float(x) for x in color.split()]
+        if glob.has_magic(src):
+            od=R(output) if output else None
+            if od:
+                od.mkdir(parents=True,exist_ok=True)
+            dsts=[str(od/Path(f).name) if od else f for f in files]
+        else:
+            dsts=[str(R(output)) if output else src]
+        async def one(f,d):
+            try:
+                return await _submit("cpu",_pdf_stamp_file,f,d,text,font_size,col,rotation)
+            except Exception as e:
+                return {"src":f,"err":str(e)}
+        t0=time.perf_counter()
+        res=await asyncio.gather(*(one(f,d) for f,d in zip(files,dsts)))
+        failed=sum(1 for r in res if "err" in r)
+        if not glob.has_magic(src):
+            r=res[0]
+            return J(False,err=r["err"]) if failed else J(**r)
+        pages=sum(r.get("pages",0) for r in res)
+        dt=time.perf_counter()-t0
+        return J(failed==0,results=res,count=len(res),failed=failed,pages=pages,
+                 time_s=round(dt,3),pages_per_s=round(pages/dt,1) if dt else None)
     except Exception as e:
         return J(False,err=str(e))
-@mcp.tool(name="pdf_to_images")
-async def pdf_to_images(path:str,output_dir:str="",dpi:int=200,fmt:str="png")->str:
-    """PDF转图片"""
+def _pdf_raster_shard(path: str, pages: Sequence[int], od: str, dpi: int, fmt: str,
+                      gray: bool, alpha: bool, thumb: int) -> list:
+    """Rasterise `pages` with a private fitz handle (pool worker), saving each page as it finishes."""
     import fitz
+    out = []
+    with fitz.open(path) as doc:
+        for i in pages:
+            t0 = time.perf_counter()
+            try:
+                page = doc.load_page(i)
+                zoom = thumb / max(page.rect.width, page.rect.height) if thumb else dpi / 72
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=alpha,
+                                      colorspace=fitz.csGRAY if gray else fitz.csRGB)
+                op = str(Path(od) / f"{'thumb' if thumb else 'page'}_{i + 1}.{fmt}")
+                pix.save(op)
+                out.append({"page": i, "path": op, "size": [pix.width, pix.height],
+                            "time_s": round(time.perf_counter() - t0, 3)})
+            except Exception as e:
+                out.append({"page": i, "err": str(e), "time_s": round(time.perf_counter() - t0, 3)})
+    return out
+@mcp.tool(name="pdf_to_images")
+async def pdf_to_images(path:str,output_dir:str="",dpi:int=200,fmt:str="png",pages:str="",
+                        gray:bool=False,alpha:bool=False,thumb:int=0,workers:int=0)->str:
+    """PDF转图片, 页面分片后在多个进程中并行渲染
+    pages: 页码(从0开始), 如 '0,2' 或 '10-50' 或 '90-', 空=全部
+    gray: 输出灰度图  alpha: 保留透明通道(仅png)
+    thumb: 缩略图模式, 按最长边像素数缩放(忽略dpi), 文件名为thumb_N; 0=关闭
+    workers: 并行进程数, 0=OMNI_CPU_WORKERS, 1=单进程顺序渲染
+    返回 pages: 每页 {"page":0,"path":"...","size":[w,h],"time_s":0.12}"""
     try:
-        doc=fitz.open(str(R(path)))
+        src=str(R(path))
+        sel=list(_page_spec(pages,await _submit("io",_pdf_page_count,src)))
         od=Path(output_dir) if output_dir else WD
         od.mkdir(parents=True,exist_ok=True)
-        outs=[]
-        mat=fitz.Matrix(dpi/72,dpi/72)
-        for i,page in enumerate(doc):
-            pix=page.get_pixmap(matrix=mat)
-            op=str(od/f"page_{i+1}.{fmt}")
-            pix.save(op)
-            outs.append(op)
-        doc.close()
-        return J(files=outs,count=len(outs))
+        n=max(1,min(workers or CPU_WORKERS,len(sel)))
+        # 连续页分片: 每个进程顺序读取相邻页, 分片数为进程数的2倍以平衡页面耗时差异
+        k=min(len(sel),n*2) if n>1 else 1
+        shards=[sel[j*len(sel)//k:(j+1)*len(sel)//k] for j in range(k)] if sel else []
+        t0=time.perf_counter()
+        args=(str(od),dpi,fmt,gray,alpha,thumb)
+        res=await _map_pool("cpu",_pdf_raster_shard,[(src,sh,*args) for sh in (shards if n>1 else [sel])])
+        pos={pg:i for i,pg in enumerate(sel)}
+        done=sorted((r for sh in res for r in sh),key=lambda r:pos[r["page"]])
+        files=[r["path"] for r in done if "path" in r]
+        failed=len(done)-len(files)
+        return J(failed==0,files=files,count=len(files),failed=failed,pages=done,
+                 shards=len(res),wall_s=round(time.perf_counter()-t0,3))
+    except BrokenProcessPool as e:
+        return J(False,err=f"worker crashed: {e}")
     except Exception as e:
         return J(False,err=str(e))
 # --- IMAGE SUBSYSTEM: Raster processing pipeline ---
+_IMG_POINT_OPS = ("brightness", "contrast", "levels", "gamma")
+_IMG_SAME_SIZE = ("flip", "blur", "sharpen", "gray", "brightness", "contrast", "saturation",
+                  "convert", "text", "overlay", "round_corners", "levels", "gamma", "mix",
+                  "alpha_threshold")
+def _img_plan(ops: Sequence[dict], size: Tuple[int, int], mode: str, fmt: Optional[str],
+              fast: bool = False) -> list:
+    """Rewrite an img_process op list into execution stages with the same result.
+
+    - resize / resize_ratio directly followed by an in-bounds crop becomes one resize of
+      just the cropped source region (Image.resize box=), so the discarded area is never
+      resampled; the box resample only reproduces resize-then-crop bit for bit when both
+      scale factors are whole numbers (and not both 1, which Pillow serves as a plain
+      copy), so other factors are merged only with `fast`;
+    - runs of brightness/contrast/levels/gamma on L/RGB/RGBA collapse into one per-channel
+      lookup table;
+    - with `fast`, a JPEG whose first stage is a >=2x downscale is decoded at reduced size
+      via draft(); the DCT-scaled decode only approximates the full-size resample, so this
+      one rewrite is opt-in.
+    Each stage lists the indexes of the ops it covers."""
+    stages: list = []
+    cur: Optional[Tuple[int, int]] = size
+    i = 0
+    while i < len(ops):
+        o, op = ops[i], ops[i]["op"]
+        if op in ("resize", "resize_ratio") and cur:
+            w, h = (o["w"], o["h"]) if op == "resize" else (int(cur[0] * o["ratio"]), int(cur[1] * o["ratio"]))
+            st = {"stage": "resize", "ops": [i], "size": [w, h], "box": [0, 0, cur[0], cur[1]]}
+            nxt = ops[i + 1] if i + 1 < len(ops) else {}
+            exact = min(w, h) > 0 and cur[0] % w == 0 and cur[1] % h == 0 and cur != (w, h)
+            if nxt.get("op") == "crop" and 0 <= nxt["l"] < nxt["r"] <= w and 0 <= nxt["t"] < nxt["b"] <= h \
+                    and min(cur) > 0 and (exact or fast):
+                sx, sy = cur[0] / w, cur[1] / h
+                st.update(size=[nxt["r"] - nxt["l"], nxt["b"] - nxt["t"]],
+                          box=[nxt["l"] * sx, nxt["t"] * sy, nxt["r"] * sx, nxt["b"] * sy])
+                st["ops"].append(i + 1)
+            if fast and not stages and fmt == "JPEG" and cur == size and min(cur) > 0:
+                bw, bh = st["box"][2] - st["box"][0], st["box"][3] - st["box"][1]
+                req = (-(-size[0] * st["size"][0] // bw), -(-size[1] * st["size"][1] // bh))
+                if req[0] * 2 <= size[0] and req[1] * 2 <= size[1]:
+                    st["draft"] = [int(req[0]), int(req[1])]
+            stages.append(st)
+            cur = tuple(st["size"])
+            i = st["ops"][-1] + 1
+            continue
+        if op in _IMG_POINT_OPS and mode in ("L", "RGB", "RGBA"):
+            j = i
+            while j < len(ops) and ops[j]["op"] in _IMG_POINT_OPS:
+                j += 1
+            if j - i > 1:
+                stages.append({"stage": "lut", "ops": list(range(i, j)),
+                               "chain": [dict(x) for x in ops[i:j]]})
+                i = j
+                continue
+        stages.append({"stage": op, "ops": [i]})
+        if op == "crop":
+            cur = (o["r"] - o["l"], o["b"] - o["t"])
+        elif op == "border" and cur:
+            cur = (cur[0] + 2 * o.get("size", 10), cur[1] + 2 * o.get("size", 10))
+        elif op == "rotate" and cur and o["angle"] % 90 == 0:
+            cur = cur[::-1] if o["angle"] % 180 else cur
+        elif op not in _IMG_SAME_SIZE:
+            cur = None
+        if op == "gray":
+            mode = "L"
+        elif op == "convert":
+            mode = o["mode"]
+        elif op in ("text", "round_corners"):
+            mode = "RGBA"
+        i += 1
+    return stages
+def _img_resize_stage(img: Any, st: dict) -> Any:
+    """Run a planned resize stage: optional JPEG draft decode, then resize of the source box."""
+    from PIL import Image
+    box = st["box"]
+    if st.get("draft"):
+        w0, h0 = img.size
+        img.draft(img.mode, tuple(st["draft"]))
+        sx, sy = img.width / w0, img.height / h0
+        box = [box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy]
+    return img.resize(tuple(st["size"]), Image.LANCZOS, box=tuple(box))
+def _img_point_chain(img: Any, chain: Sequence[dict]) -> Any:
+    """Apply brightness/contrast/levels/gamma ops as one point() lookup over the image.
+
+    Every step is a per-channel 256-entry map (alpha is left alone), so a run of them
+    composes into a single table. Brightness and contrast reproduce ImageEnhance exactly:
+    it blends against a constant (0, or the rounded mean of the L image) and truncates
+    to uint8 after every step; the mean for a contrast step is computed from the tables
+    composed so far instead of building the intermediate image."""
+    import numpy as np
+    bands = len(img.getbands()) - ("A" in img.getbands())
+    v = np.arange(256, dtype=np.float32)
+    ident = np.arange(256, dtype=np.uint8)
+    luts = [ident] * bands
+    arr = None
+    for o in chain:
+        op = o["op"]
+        if op == "levels":
+            lo, hi = o.get("in_low", 0), o.get("in_high", 255)
+            x = np.clip((np.arange(256.0) - lo) / max(hi - lo, 1e-6), 0, 1) ** (1 / o.get("gamma", 1.0))
+            y = o.get("out_low", 0) + x * (o.get("out_high", 255) - o.get("out_low", 0))
+            step = np.clip(np.rint(y), 0, 255).astype(np.uint8)
+        elif op == "gamma":
+            step = np.clip(np.rint(255 * (np.arange(256.0) / 255) ** (1 / o["g"])), 0, 255).astype(np.uint8)
+        else:
+            if op == "brightness":
+                c = 0
+            elif all((lut == ident).all() for lut in luts):
+                c = int(sum(i * n for i, n in enumerate(img.convert("L").histogram())) / (img.width * img.height) + 0.5)
+            else:
+                if arr is None:
+                    arr = np.asarray(img)
+                if bands == 1:
+                    lv = luts[0][arr].astype(np.uint32)
+                else:
+                    lv = (luts[0][arr[..., 0]].astype(np.uint32) * 19595 + luts[1][arr[..., 1]].astype(np.uint32) * 38470
+                          + luts[2][arr[..., 2]].astype(np.uint32) * 7471 + 0x8000) >> 16
+                c = int(float(lv.sum()) / lv.size + 0.5)
+            t = np.float32(c) + np.float32(o["f"]) * (v - np.float32(c))
+            step = np.clip(t, 0, 255).astype(np.uint8)
+        luts = [step[lut] for lut in luts]
+    table = np.concatenate(luts + [ident] * ("A" in img.getbands())).tolist()
+    return img.point(table)
+@functools.lru_cache(maxsize=8)
+def _img_overlay(path: str, stamp: tuple, opacity: float) -> Any:
+    """Decoded overlay image with alpha pre-scaled by `opacity`, cached per file version."""
+    import numpy as np
+    from PIL import Image
+    ov = Image.open(path)
+    ov.load()
+    if opacity < 1:
+        ov = ov.convert("RGBA")
+        a = np.asarray(ov.getchannel("A"), dtype=np.float64) * opacity
+        ov.putalpha(Image.fromarray(a.astype(np.uint8)))
+    return ov
+@functools.lru_cache(maxsize=16)
+def _img_font(size: int) -> Any:
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except Exception:
+        return ImageFont.load_default()
+def _img_round_corners(img: Any, radius: int) -> Any:
+    """Anti-aliased rounded corners: only the four r x r corner blocks of alpha are touched."""
+    import numpy as np
+    from PIL import Image
+    img = img.convert("RGBA")
+    r = min(int(radius), img.width // 2, img.height // 2)
+    if r <= 0:
+        return img
+    yy, xx = np.mgrid[0:r, 0:r] + 0.5
+    cov = np.clip(r - np.hypot(r - xx, r - yy) + 0.5, 0, 1)
+    a = np.array(img.getchannel("A"))
+    for ys, xs, m in ((slice(None, r), slice(None, r), cov), (slice(None, r), slice(-r, None), cov[:, ::-1]),
+                      (slice(-r, None), slice(None, r), cov[::-1]), (slice(-r, None), slice(-r, None), cov[::-1, ::-1])):
+        a[ys, xs] = (a[ys, xs] * m + 0.5).astype(np.uint8)
+    img.putalpha(Image.fromarray(a))
+    return img
+def _img_mix(img: Any, matrix: Sequence[Sequence[float]]) -> Any:
+    """Channel mix: out_rgb = M[:, :3] @ rgb (+ M[:, 3]), in row bands to bound temporaries."""
+    import numpy as np
+    from PIL import Image
+    if img.mode not in ("RGB", "RGBA"):
+        raise ValueError(f"mix needs an RGB/RGBA image, got {img.mode}")
+    m = np.asarray(matrix, dtype=np.float32)
+    if m.shape not in ((3, 3), (3, 4)):
+        raise ValueError("mix matrix must be 3x3 or 3x4")
+    out = np.array(img)
+    for y in range(0, img.height, 256):
+        band = out[y:y + 256, :, :3]
+        rgb = band @ m[:, :3].T
+        if m.shape[1] == 4:
+            rgb += m[:, 3]
+        band[...] = np.clip(np.rint(rgb), 0, 255)
+    return Image.fromarray(out)
+def _img_op(img: Any, o: dict) -> Any:
+    """Apply one img_process op and return the resulting image."""
+    import numpy as np
+    from PIL import Image, ImageColor, ImageDraw, ImageEnhance, ImageFilter, ImageOps
+    op = o["op"]
+    if op == "resize":
+        img = img.resize((o["w"], o["h"]), Image.LANCZOS)
+    elif op == "resize_ratio":
+        img = img.resize((int(img.width * o["ratio"]), int(img.height * o["ratio"])), Image.LANCZOS)
+    elif op == "crop":
+        img = img.crop((o["l"], o["t"], o["r"], o["b"]))
+    elif op == "rotate":
+        img = img.rotate(o["angle"], expand=True, resample=Image.BICUBIC)
+    elif op == "flip":
+        img = img.transpose(Image.FLIP_LEFT_RIGHT if o["dir"] == "h" else Image.FLIP_TOP_BOTTOM)
+    elif op == "blur":
+        img = img.filter(ImageFilter.GaussianBlur(o.get("r", 5)))
+    elif op == "sharpen":
+        img = img.filter(ImageFilter.SHARPEN)
+    elif op == "gray":
+        img = img.convert("L")
+    elif op == "brightness":
+        img = ImageEnhance.Brightness(img).enhance(o["f"])
+    elif op == "contrast":
+        img = ImageEnhance.Contrast(img).enhance(o["f"])
+    elif op == "saturation":
+        img = ImageEnhance.Color(img).enhance(o["f"])
+    elif op == "convert":
+        img = img.convert(o["mode"])
+    elif op == "thumbnail":
+        s = o["size"]
+        img.thumbnail((s, s), Image.LANCZOS)
+    elif op == "border":
+        img = ImageOps.expand(img, border=o.get("size", 10), fill=o.get("color", "black"))
+    elif op == "overlay":
+        p = R(o["path"])
+        st = p.stat()
+        overlay = _img_overlay(str(p), (st.st_mtime_ns, st.st_size), min(o.get("opacity", 1), 1))
+        img.paste(overlay, (o.get("x", 0), o.get("y", 0)), overlay if overlay.mode == "RGBA" else None)
+    elif op == "text":
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        ft = _img_font(o.get("size", 36))
+        x, y = o.get("x", 10), o.get("y", 10)
+        fill = o.get("color", "white")
+        if "opacity" in o:
+            fill = ImageColor.getrgb(fill)[:3] + (o["opacity"],)
+        # Draw into a layer covering just the text box, clipped to the image.
+        l, t, r, b = ImageDraw.Draw(img).textbbox((x, y), o["text"], font=ft)
+        l, t, r, b = max(int(l), 0), max(int(t), 0), min(int(r) + 1, img.width), min(int(b) + 1, img.height)
+        if l < r and t < b:
+            layer = Image.new("RGBA", (r - l, b - t), (0, 0, 0, 0))
+            ImageDraw.Draw(layer).text((x - l, y - t), o["text"], fill=fill, font=ft)
+            img.alpha_composite(layer, (l, t))
+    elif op == "round_corners":
+        img = _img_round_corners(img, o.get("radius", 20))
+    elif op in ("levels", "gamma"):
+        img = _img_point_chain(img, [o])
+    elif op == "mix":
+        img = _img_mix(img, o["matrix"])
+    elif op == "alpha_threshold":
+        if "A" in img.getbands():
+            a = np.asarray(img.getchannel("A"))
+            img.putalpha(Image.fromarray(np.where(a >= o.get("t", 128), 255, 0).astype(np.uint8)))
+    return img
+def _img_run(img: Any, ops: Sequence[dict], stages: Sequence[dict]) -> Any:
+    """Execute planned `stages` of `ops` on an opened image (palette images work in RGBA)."""
+    if img.mode == "P":
+        img = img.convert("RGBA")
+    for st in stages:
+        if st["stage"] == "resize" and "box" in st:
+            img = _img_resize_stage(img, st)
+        elif st["stage"] == "lut" and img.mode in ("L", "RGB", "RGBA"):
+            img = _img_point_chain(img, st["chain"])
+        else:
+            for i in st["ops"]:
+                img = _img_op(img, ops[i])
+    return img
 @mcp.tool(name="img_process")
-async def img_process(src:str,dst:str="",ops:str="[]")->str:
+@_offload("cpu")
+def img_process(src:str,dst:str="",ops:str="[]",plan:bool=True,explain:bool=False,fast:bool=False)->str:
     """图像处理(增强版)
     ops: JSON数组,按序执行:
       {"op":"resize","w":800,"h":600}  {"op":"resize_ratio","ratio":0.5}
@@ -781,70 +2223,154 @@ async def img_process(src:str,dst:str="",ops:str="[]")->str:
       {"op":"convert","mode":"RGBA"|"RGB"|"L"|"CMYK"}
       {"op":"thumbnail","size":256}
       {"op":"overlay","path":"logo.png","x":10,"y":10,"opacity":0.5}
-    dst空则覆盖src"""
-    from PIL import Image,ImageFilter,ImageEnhance,ImageDraw,ImageFont,ImageOps
+      {"op":"levels","in_low":0,"in_high":255,"gamma":1.0,"out_low":0,"out_high":255}
+      {"op":"gamma","g":2.2}  (g>1变亮)
+      {"op":"mix","matrix":[[1,0,0],[0,1,0],[0,0,1]]}  (RGB通道混合, 3x3或3x4, 第4列为偏移)
+      {"op":"alpha_threshold","t":128}  (透明度二值化: >=t不透明, 否则全透明; 无透明通道时不变)
+    dst空则覆盖src
+    plan: 执行前优化操作序列(结果与逐个执行一致): 整数倍缩小后紧跟的crop只对保留区域重采样,
+      连续的brightness/contrast/levels/gamma合并为一次查表; false=严格逐个执行
+    fast: true=非整数倍缩放后的crop也只对保留区域重采样, JPEG首步大幅缩小(>=2倍)时按缩小尺寸解码;
+      速度更快但结果为近似值, 与逐个执行存在轻微像素差异(需plan=true)
+    explain: 只返回执行计划(各阶段及其覆盖的ops下标), 不处理图像"""
+    from PIL import Image
     try:
         img=Image.open(str(R(src)))
-        if img.mode=="P":
-            img=img.convert("RGBA")
-        for o in json.loads(ops):
-            op=o["op"]
-            if op=="resize":
-                img=img.resize((o["w"],o["h"]),Image.LANCZOS)
-            elif op=="resize_ratio":
-                img=img.resize((int(img.width*o["ratio"]),int(img.height*o["ratio"])),Image.LANCZOS)
-            elif op=="crop":
-                img=img.crop((o["l"],o["t"],o["r"],o["b"]))
-            elif op=="rotate":
-                img=img.rotate(o["angle"],expand=True,resample=Image.BICUBIC)
-            elif op=="flip":
-                img=img.transpose(Image.FLIP_LEFT_RIGHT if o["dir"]=="h" else Image.FLIP_TOP_BOTTOM)
-            elif op=="blur":
-                img=img.filter(ImageFilter.GaussianBlur(o.get("r",5)))
-            elif op=="sharpen":
-                img=img.filter(ImageFilter.SHARPEN)
-            elif op=="gray":
-                img=img.convert("L")
-            elif op=="brightness":
-                img=ImageEnhance.Brightness(img).enhance(o["f"])
-            elif op=="contrast":
-                img=ImageEnhance.Contrast(img).enhance(o["f"])
-            elif op=="saturation":
-                img=ImageEnhance.Color(img).enhance(o["f"])
-            elif op=="convert":
-                img=img.convert(o["mode"])
-            elif op=="thumbnail":
-                s=o["size"]
-                img.thumbnail((s,s),Image.LANCZOS)
-            elif op=="border":
-                img=ImageOps.expand(img,border=o.get("size",10),fill=o.get("color","black"))
-            elif op=="overlay":
-                overlay=Image.open(str(R(o["path"])))
-                if o.get("opacity",1)<1:
-                    overlay=overlay.convert("RGBA")
-                    alpha=overlay.split()[3].point(lambda p:int(p*o["opacity"]))
-                    overlay.putalpha(alpha)
-                img.paste(overlay,(o.get("x",0),o.get("y",0)),overlay if overlay.mode=="RGBA" else None)
-            elif op=="text":
-                if img.mode!="RGBA":
-                    img=img.convert("RGBA")
-                txt_layer=Image.new("RGBA",img.size,(0,0,0,0))
-                d=ImageDraw.Draw(txt_layer)
-                try:
-                    ft=ImageFont.truetype("arial.ttf",o.get("size",36))
-                except:
-                    ft=ImageFont.load_default()
-                fill=o.get("color","white")
-                d.text((o.get("x",10),o.get("y",10)),o["text"],fill=fill,font=ft)
-                img=Image.alpha_composite(img,txt_layer)
+        olist=json.loads(ops)
+        stages=_img_plan(olist,img.size,"RGBA" if img.mode=="P" else img.mode,img.format,fast) if plan else \
+            [{"stage":o["op"],"ops":[i]} for i,o in enumerate(olist)]
+        if explain:
+            return J(plan=stages,size=list(img.size),mode=img.mode,format=img.format)
+        img=_img_run(img,olist,stages)
         p=str(R(dst or src))
         img.save(p)
         return J(path=p,size=list(img.size),mode=img.mode)
     except Exception as e:
         return J(False,err=str(e))
+_IMG_MANIFEST = ".omni_img_batch.json"
+def _img_batch_shard(jobs: Sequence[Tuple[int, str, str, Optional[str]]], ops: Sequence[dict], plan: bool,
+                     skip: str, quality: int, max_mp: float, fast: bool = False) -> list:
+    """Run the img_process pipeline over `jobs` (pool worker), one decoded image at a time.
+
+    A job is (index, src, dst, previous digest). With skip="hash" the digest covers the
+    source bytes, ops, quality and `fast`; outputs are written to a temp name and renamed, so an
+    interrupted run never leaves a truncated file that looks up to date."""
+    from PIL import Image
+    out = []
+    for i, src, dst, prev in jobs:
+        t0 = time.perf_counter()
+        item: Dict[str, Any] = {"i": i, "src": src, "path": dst}
+        try:
+            if skip == "mtime" and os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+                out.append(dict(item, skipped=True))
+                continue
+            if skip == "hash":
+                h = hashlib.sha1(json.dumps([ops, quality] + ([True] if fast else [])).encode())
+                with open(src, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        h.update(chunk)
+                item["digest"] = h.hexdigest()
+                if item["digest"] == prev and os.path.exists(dst):
+                    out.append(dict(item, skipped=True))
+                    continue
+            fmt = Image.registered_extensions().get(Path(dst).suffix.lower())
+            if not fmt:
+                raise ValueError(f"unknown output format: {Path(dst).suffix}")
+            with Image.open(src) as im:
+                if max_mp and im.width * im.height > max_mp * 1e6:
+                    raise ValueError(f"{im.width}x{im.height} exceeds max_mp={max_mp}")
+                item["mp"] = round(im.width * im.height / 1e6, 3)
+                stages = _img_plan(ops, im.size, "RGBA" if im.mode == "P" else im.mode, im.format, fast) if plan \
+                    else [{"stage": o["op"], "ops": [j]} for j, o in enumerate(ops)]
+                img = _img_run(im, ops, stages)
+                if fmt == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+                    img = img.convert("RGB")
+                Path(dst).parent.mkdir(parents=True, exist_ok=True)
+                img.save(dst + ".tmp", format=fmt, **({"quality": quality} if quality else {}))
+            os.replace(dst + ".tmp", dst)
+            item.update(size=list(img.size), time_s=round(time.perf_counter() - t0, 3))
+        except Exception as e:
+            with contextlib.suppress(OSError):
+                os.remove(dst + ".tmp")
+            item = {"i": i, "src": src, "path": dst, "err": str(e)}
+        out.append(item)
+    return out
+@mcp.tool(name="img_batch")
+async def img_batch(src:str,output_dir:str,ops:str="[]",name:str="{stem}{ext}",skip:str="mtime",
+                    quality:int=0,max_mp:float=0,plan:bool=True,fast:bool=False,workers:int=0,
+                    ctx:Context=None)->str:
+    """批量图像处理: 对一批图片执行同一组img_process ops, 多进程并行, 每个进程同一时刻只解码一张图
+    src: 通配符(如 'photos/**/*.jpg', **递归子目录) 或 JSON数组 ["a.png","b.jpg"]
+    output_dir: 输出目录
+    ops/plan/fast: 同img_process
+    name: 输出文件名模板(可含子目录), 字段 {stem} {ext}(含点) {parent}(源文件所在目录名) {n}(从1开始的序号),
+      扩展名决定输出格式, 如 "{stem}_thumb.webp"; 输出到JPEG时透明图自动转RGB
+    skip: mtime=输出比源文件新则跳过 | hash=源文件内容、ops、quality与fast都未变则跳过(摘要记录在输出目录的.omni_img_batch.json) | none=全部重新处理
+    quality: JPEG/WEBP质量, 0=Pillow默认
+    max_mp: 单张像素上限(百万像素), 超出的图片记为错误且不解码, 0=不限
+    workers: 并行进程数, 0=OMNI_CPU_WORKERS
+    进度通过MCP进度通知推送; 单张失败不影响其余文件
+    返回 processed/skipped/failed, errors: [{"src":"...","err":"..."}], files_per_s, mp_per_s"""
+    try:
+        olist=json.loads(ops)
+        if src.lstrip().startswith("["):
+            files=[str(R(f)) for f in json.loads(src)]
+        else:
+            files=sorted(f for f in glob.glob(str(R(src)),recursive=True) if os.path.isfile(f))
+        if not files:
+            return J(False,err=f"无匹配文件: {src}")
+        od=R(output_dir)
+        od.mkdir(parents=True,exist_ok=True)
+        mf=od/_IMG_MANIFEST
+        manifest=json.loads(mf.read_text()) if skip=="hash" and mf.exists() else {}
+        jobs,errors,seen=[],[],set()
+        for i,f in enumerate(files):
+            fp=Path(f)
+            dst=str(od/name.format(stem=fp.stem,ext=fp.suffix,parent=fp.parent.name,n=i+1))
+            if dst in seen or os.path.abspath(dst)==os.path.abspath(f):
+                errors.append({"src":f,"err":f"output collides: {dst}"})
+                continue
+            seen.add(dst)
+            jobs.append((i,f,dst,manifest.get(dst)))
+        n=max(1,min(workers or CPU_WORKERS,len(jobs) or 1))
+        size=max(1,min(32,len(jobs)//(n*4) or 1))
+        shards=[jobs[j:j+size] for j in range(0,len(jobs),size)]
+        t0=time.perf_counter()
+        done=processed=skipped=0
+        mp=0.0
+        async def collect(part):
+            nonlocal done,processed,skipped,mp
+            for r in part:
+                if "err" in r:
+                    errors.append({"src":r["src"],"err":r["err"]})
+                    manifest.pop(r.get("path",""),None)
+                    continue
+                if r.get("skipped"):
+                    skipped+=1
+                else:
+                    processed+=1
+                    mp+=r["mp"]
+                if "digest" in r:
+                    manifest[r["path"]]=r["digest"]
+            done+=len(part)
+            await _notify(ctx,done,len(jobs),[f"{r['src']}: {r['err']}" for r in part if "err" in r])
+        await _map_pool("cpu",_img_batch_shard,[(sh,olist,plan,skip,quality,max_mp,fast) for sh in shards],collect)
+        if skip=="hash":
+            mf.write_text(json.dumps(manifest))
+        dt=time.perf_counter()-t0
+        return J(not errors,output_dir=str(od),count=len(files),processed=processed,skipped=skipped,
+                 failed=len(errors),errors=errors,megapixels=round(mp,2),time_s=round(dt,3),
+                 files_per_s=round(processed/dt,1) if dt else None,mp_per_s=round(mp/dt,1) if dt else None)
+    except BrokenProcessPool as e:
+        return J(False,err=f"worker crashed: {e}")
+    except Exception as e:
+        return J(False,err=str(e))
 @mcp.tool(name="img_create")
-async def img_create(path:str,w:int=800,h:int=600,color:str="white")->str:
-    """创建纯色图像"""
+@_cached()
+@_offload("io")
+def img_create(path:str,w:int=800,h:int=600,color:str="white")->str:
+    """创建纯色图像
+    cache: true=参数与输入文件相同时直接复制缓存产物,跳过重新生成(统计/清理见render_cache)"""
     from PIL import Image
     try:
         img=Image.new("RGB",(w,h),color)
@@ -853,27 +2379,97 @@ async def img_create(path:str,w:int=800,h:int=600,color:str="white")->str:
         return J(path=p)
     except Exception as e:
         return J(False,err=str(e))
+def _img_header(path: str) -> dict:
+    """Header-only facts about one image file; pixel data is never decoded."""
+    from PIL import Image
+    try:
+        with Image.open(path) as im:
+            dpi = im.info.get("dpi")
+            info = {"path": path, "size": list(im.size), "mode": im.mode, "format": im.format,
+                    "megapixels": round(im.width * im.height / 1e6, 2), "bytes": os.path.getsize(path),
+                    "dpi": [round(float(x), 2) for x in dpi] if dpi else None,
+                    "orientation": None, "taken": None, "has_exif": False}
+            # PNG getexif() loads the whole image unless eXIf came before the pixel data.
+            exif = im.getexif() if im.format != "PNG" or "exif" in im.info else None
+            if exif:
+                info.update(has_exif=True, orientation=exif.get(0x0112),
+                            taken=exif.get_ifd(0x8769).get(0x9003) or exif.get(0x0132))
+        return info
+    except Exception as e:
+        return {"path": path, "err": str(e)}
+def _img_headers(paths: Sequence[str]) -> list:
+    return [_img_header(p) for p in paths]
+def _img_info_schema() -> Any:
+    """Arrow schema of an img_info row, so every parquet row group has the same column types."""
+    import pyarrow as pa
+    return pa.schema([("path", pa.string()), ("size", pa.list_(pa.int64())), ("mode", pa.string()),
+                      ("format", pa.string()), ("megapixels", pa.float64()), ("bytes", pa.int64()),
+                      ("dpi", pa.list_(pa.float64())), ("orientation", pa.int64()), ("taken", pa.string()),
+                      ("has_exif", pa.bool_()), ("err", pa.string())])
 @mcp.tool(name="img_info")
-async def img_info(path:str)->str:
-    """获取图像详细信息"""
+async def img_info(path:str,recursive:bool=False,cursor:int=0,limit:int=1000,index:str="",
+                   ctx:Context=None)->str:
+    """获取图像信息(只读文件头, 不解码像素): 尺寸/模式/格式/DPI/文件大小/EXIF方向与拍摄时间
+    path: 单个文件; 或目录/通配符(如 'assets/**/*.jpg', **递归)批量读取, 线程池并行
+    recursive: path为目录时是否包含子目录
+    cursor/limit: 批量结果分页(按路径排序), 返回next_cursor, null表示已到末尾
+    index: 把全部结果写入索引文件(.jsonl, 或.parquet需要pyarrow), 此时不分页, 只返回统计
+    批量时单个文件失败记为 {"path":"...","err":"..."}, 不影响其余文件"""
     from PIL import Image
     try:
-        img=Image.open(str(R(path)))
-        info={"size":list(img.size),"mode":img.mode,"format":img.format,
-              "megapixels":round(img.width*img.height/1e6,2)}
-        if img.info.get("dpi"):
-            info["dpi"]=img.info["dpi"]
+        src=R(path)
+        if src.is_file():
+            r=await _submit("io",_img_header,str(src))
+            return J(False,err=r["err"]) if "err" in r else J(**r)
+        if src.is_dir():
+            exts=set(Image.registered_extensions())
+            files=sorted(str(f) for f in (src.rglob("*") if recursive else src.iterdir())
+                         if f.suffix.lower() in exts and f.is_file())
+        elif glob.has_magic(str(src)):
+            files=sorted(f for f in glob.glob(str(src),recursive=True) if os.path.isfile(f))
+        else:
+            return J(False,err=f"文件不存在: {path}")
+        sel=files if index else files[cursor:cursor+limit]
+        chunks=[sel[j:j+64] for j in range(0,len(sel),64)]
+        t0=time.perf_counter()
+        items,failed,fh,pw=[],0,None,None
+        ip=R(index) if index else None
+        if ip and ip.suffix.lower()==".parquet":
+            import pyarrow as pa,pyarrow.parquet as pq
+            schema=_img_info_schema()
+            pw=pq.ParquetWriter(str(ip),schema)
+        elif ip:
+            fh=open(ip,"w",encoding="utf-8")
         try:
-            exif=img._getexif()
-            if exif:
-                info["has_exif"]=True
-        except:
-            pass
-        return J(**info)
+            # 每轮最多IO_WORKERS个分片在途, 结果按顺序写出, 内存不随文件数增长
+            for w in range(0,len(chunks),IO_WORKERS):
+                parts=await asyncio.gather(*(_submit("io",_img_headers,c) for c in chunks[w:w+IO_WORKERS]))
+                for part in parts:
+                    failed+=sum(1 for r in part if "err" in r)
+                    if fh:
+                        fh.writelines(json.dumps(r,ensure_ascii=False)+"\n" for r in part)
+                    elif not pw:
+                        items.extend(part)
+                if pw:
+                    # 每轮写一个row group, 列类型由固定schema决定而非首行推断
+                    pw.write_table(pa.Table.from_pylist([r for part in parts for r in part],schema=schema))
+                await _notify(ctx,min(len(sel),(w+IO_WORKERS)*64),len(sel))
+        finally:
+            if fh:
+                fh.close()
+            if pw:
+                pw.close()
+        dt=time.perf_counter()-t0
+        stats=dict(count=len(sel),failed=failed,time_s=round(dt,3),files_per_s=round(len(sel)/dt,1) if dt else None)
+        if ip:
+            return J(index=str(ip),**stats)
+        nxt=cursor+limit if cursor+limit<len(files) else None
+        return J(items=items,total=len(files),cursor=cursor,next_cursor=nxt,**stats)
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="img_convert")
-async def img_convert(src:str,dst:str,quality:int=95)->str:
+@_offload("cpu")
+def img_convert(src:str,dst:str,quality:int=95)->str:
     """图像格式转换(png/jpg/bmp/webp/tiff/gif)"""
     from PIL import Image
     try:
@@ -885,64 +2481,246 @@ async def img_convert(src:str,dst:str,quality:int=95)->str:
         return J(path=p,size=list(img.size))
     except Exception as e:
         return J(False,err=str(e))
+def _composite_layout(sizes: Sequence[Tuple[int, int]], direction: str, gap: int,
+                      cols: int) -> Tuple[int, int, list]:
+    """Canvas size and rows [(y, band height, [(index, x), ...])] for img_composite.
+
+    A band runs from its row's top to the next row's top, so gaps belong to the band above."""
+    n = len(sizes)
+    if direction == "horizontal":
+        xs = [sum(w for w, _ in sizes[:i]) + gap * i for i in range(n)]
+        h = max(h for _, h in sizes)
+        return xs[-1] + sizes[-1][0], h, [(0, h, list(zip(range(n), xs)))]
+    if direction == "vertical":
+        ys = [sum(h for _, h in sizes[:i]) + gap * i for i in range(n)]
+        hh = ys[-1] + sizes[-1][1]
+        return max(w for w, _ in sizes), hh, [(y, (ys[i + 1] if i + 1 < n else hh) - y, [(i, 0)])
+                                             for i, y in enumerate(ys)]
+    cols = cols or int(n ** 0.5) + 1
+    nrows = (n + cols - 1) // cols
+    mw, mh = max(w for w, _ in sizes), max(h for _, h in sizes)
+    return cols * (mw + gap) - gap, nrows * (mh + gap) - gap, [
+        (r * (mh + gap), mh + (gap if r + 1 < nrows else 0),
+         [(i, (i - r * cols) * (mw + gap)) for i in range(r * cols, min(n, (r + 1) * cols))])
+        for r in range(nrows)]
+def _composite_band(files: Sequence[str], sizes: Sequence[Tuple[int, int]], rows: Sequence[tuple],
+                    width: int, bg: str) -> Any:
+    """Render consecutive layout rows into one RGB band; each input is decoded only while pasted."""
+    from PIL import Image
+    y0 = rows[0][0]
+    band = Image.new("RGB", (width, rows[-1][0] + rows[-1][1] - y0), bg)
+    for y, _, items in rows:
+        for i, x in items:
+            with Image.open(files[i]) as im:
+                if im.size != tuple(sizes[i]):
+                    im.draft(im.mode, sizes[i])
+                    band.paste(im.resize(sizes[i], Image.LANCZOS), (x, y - y0))
+                else:
+                    band.paste(im, (x, y - y0))
+    return band
+def _dzi_write(path: Path, width: int, height: int, bands: Any, fmt: str, tile: int = 256) -> int:
+    """Write a Deep Zoom pyramid (path.dzi + path_files/<level>/<col>_<row>.<fmt>) from a
+    top-to-bottom stream of full-width bands. Level tiles are cut as soon as enough rows have
+    arrived; each lower level is then built tile by tile from the four children on disk."""
+    from PIL import Image
+    top = (max(width, height) - 1).bit_length()
+    root = path.parent / f"{path.stem}_files"
+    def dims(level: int) -> Tuple[int, int]:
+        k = 1 << (top - level)
+        return -(-width // k), -(-height // k)
+    def save(level: int, c: int, r: int, im: Any) -> None:
+        im.save(root / str(level) / f"{c}_{r}.{fmt}", **({"quality": 90} if fmt == "jpg" else {}))
+    for level in range(top + 1):
+        (root / str(level)).mkdir(parents=True, exist_ok=True)
+    count, r, carry = 0, 0, None
+    for band in bands:
+        if carry is not None:
+            merged = Image.new("RGB", (width, carry.height + band.height))
+            merged.paste(carry, (0, 0))
+            merged.paste(band, (0, carry.height))
+            band = merged
+        y = 0
+        while r * tile < height and band.height - y >= min(tile, height - r * tile):
+            th = min(tile, height - r * tile)
+            for c in range(-(-width // tile)):
+                save(top, c, r, band.crop((c * tile, y, min(width, (c + 1) * tile), y + th)))
+                count += 1
+            r, y = r + 1, y + th
+        carry = band.crop((0, y, width, band.height)) if y < band.height else None
+    for level in range(top - 1, -1, -1):
+        (wl, hl), (wc, hc) = dims(level), dims(level + 1)
+        for r in range(-(-hl // tile)):
+            for c in range(-(-wl // tile)):
+                cw, ch = min(2 * tile, wc - 2 * c * tile), min(2 * tile, hc - 2 * r * tile)
+                im = Image.new("RGB", (cw, ch))
+                for dy in (0, 1):
+                    for dx in (0, 1):
+                        if dx * tile < cw and dy * tile < ch:
+                            with Image.open(root / str(level + 1) / f"{2 * c + dx}_{2 * r + dy}.{fmt}") as child:
+                                im.paste(child, (dx * tile, dy * tile))
+                save(level, c, r, im.resize((min(tile, wl - c * tile), min(tile, hl - r * tile)), Image.BOX))
+                count += 1
+    path.write_text('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{fmt}" Overlap="0" '
+                    f'TileSize="{tile}"><Size Width="{width}" Height="{height}"/></Image>\n')
+    return count
 @mcp.tool(name="img_composite")
-async def img_composite(images:str="[]",output:str="composite.png",
-                        direction:str="horizontal",gap:int=0,bg:str="white")->str:
-    """拼接多张图片
-    images: JSON数组 ["img1.png","img2.png",...]
+@_offload("cpu")
+def img_composite(images:str="[]",output:str="composite.png",
+                        direction:str="horizontal",gap:int=0,bg:str="white",cols:int=0,
+                        cell_w:int=0,cell_h:int=0,strip_h:int=0,tile_fmt:str="jpg")->str:
+    """拼接多张图片(流式: 布局只读取图片头信息, 每张图粘贴时才解码, 用完即释放)
+    images: JSON数组 ["img1.png","img2.png",...] 或通配符 'shots/*.png'
     direction: horizontal|vertical|grid
-    gap: 图片间距(px)"""
+    gap: 图片间距(px)
+    cols: grid列数, 0=自动
+    cell_w/cell_h: 每张图先等比缩小到不超过该尺寸(只缩小), 0=不限; JPEG按缩小尺寸解码
+    strip_h: >0时按整行分条输出, 每条不超过strip_h像素高(至少一行), 文件为 名称_0.png, 名称_1.png...; 内存只占一条
+    output以.dzi结尾时输出Deep Zoom金字塔瓦片(名称.dzi + 名称_files/<级>/<列>_<行>.<tile_fmt>), 内存只占一行图片
+    tile_fmt: DZI瓦片格式 jpg|png"""
     from PIL import Image
     try:
-        imgs=[Image.open(str(R(p))) for p in json.loads(images)]
-        if not imgs:
+        if images.lstrip().startswith("["):
+            files=[str(R(p)) for p in json.loads(images)]
+        else:
+            files=sorted(glob.glob(str(R(images))))
+        if not files:
             return J(False,err="no images")
-        if direction=="horizontal":
-            h=max(i.height for i in imgs)
-            w=sum(i.width for i in imgs)+gap*(len(imgs)-1)
-            out=Image.new("RGB",(w,h),bg)
-            x=0
-            for i in imgs:
-                out.paste(i,(x,0))
-                x+=i.width+gap
-        elif direction=="vertical":
-            w=max(i.width for i in imgs)
-            h=sum(i.height for i in imgs)+gap*(len(imgs)-1)
-            out=Image.new("RGB",(w,h),bg)
-            y=0
-            for i in imgs:
-                out.paste(i,(0,y))
-                y+=i.height+gap
-        else: # grid
-            n=len(imgs)
-            cols=int(n**0.5)+1
-            rows=(n+cols-1)//cols
-            mw=max(i.width for i in imgs)
-            mh=max(i.height for i in imgs)
-            out=Image.new("RGB",(cols*(mw+gap)-gap,rows*(mh+gap)-gap),bg)
-            for idx,i in enumerate(imgs):
-                r,c=divmod(idx,cols)
-                out.paste(i,(c*(mw+gap),r*(mh+gap)))
-        p=str(R(output))
-        out.save(p)
-        return J(path=p,size=list(out.size))
+        sizes=[]
+        for f in files:
+            with Image.open(f) as im:
+                w,h=im.size
+            k=min(cell_w/w if cell_w else 1,cell_h/h if cell_h else 1,1)
+            sizes.append((max(1,round(w*k)),max(1,round(h*k))) if k<1 else (w,h))
+        W,H,rows=_composite_layout(sizes,direction,gap,cols)
+        p=R(output)
+        if p.suffix.lower()==".dzi":
+            n=_dzi_write(p,W,H,(_composite_band(files,sizes,[row],W,bg) for row in rows),tile_fmt.lower().lstrip("."))
+            return J(path=str(p),size=[W,H],tiles=n,levels=(max(W,H)-1).bit_length()+1,tiles_dir=str(p.parent/f"{p.stem}_files"))
+        if strip_h>0:
+            groups=[[]]
+            for row in rows:
+                if groups[-1] and row[0]+row[1]-groups[-1][0][0]>strip_h:
+                    groups.append([])
+                groups[-1].append(row)
+            strips=[]
+            for k,g in enumerate(groups):
+                sp=str(p.with_name(f"{p.stem}_{k}{p.suffix}"))
+                _composite_band(files,sizes,g,W,bg).save(sp)
+                strips.append({"path":sp,"y":g[0][0],"h":g[-1][0]+g[-1][1]-g[0][0]})
+            return J(paths=[x["path"] for x in strips],strips=strips,size=[W,H])
+        out=_composite_band(files,sizes,rows,W,bg)
+        out.save(str(p))
+        return J(path=str(p),size=list(out.size))
     except Exception as e:
         return J(False,err=str(e))
 # --- BLENDER SUBSYSTEM: Headless modeling and rendering ---
-@mcp.tool(name="blender_exec")
-async def blender_exec(script:str,blend_file:str="",timeout:int=300)->str:
-    """在Blender后台执行Python脚本
-    script: bpy Python代码
-    blend_file: 可选,.blend文件路径
-    常用: bpy.ops.mesh.primitive_xxx_add / bpy.ops.render.render(write_still=True)"""
+# Warm workers: each runs this loop inside `blender --background [file] --python`,
+# reading one JSON request per stdin line and answering with a prefixed JSON frame
+# on stdout. Anything else the script or Blender prints is passed through as log.
+_BLENDER_WORKER = r'''
+import json, os, sys, traceback
+import bpy
+PREFIX = "\x1e@omni "
+def reply(**kw):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.__stdout__.write(PREFIX + json.dumps(kw) + "\n")
+    sys.__stdout__.flush()
+reply(id=0, ok=True, version=bpy.app.version_string, file=bpy.data.filepath)
+for line in sys.stdin:
+    req = json.loads(line)
+    rid, op = req.get("id"), req.get("op")
     try:
-        sf=WD/"_bpy.py"
+        if op == "exec":
+            code = 0
+            try:
+                exec(compile(req["script"], "<omni_mcp>", "exec"), {"__name__": "__main__"})
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            reply(id=rid, ok=True, code=code, file=bpy.data.filepath)
+        elif op == "reload":
+            if req.get("file"):
+                bpy.ops.wm.open_mainfile(filepath=req["file"])
+            else:
+                bpy.ops.wm.read_homefile()
+            reply(id=rid, ok=True, file=bpy.data.filepath)
+        elif op == "ping":
+            reply(id=rid, ok=True, pid=os.getpid())
+        elif op == "quit":
+            reply(id=rid, ok=True)
+            break
+        else:
+            reply(id=rid, ok=False, err="unknown op: %s" % op)
+    except BaseException:
+        reply(id=rid, ok=False, err=traceback.format_exc())
+'''
+class _BlenderWorker(_PipeWorker):
+    """Warm Blender session holding one blend file (key "" = factory startup scene)."""
+    start_timeout = BLENDER_START_TIMEOUT
+    def _bound(self, filepath: str) -> bool:
+        """Whether Blender's current main file is still the file this session is keyed on."""
+        if not self.key:
+            return not filepath
+        norm = lambda x: os.path.normcase(os.path.abspath(x))
+        return bool(filepath) and norm(filepath) == norm(self.key)
+    def _disk_mtime(self) -> Optional[float]:
+        return os.path.getmtime(self.key) if self.key and os.path.exists(self.key) else None
+    def command(self) -> list:
+        sf = WD / "_blender_worker.py"
+        if not sf.exists() or sf.read_text(encoding="utf-8") != _BLENDER_WORKER:
+            sf.write_text(_BLENDER_WORKER, encoding="utf-8")
+        return [BLENDER, "--background"] + ([self.key] if self.key else []) + ["--python", str(sf)]
+    async def start(self) -> None:
+        await super().start()
+        self.mtime = self._disk_mtime()
+        self.dirty = False
+    async def execute(self, script: str, timeout: float, keep: bool = False) -> Tuple[str, str, int]:
+        """Run `script` in the warm session.
+
+        The session is reloaded first if the file changed on disk, or if an earlier call
+        modified it and `keep` is false, so each call starts from the file as saved.
+        """
+        if self.alive and (self._disk_mtime() != self.mtime or (self.dirty and not keep)):
+            await self.call("reload", self.start_timeout, file=self.key)
+            self.dirty = False
+        msg, out = await self.call("exec", timeout, script=script)
+        self.runs += 1
+        self.dirty = True
+        self.mtime = self._disk_mtime()
+        if not self._bound(msg.get("file", "")):
+            # The script switched files (save_as_mainfile, open_mainfile); drop the process
+            # rather than serve another file's state under this key.
+            self.close()
+        if not msg.get("ok"):
+            return out, msg.get("err", ""), 1
+        return out, "", msg.get("code", 0)
+_BLENDER_POOL = _WorkerPool(_BlenderWorker, BLENDER_WORKERS, BLENDER_IDLE)
+async def _blender_run(script:str,blend_file:str="",timeout:int=300,warm:bool=True,
+                      keep:bool=False)->Tuple[str,str,int]:
+    """Run a bpy script in a warm pooled session or a cold `blender --background` process."""
+    if warm:
+        return await _BLENDER_POOL.run(str(R(blend_file)) if blend_file else "","execute",script,timeout,keep)
+    with _scratch() as sd:
+        sf=Path(sd)/"_bpy.py"
         sf.write_text(script,encoding="utf-8")
         cmd=[BLENDER,"--background"]
         if blend_file:
             cmd.append(str(R(blend_file)))
         cmd.extend(["--python",str(sf)])
-        o,e,c=_run(cmd,timeout=timeout)
+        return await _run(cmd,timeout=timeout)
+@mcp.tool(name="blender_exec")
+async def blender_exec(script:str,blend_file:str="",timeout:int=300,warm:bool=True,
+                       keep:bool=False)->str:
+    """在Blender后台执行Python脚本
+    script: bpy Python代码
+    blend_file: 可选,.blend文件路径
+    warm: true=在常驻Blender会话中执行(按blend_file复用,磁盘文件被外部修改时自动重新加载); false=每次冷启动独立进程
+    keep: true=保留上次调用对场景的修改; false=执行前重新加载blend_file(或启动场景), 与冷启动结果一致
+    脚本另存为/打开其他文件(save_as_mainfile/open_mainfile)后该会话会被回收, 不会串用到其他文件
+    常用: bpy.ops.mesh.primitive_xxx_add / bpy.ops.render.render(write_still=True)"""
+    try:
+        o,e,c=await _blender_run(script,blend_file,timeout,warm,keep)
         return J(stdout=o,stderr=e,code=c)
     except subprocess.TimeoutExpired:
         return J(False,err=f"超时({timeout}s)")
@@ -950,10 +2728,14 @@ async def blender_exec(script:str,blend_file:str="",timeout:int=300)->str:
         return J(False,err=str(e))
 @mcp.tool(name="blender_render")
 async def blender_render(blend_file:str,output:str,engine:str="CYCLES",
-                         rx:int=1920,ry:int=1080,samples:int=128,frame:int=1)->str:
+                         rx:int=1920,ry:int=1080,samples:int=128,frame:int=1,
+                         warm:bool=True)->str:
     """渲染Blender场景
     engine: CYCLES | BLENDER_EEVEE_NEXT
-    output: 输出图片路径(.png/.jpg/.exr)"""
+    output: 输出图片路径(.png/.jpg/.exr)
+    warm: 是否在常驻Blender会话中渲染(同blender_exec); 常驻会话省去Blender进程启动,
+      但会话在上次调用后被修改过时(如上一次渲染), 渲染前仍会重新加载blend_file, 文件加载时间不会省去
+    失败(code非0)时返回ok:false, 并附带Blender输出末尾作为log"""
     op=str(R(output)).replace("\\","\\\\")
     script=f"""import bpy
 s=bpy.context.scene
@@ -967,36 +2749,39 @@ bpy.ops.render.render(write_still=True)
 print('RENDER_DONE:',s.render.filepath)
 """
     try:
-        cmd=[BLENDER,"--background",str(R(blend_file)),"--python-expr",script]
-        o,e,c=_run(cmd,timeout=600)
-        return J(path=str(R(output)),code=c)
+        if warm:
+            o,e,c=await _BLENDER_POOL.run(str(R(blend_file)),"execute",script,600)
+        else:
+            cmd=[BLENDER,"--background",str(R(blend_file)),"--python-expr",script]
+            o,e,c=await _run(cmd,timeout=600)
+        return J(c==0,path=str(R(output)),code=c,**({"log":(o+e)[-2000:]} if c else {}))
     except Exception as e:
         return J(False,err=str(e))
-@mcp.tool(name="blender_scene")
-async def blender_scene(action:str,kw:str="{}",blend_file:str="")->str:
-    """快捷Blender场景操作
-    action: 
-      "add_mesh" - 添加网格 (mesh="cube"|"sphere"|"cylinder"|"cone"|"torus"|"monkey", loc=[0,0,0], scale=[1,1,1])
-      "add_light" - 添加灯光 (light="POINT"|"SUN"|"SPOT"|"AREA", loc=[0,0,5], energy=1000)
-      "add_camera" - 添加相机 (loc=[7,−6,5], rot=[1.1,0,0.8])
-      "set_material" - 设置材质 (obj="Cube", color=[0.8,0.1,0.1,1])
-      "delete" - 删除对象 (obj="Cube")
-      "export" - 导出 (fmt="fbx"|"obj"|"stl"|"gltf", path="out.fbx")
-      "save" - 保存blend文件 (path="scene.blend")
-    kw: JSON对象,传递action所需参数
-    blend_file: 可选,在此文件基础上操作"""
-    kw=json.loads(kw) if isinstance(kw,str) else kw
-    meshes={"cube":"primitive_cube_add","sphere":"primitive_uv_sphere_add",
-            "cylinder":"primitive_cylinder_add","cone":"primitive_cone_add",
-            "torus":"primitive_torus_add","monkey":"primitive_monkey_add",
-            "plane":"primitive_plane_add","ico":"primitive_ico_sphere_add"}
-    exports={"fbx":"export_scene.fbx","obj":"export_scene.obj",
-             "stl":"export_mesh.stl","gltf":"export_scene.gltf"}
-    lines=["import bpy","import math"]
-    a=action
+@mcp.tool(name="blender_pool")
+async def blender_pool(action:str="status",blend_file:str="")->str:
+    """管理常驻Blender会话池
+    action: status=列出会话 | evict=关闭空闲会话(blend_file空=全部,下次调用自动重启)
+    上限/空闲回收由环境变量 OMNI_BLENDER_WORKERS / OMNI_BLENDER_IDLE 控制"""
+    try:
+        if action=="evict":
+            n=await _BLENDER_POOL.shutdown(str(R(blend_file)) if blend_file else None)
+            return J(evicted=n,workers=_BLENDER_POOL.status())
+        return J(workers=_BLENDER_POOL.status(),max_workers=_BLENDER_POOL.size,idle_timeout=_BLENDER_POOL.idle)
+    except Exception as e:
+        return J(False,err=str(e))
+_SCENE_MESHES={"cube":"primitive_cube_add","sphere":"primitive_uv_sphere_add",
+               "cylinder":"primitive_cylinder_add","cone":"primitive_cone_add",
+               "torus":"primitive_torus_add","monkey":"primitive_monkey_add",
+               "plane":"primitive_plane_add","ico":"primitive_ico_sphere_add"}
+_SCENE_EXPORTS={"fbx":"export_scene.fbx","obj":"export_scene.obj",
+                "stl":"export_mesh.stl","gltf":"export_scene.gltf"}
+_SCENE_ACTIONS=("add_mesh","add_light","add_camera","set_material","delete","export","save")
+def _scene_lines(a:str,kw:dict)->list:
+    """Compile one blender_scene action into bpy source lines (empty for unknown actions)."""
+    lines=[]
     if a=="add_mesh":
         m=kw.get("mesh","cube")
-        fn=meshes.get(m,f"primitive_{m}_add")
+        fn=_SCENE_MESHES.get(m,f"primitive_{m}_add")
         loc=kw.get("loc",[0,0,0])
         scl=kw.get("scale",[1,1,1])
         lines.append(f"bpy.ops.mesh.{fn}(location={loc},scale={scl})")
@@ -1024,16 +2809,94 @@ async def blender_scene(action:str,kw:str="{}",blend_file:str="")->str:
     elif a=="export":
         fmt=kw.get("fmt","fbx")
         ep=str(R(kw.get("path",f"out.{fmt}"))).replace("\\","\\\\")
-        fn=exports.get(fmt,f"export_scene.{fmt}")
+        fn=_SCENE_EXPORTS.get(fmt,f"export_scene.{fmt}")
         lines.append(f"bpy.ops.{fn}(filepath=r'{ep}')")
     elif a=="save":
         sp=str(R(kw.get("path","scene.blend"))).replace("\\","\\\\")
         lines.append(f"bpy.ops.wm.save_as_mainfile(filepath=r'{sp}')")
+    return lines
+@mcp.tool(name="blender_scene")
+async def blender_scene(action:str,kw:str="{}",blend_file:str="")->str:
+    """快捷Blender场景操作
+    action: 
+      "add_mesh" - 添加网格 (mesh="cube"|"sphere"|"cylinder"|"cone"|"torus"|"monkey", loc=[0,0,0], scale=[1,1,1])
+      "add_light" - 添加灯光 (light="POINT"|"SUN"|"SPOT"|"AREA", loc=[0,0,5], energy=1000)
+      "add_camera" - 添加相机 (loc=[7,−6,5], rot=[1.1,0,0.8])
+      "set_material" - 设置材质 (obj="Cube", color=[0.8,0.1,0.1,1])
+      "delete" - 删除对象 (obj="Cube")
+      "export" - 导出 (fmt="fbx"|"obj"|"stl"|"gltf", path="out.fbx")
+      "save" - 保存blend文件 (path="scene.blend")
+    kw: JSON对象,传递action所需参数
+    blend_file: 可选,在此文件基础上操作"""
+    kw=json.loads(kw) if isinstance(kw,str) else kw
+    lines=["import bpy","import math"]+_scene_lines(action,kw)
     lines.append("print('DONE')")
     return await blender_exec("\n".join(lines),blend_file)
+@mcp.tool(name="blender_scene_batch")
+async def blender_scene_batch(actions:str="[]",blend_file:str="",atomic:bool=True,
+                              timeout:int=600,warm:bool=True)->str:
+    """批量Blender场景事务: 所有动作编译为一个bpy脚本,在同一进程、同一已加载文件中一次执行
+    actions: JSON数组,按序执行,每项为 {"action":动作名,...参数}, 动作与参数同blender_scene:
+      [{"action":"add_mesh","mesh":"cube","loc":[0,0,0]},
+       {"action":"set_material","obj":"Cube","color":[0.8,0.1,0.1,1]},
+       {"action":"save","path":"scene.blend"}]
+    atomic: true=任一动作失败则跳过后续动作,并将常驻会话恢复为执行前的状态(即磁盘上的blend_file,
+      常驻会话每次调用前都会重新加载); 已写出的文件无法回滚, 因此save/export只能放在批次末尾,
+      其后不能再有修改场景的动作, 末尾的save/export中途失败时之前已写出的文件会保留
+    返回 results: 每个动作一项 {"i":0,"action":"add_mesh","ok":true,"obj":"Cube"}"""
+    try:
+        acts=json.loads(actions) if isinstance(actions,str) else actions
+        if atomic:
+            names=[a.get("action","") for a in acts]
+            tail=len(names)
+            while tail and names[tail-1] in ("save","export"):
+                tail-=1
+            early=[i for i,n in enumerate(names[:tail]) if n in ("save","export")]
+            if early:
+                return J(False,err=f"atomic批次中save/export只能位于末尾(写出的文件无法回滚): 动作 {early}")
+        with _scratch() as sd:
+            rp=Path(sd)/"_scene_results.json"
+            lines=["import bpy","import json","import math","_res=[]","_abort=False"]
+            for i,a in enumerate(acts):
+                name=a.get("action","")
+                body=_scene_lines(name,a)
+                head={"i":i,"action":name}
+                if not body:
+                    lines.append(f"_res.append({dict(head,ok=False,err=f'unknown action: {name}')!r})")
+                    lines.append(f"_abort=_abort or {atomic}")
+                    continue
+                done="dict(ok=True"+(",obj=bpy.context.object.name if bpy.context.object else None" if name.startswith("add_") else "")+")"
+                lines.append("if _abort:")
+                lines.append(f"    _res.append({dict(head,ok=False,skipped=True)!r})")
+                lines.append("else:")
+                lines.append("    try:")
+                lines.extend("        "+ln for ln in body)
+                lines.append(f"        _res.append(dict({head!r},**{done}))")
+                lines.append("    except Exception as _e:")
+                lines.append(f"        _res.append(dict({head!r},ok=False,err=f'{{type(_e).__name__}}: {{_e}}'))")
+                lines.append(f"        _abort={atomic}")
+            if warm and atomic:
+                # 回滚常驻会话中的内存修改,避免keep=true的后续调用看到半完成的场景
+                lines.append("if _abort:")
+                lines.append("    bpy.ops.wm.revert_mainfile() if bpy.data.filepath else bpy.ops.wm.read_homefile()")
+            lines.append(f"json.dump({{'results':_res,'aborted':_abort}},open({str(rp)!r},'w'))")
+            o,e,c=await _blender_run("\n".join(lines),blend_file,timeout,warm)
+            if not rp.exists():
+                return J(False,err="batch script did not complete",stdout=o,stderr=e,code=c)
+            res=json.loads(rp.read_text())
+        failed=sum(1 for r in res["results"] if not r["ok"] and not r.get("skipped"))
+        skipped=sum(1 for r in res["results"] if r.get("skipped"))
+        return J(failed==0,results=res["results"],count=len(acts),failed=failed,skipped=skipped,
+                 aborted=res["aborted"],stdout=o,stderr=e,code=c)
+    except subprocess.TimeoutExpired:
+        return J(False,err=f"超时({timeout}s)")
+    except Exception as e:
+        return J(False,err=str(e))
 # --- SVG SUBSYSTEM: Vector description synthesis ---
 @mcp.tool(name="svg_create")
-async def svg_create(path:str,w:int=800,h:int=600,elements:str="[]",bg:str="")->str:
+@_cached()
+@_offload("io")
+def svg_create(path:str,w:int=800,h:int=600,elements:str="[]",bg:str="")->str:
     """创建SVG
     elements: JSON数组:
       {"tag":"rect","x":0,"y":0,"w":100,"h":50,"fill":"blue","stroke":"black","rx":5}
@@ -1046,7 +2909,8 @@ async def svg_create(path:str,w:int=800,h:int=600,elements:str="[]",bg:str="")->
       {"tag":"polyline","points":"0,0 50,50 100,0","stroke":"blue","fill":"none"}
       {"tag":"group","transform":"translate(100,100) rotate(45)","children":[...]}
       {"tag":"defs","gradient":{"id":"g1","type":"linear","stops":[{"offset":"0%","color":"red"},{"offset":"100%","color":"blue"}]}}
-    bg: 背景色,空=透明"""
+    bg: 背景色,空=透明
+    cache: true=参数与输入文件相同时直接复制缓存产物,跳过重新生成(统计/清理见render_cache)"""
     try:
         parts=[f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">']
         if bg:
@@ -1091,8 +2955,61 @@ async def svg_create(path:str,w:int=800,h:int=600,elements:str="[]",bg:str="")->
     except Exception as e:
         return J(False,err=str(e))
 # --- CHART SUBSYSTEM: Statistical plotting utilities ---
+# Charts are drawn with the object-oriented Figure/FigureCanvasAgg API, never pyplot,
+# so no global figure registry is touched and renders are safe in pool workers.
+_CJK_KEYS=('Microsoft YaHei','SimHei','SimSun','PingFang','Noto Sans CJK')
+_CHART_FIGS=threading.local()
+@functools.lru_cache(maxsize=None)
+def _cjk_font()->Optional[str]:
+    """First installed CJK-capable font, resolved once per process."""
+    import matplotlib.font_manager as fm
+    return next((f.name for f in fm.fontManager.ttflist if any(k in f.name for k in _CJK_KEYS)),None)
+@functools.lru_cache(maxsize=None)
+def _chart_rc(style:str)->dict:
+    """rcParams overrides for `style` (empty/unknown = matplotlib defaults) with CJK fonts applied."""
+    import matplotlib
+    if style in matplotlib.style.library:
+        rc=dict(matplotlib.style.library[style])
+    elif style and os.path.isfile(style):
+        rc=dict(matplotlib.rc_params_from_file(style,use_default_template=False))
+    else:
+        rc={}
+    # 中文字体需排在样式自带的sans-serif列表之前
+    base=list(rc.get('font.sans-serif',matplotlib.rcParamsDefault['font.sans-serif']))
+    font=_cjk_font()
+    rc['font.sans-serif']=([font] if font else ['Microsoft YaHei','SimHei','SimSun'])+base
+    rc['axes.unicode_minus']=False
+    return rc
+@contextlib.contextmanager
+def _chart_style(style:str):
+    """Render under defaults+`style` and restore the process rcParams afterwards."""
+    import matplotlib
+    with matplotlib.rc_context():
+        matplotlib.rcdefaults()
+        matplotlib.rcParams.update(_chart_rc(style))
+        yield
+def _chart_figure(style:str,w:float,h:float):
+    """Per-thread reusable Agg figure for `style`, cleared and resized for a new render.
+    Must be called inside _chart_style(style)."""
+    import matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figs=_CHART_FIGS.__dict__.setdefault("by_style",{})
+    fig=figs.get(style)
+    if fig is None:
+        fig=figs[style]=Figure(facecolor='white')
+        FigureCanvasAgg(fig)
+    else:
+        fig.clear()
+        # tight_layout() moves the subplot params; start every render from the style's values
+        fig.subplotpars.update(**{k:matplotlib.rcParams[f'figure.subplot.{k}']
+                                  for k in ('left','right','bottom','top','wspace','hspace')})
+    fig.set_size_inches(w,h)
+    return fig
 @mcp.tool(name="chart_create")
-async def chart_create(path:str,chart_type:str="line",title:str="",
+@_cached()
+@_offload("cpu")
+def chart_create(path:str,chart_type:str="line",title:str="",
                        x_label:str="",y_label:str="",
                        datasets:str='[{"label":"data","x":[1,2,3],"y":[4,5,6]}]',
                        w:float=10,h:float=6,style:str="default",dpi:int=150,
@@ -1109,125 +3026,114 @@ async def chart_create(path:str,chart_type:str="line",title:str="",
     w,h: 图表宽高(英寸),如 w=8,h=6 → 800×600px(dpi=100)
     annotations: [{"text":"标注","x":2,"y":5,"arrow":true}]
     legend_pos: best|upper right|upper left|lower right|lower left|center
-    已内置CJK中文字体支持,无需额外配置"""
-    import matplotlib
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-    import matplotlib.font_manager as fm
+    已内置CJK中文字体支持,无需额外配置
+    cache: true=参数与输入文件相同时直接复制缓存产物,跳过重新生成(统计/清理见render_cache)"""
     import numpy as np
     try:
-        # 先应用样式(会重置rcParams),再配置中文字体
-        if style in plt.style.available:
-            plt.style.use(style)
-        # 配置中文字体支持(必须在style.use之后,否则会被重置)
-        _cjk=[f.name for f in fm.fontManager.ttflist if any(k in f.name for k in ('Microsoft YaHei','SimHei','SimSun','PingFang','Noto Sans CJK'))]
-        if _cjk:
-            plt.rcParams['font.sans-serif']=[_cjk[0]]+plt.rcParams.get('font.sans-serif',[])
-        else:
-            plt.rcParams['font.sans-serif']=['Microsoft YaHei','SimHei','SimSun']+plt.rcParams.get('font.sans-serif',[])
-        plt.rcParams['axes.unicode_minus']=False
-        fig,ax=plt.subplots(figsize=(w,h),facecolor='white')
-        ax.set_facecolor('white')
-        ds=json.loads(datasets)
-        ct=chart_type
-        if ct=="pie":
-            d=ds[0]
-            ax.pie(d["values"],labels=d["labels"],colors=d.get("colors"),
-                            explode=d.get("explode"),autopct='%1.1f%%',startangle=90)
-        elif ct=="heatmap":
-            d=ds[0]
-            data=np.array(d["data"])
-            im=ax.imshow(data,cmap=d.get("cmap","viridis"),aspect="auto")
-            fig.colorbar(im,ax=ax)
-            if d.get("xlabels"):
-                ax.set_xticks(range(len(d["xlabels"])))
-                ax.set_xticklabels(d["xlabels"])
-            if d.get("ylabels"):
-                ax.set_yticks(range(len(d["ylabels"])))
-                ax.set_yticklabels(d["ylabels"])
-        elif ct=="radar":
-            d=ds[0]
-            labels=d.get("labels",[])
-            vals=d["y"]
-            N=len(labels)
-            angles=np.linspace(0,2*np.pi,N,endpoint=False).tolist()
-            vals=vals+vals[:1]
-            angles+=angles[:1]
-            ax=fig.add_subplot(111,polar=True)
-            ax.plot(angles,vals)
-            ax.fill(angles,vals,alpha=0.25)
-            ax.set_xticks(angles[:-1])
-            ax.set_xticklabels(labels)
-        else:
-            bottom_stack=None
-            for d in ds:
-                lb=d.get("label","")
-                cl=d.get("color")
-                kw={"label":lb}
-                if cl:
-                    kw["color"]=cl
-                if d.get("marker"):
-                    kw["marker"]=d["marker"]
-                if d.get("linestyle"):
-                    kw["linestyle"]=d["linestyle"]
-                if d.get("linewidth"):
-                    kw["linewidth"]=d["linewidth"]
-                x,y=d.get("x"),d.get("y",[])
-                if ct=="line":
-                    ax.plot(x,y,**kw)
-                elif ct=="step":
-                    ax.step(x,y,**kw)
-                elif ct=="stem":
-                    ax.stem(x,y,label=lb)
-                elif ct=="bar":
-                    ax.bar(x,y,**kw)
-                elif ct=="hbar":
-                    ax.barh(x,y,**kw)
-                elif ct=="stackbar":
-                    if bottom_stack is None:
-                        ax.bar(x,y,**kw)
-                        bottom_stack=np.array(y)
-                    else:
-                        ax.bar(x,y,bottom=bottom_stack,**kw)
-                        bottom_stack+=np.array(y)
-                elif ct=="scatter":
-                    ax.scatter(x,y,s=d.get("size",20),**kw)
-                elif ct=="area":
-                    ax.fill_between(x,y,alpha=0.5,**kw)
-                elif ct=="hist":
-                    ax.hist(y,bins=d.get("bins",20),**kw)
-                elif ct=="box":
-                    ax.boxplot([dd["y"] for dd in ds],labels=[dd.get("label","") for dd in ds])
-                    break
-            if ct not in("box",):
-                ax.legend(loc=legend_pos)
-        # annotations
-        for ann in json.loads(annotations):
-            kw2={"fontsize":ann.get("fontsize",10)}
-            if ann.get("arrow"):
-                ax.annotate(ann["text"],xy=(ann["x"],ann["y"]),xytext=(ann.get("tx",ann["x"]+1),ann.get("ty",ann["y"]+1)),
-                           arrowprops=dict(arrowstyle="->"),**kw2)
+        with _chart_style(style):
+            fig=_chart_figure(style,w,h)
+            ax=fig.subplots()
+            ax.set_facecolor('white')
+            ds=json.loads(datasets)
+            ct=chart_type
+            if ct=="pie":
+                d=ds[0]
+                ax.pie(d["values"],labels=d["labels"],colors=d.get("colors"),
+                                explode=d.get("explode"),autopct='%1.1f%%',startangle=90)
+            elif ct=="heatmap":
+                d=ds[0]
+                data=np.array(d["data"])
+                im=ax.imshow(data,cmap=d.get("cmap","viridis"),aspect="auto")
+                fig.colorbar(im,ax=ax)
+                if d.get("xlabels"):
+                    ax.set_xticks(range(len(d["xlabels"])))
+                    ax.set_xticklabels(d["xlabels"])
+                if d.get("ylabels"):
+                    ax.set_yticks(range(len(d["ylabels"])))
+                    ax.set_yticklabels(d["ylabels"])
+            elif ct=="radar":
+                d=ds[0]
+                labels=d.get("labels",[])
+                vals=d["y"]
+                N=len(labels)
+                angles=np.linspace(0,2*np.pi,N,endpoint=False).tolist()
+                vals=vals+vals[:1]
+                angles+=angles[:1]
+                ax=fig.add_subplot(111,polar=True)
+                ax.plot(angles,vals)
+                ax.fill(angles,vals,alpha=0.25)
+                ax.set_xticks(angles[:-1])
+                ax.set_xticklabels(labels)
             else:
-                ax.text(ann["x"],ann["y"],ann["text"],**kw2)
-        if grid:
-            ax.grid(True,alpha=0.3)
-        if title:
-            ax.set_title(title)
-        if x_label:
-            ax.set_xlabel(x_label)
-        if y_label:
-            ax.set_ylabel(y_label)
-        if x_rotation:
-            plt.xticks(rotation=x_rotation)
-        plt.tight_layout()
-        p=str(R(path))
-        fig.savefig(p,dpi=dpi,bbox_inches='tight',facecolor='white')
-        plt.close()
-        return J(path=p)
+                bottom_stack=None
+                for d in ds:
+                    lb=d.get("label","")
+                    cl=d.get("color")
+                    kw={"label":lb}
+                    if cl:
+                        kw["color"]=cl
+                    if d.get("marker"):
+                        kw["marker"]=d["marker"]
+                    if d.get("linestyle"):
+                        kw["linestyle"]=d["linestyle"]
+                    if d.get("linewidth"):
+                        kw["linewidth"]=d["linewidth"]
+                    x,y=d.get("x"),d.get("y",[])
+                    if ct=="line":
+                        ax.plot(x,y,**kw)
+                    elif ct=="step":
+                        ax.step(x,y,**kw)
+                    elif ct=="stem":
+                        ax.stem(x,y,label=lb)
+                    elif ct=="bar":
+                        ax.bar(x,y,**kw)
+                    elif ct=="hbar":
+                        ax.barh(x,y,**kw)
+                    elif ct=="stackbar":
+                        if bottom_stack is None:
+                            ax.bar(x,y,**kw)
+                            bottom_stack=np.array(y)
+                        else:
+                            ax.bar(x,y,bottom=bottom_stack,**kw)
+                            bottom_stack+=np.array(y)
+                    elif ct=="scatter":
+                        ax.scatter(x,y,s=d.get("size",20),**kw)
+                    elif ct=="area":
+                        ax.fill_between(x,y,alpha=0.5,**kw)
+                    elif ct=="hist":
+                        ax.hist(y,bins=d.get("bins",20),**kw)
+                    elif ct=="box":
+                        ax.boxplot([dd["y"] for dd in ds],labels=[dd.get("label","") for dd in ds])
+                        break
+                if ct not in("box",):
+                    ax.legend(loc=legend_pos)
+            # annotations
+            for ann in json.loads(annotations):
+                kw2={"fontsize":ann.get("fontsize",10)}
+                if ann.get("arrow"):
+                    ax.annotate(ann["text"],xy=(ann["x"],ann["y"]),xytext=(ann.get("tx",ann["x"]+1),ann.get("ty",ann["y"]+1)),
+                               arrowprops=dict(arrowstyle="->"),**kw2)
+                else:
+                    ax.text(ann["x"],ann["y"],ann["text"],**kw2)
+            if grid:
+                ax.grid(True,alpha=0.3)
+            if title:
+                ax.set_title(title)
+            if x_label:
+                ax.set_xlabel(x_label)
+            if y_label:
+                ax.set_ylabel(y_label)
+            if x_rotation:
+                ax.tick_params(axis='x',labelrotation=x_rotation)
+            fig.tight_layout()
+            p=str(R(path))
+            fig.savefig(p,dpi=dpi,bbox_inches='tight',facecolor='white')
+            return J(path=p)
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="chart_subplot")
-async def chart_subplot(path:str,rows:int=1,cols:int=2,
+@_offload("cpu")
+def chart_subplot(path:str,rows:int=1,cols:int=2,
                         subplots:str="[]",w:float=14,h:float=6,dpi:int=150,
                         title:str="",style:str="")->str:
     """创建多子图
@@ -1235,156 +3141,563 @@ async def chart_subplot(path:str,rows:int=1,cols:int=2,
       {"title":"","chart_type":"line|bar|scatter|pie|area","datasets":[...],"x_label":"","y_label":"","grid":true}
     datasets格式同chart_create
     pie需要 x(标签) y(数值) colors(可选颜色列表)"""
-    import matplotlib
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-    import matplotlib.font_manager as fm
     try:
-        # 先应用样式(会重置rcParams),再配置中文字体
-        if style:
-            try:
-                plt.style.use(style)
-            except:
-                pass
-        # 配置中文字体支持(必须在style.use之后,否则会被重置)
-        _cjk=[f.name for f in fm.fontManager.ttflist if any(k in f.name for k in ('Microsoft YaHei','SimHei','SimSun','PingFang','Noto Sans CJK'))]
-        if _cjk:
-            plt.rcParams['font.sans-serif']=[_cjk[0]]+plt.rcParams.get('font.sans-serif',[])
-        else:
-            plt.rcParams['font.sans-serif']=['Microsoft YaHei','SimHei','SimSun']+plt.rcParams.get('font.sans-serif',[])
-        plt.rcParams['axes.unicode_minus']=False
-        fig,axes=plt.subplots(rows,cols,figsize=(w,h),facecolor='white')
-        if rows*cols==1:
-            axes=[axes]
-        elif rows==1 or cols==1:
-            axes=axes.flatten()
-        else:
-            axes=axes.flatten()
-        subs=json.loads(subplots)
-        for i,sp in enumerate(subs):
-            if i>=len(axes):
-                break
-            ax=axes[i]
-            ct=sp.get("chart_type","line")
-            if ct=="pie":
-                d=sp.get("datasets",[{}])[0]
-                labels=d.get("x",[])
-                sizes=d.get("y",[])
-                cs=d.get("colors",None)
-                ax.pie(sizes,labels=labels,colors=cs,autopct='%1.1f%%',startangle=90,textprops={'fontsize':8})
-                ax.set_aspect('equal')
+        with _chart_style(style):
+            fig=_chart_figure(style,w,h)
+            axes=fig.subplots(rows,cols)
+            if rows*cols==1:
+                axes=[axes]
+            elif rows==1 or cols==1:
+                axes=axes.flatten()
             else:
-                for d in sp.get("datasets",[]):
-                    x,y=d.get("x"),d.get("y",[])
-                    lb=d.get("label","")
-                    kw={"label":lb}
-                    if d.get("color"):
-                        kw["color"]=d["color"]
-                    if d.get("alpha"):
-                        kw["alpha"]=d["alpha"]
-                    if ct=="line":
-                        ax.plot(x,y,**kw)
-                    elif ct=="bar":
-                        ax.bar(x,y,**kw)
-                    elif ct=="scatter":
-                        ax.scatter(x,y,**kw)
-                    elif ct=="area":
-                        ax.fill_between(x,y,alpha=d.get("alpha",0.4),**{k:v for k,v in kw.items() if k!="alpha"})
-                if sp.get("x_label"):
-                    ax.set_xlabel(sp["x_label"])
-                if sp.get("y_label"):
-                    ax.set_ylabel(sp["y_label"])
-                if sp.get("grid",True):
-                    ax.grid(True,alpha=0.3)
-                ax.legend()
-            if sp.get("title"):
-                ax.set_title(sp["title"])
-        if title:
-            fig.suptitle(title,fontsize=14,fontweight='bold',y=1.02)
-        plt.tight_layout()
-        p=str(R(path))
-        fig.savefig(p,dpi=dpi,bbox_inches='tight',facecolor='white')
-        plt.close()
-        return J(path=p)
+                axes=axes.flatten()
+            subs=json.loads(subplots)
+            for i,sp in enumerate(subs):
+                if i>=len(axes):
+                    break
+                ax=axes[i]
+                ct=sp.get("chart_type","line")
+                if ct=="pie":
+                    d=sp.get("datasets",[{}])[0]
+                    labels=d.get("x",[])
+                    sizes=d.get("y",[])
+                    cs=d.get("colors",None)
+                    ax.pie(sizes,labels=labels,colors=cs,autopct='%1.1f%%',startangle=90,textprops={'fontsize':8})
+                    ax.set_aspect('equal')
+                else:
+                    for d in sp.get("datasets",[]):
+                        x,y=d.get("x"),d.get("y",[])
+                        lb=d.get("label","")
+                        kw={"label":lb}
+                        if d.get("color"):
+                            kw["color"]=d["color"]
+                        if d.get("alpha"):
+                            kw["alpha"]=d["alpha"]
+                        if ct=="line":
+                            ax.plot(x,y,**kw)
+                        elif ct=="bar":
+                            ax.bar(x,y,**kw)
+                        elif ct=="scatter":
+                            ax.scatter(x,y,**kw)
+                        elif ct=="area":
+                            ax.fill_between(x,y,alpha=d.get("alpha",0.4),**{k:v for k,v in kw.items() if k!="alpha"})
+                    if sp.get("x_label"):
+                        ax.set_xlabel(sp["x_label"])
+                    if sp.get("y_label"):
+                        ax.set_ylabel(sp["y_label"])
+                    if sp.get("grid",True):
+                        ax.grid(True,alpha=0.3)
+                    ax.legend()
+                if sp.get("title"):
+                    ax.set_title(sp["title"])
+            if title:
+                fig.suptitle(title,fontsize=14,fontweight='bold',y=1.02)
+            fig.tight_layout()
+            p=str(R(path))
+            fig.savefig(p,dpi=dpi,bbox_inches='tight',facecolor='white')
+            return J(path=p)
+    except Exception as e:
+        return J(False,err=str(e))
+def _chart_job(i: int, spec: dict) -> dict:
+    """Render one chart_batch spec inside a pool worker; failures are reported, never raised."""
+    t0 = time.perf_counter()
+    spec = dict(spec)
+    tool = spec.pop("tool", "chart_subplot" if "subplots" in spec else "chart_create")
+    try:
+        if tool not in ("chart_create", "chart_subplot"):
+            raise ValueError(f"unknown tool: {tool}")
+        # Specs arrive as parsed JSON; the tool bodies expect these fields as JSON text.
+        for k in ("datasets", "annotations", "subplots"):
+            if k in spec and not isinstance(spec[k], str):
+                spec[k] = json.dumps(spec[k])
+        r = json.loads(inspect.unwrap(globals()[tool])(**spec))
+    except Exception as e:
+        r = {"ok": False, "err": str(e)}
+    return dict(r, i=i, tool=tool, time_s=round(time.perf_counter() - t0, 3))
+@mcp.tool(name="chart_batch")
+async def chart_batch(specs:str="[]")->str:
+    """批量渲染图表,多个图表在CPU进程池中并行绘制(并行度由OMNI_CPU_WORKERS控制)
+    specs: JSON数组, 每项为一个图表, 参数同chart_create或chart_subplot:
+      [{"path":"a.png","chart_type":"bar","datasets":[...]},
+       {"tool":"chart_subplot","path":"b.png","rows":1,"cols":2,"subplots":[...]}]
+    tool: chart_create|chart_subplot, 省略时含subplots字段的按chart_subplot处理
+    单个图表失败不影响其余图表
+    返回 results: 每项 {"i":0,"tool":"chart_create","ok":true,"path":"...","time_s":0.21} 或 {"ok":false,"err":"..."}"""
+    try:
+        items=json.loads(specs) if isinstance(specs,str) else specs
+        t0=time.perf_counter()
+        async def one(i,sp):
+            try:
+                return await _submit("cpu",_chart_job,i,sp)
+            except BrokenProcessPool as e:
+                return {"i":i,"ok":False,"err":f"worker crashed: {e}"}
+        res=await asyncio.gather(*(one(i,sp) for i,sp in enumerate(items)))
+        failed=sum(1 for r in res if not r["ok"])
+        return J(failed==0,results=res,count=len(res),failed=failed,
+                 wall_s=round(time.perf_counter()-t0,3),render_s=round(sum(r.get("time_s",0) for r in res),3))
     except Exception as e:
         return J(False,err=str(e))
 # --- MATLAB SUBSYSTEM: Batch script execution ---
+# Warm sessions: `matlab -batch` runs this loop, which reads JSON requests from stdin
+# through Java and evaluates them in the base workspace, answering with prefixed frames.
+_MATLAB_SERVER = r"""function omni_matlab_server()
+% omni_mcp warm MATLAB session: JSON-lines requests on stdin, prefixed JSON frames on stdout.
+prefix = [char(30) '@omni '];
+rd = java.io.BufferedReader(java.io.InputStreamReader(java.lang.System.in, 'UTF-8'));
+omni_reply(prefix, struct('id', 0, 'ok', true, 'version', version));
+while true
+    line = rd.readLine();
+    if isempty(line), break; end
+    req = jsondecode(char(line));
+    rep = struct('id', req.id, 'ok', true, 'out', '', 'err', '');
+    try
+        switch req.op
+            case 'eval'
+                if ~req.keep
+                    evalin('base', 'clear'); close all force;
+                end
+                cd(req.cwd);
+                rep.out = evalc('evalin(''base'', req.code)');
+            case 'reset'
+                evalin('base', 'clear'); close all force;
+                cd(req.cwd);
+            case 'ping'
+            case 'quit'
+                omni_reply(prefix, rep);
+                break;
+            otherwise
+                rep.ok = false;
+                rep.err = ['unknown op: ' req.op];
+        end
+    catch e
+        rep.ok = false;
+        rep.err = getReport(e, 'basic');
+    end
+    omni_reply(prefix, rep);
+end
+end
+function omni_reply(prefix, rep)
+fprintf(1, '%s%s\n', prefix, jsonencode(rep));
+end
+"""
+class _MatlabWorker(_PipeWorker):
+    """Warm MATLAB session; `keep` decides whether the base workspace survives between calls."""
+    start_timeout = MATLAB_START_TIMEOUT
+    def command(self) -> list:
+        d = WD / "_omni_matlab"
+        d.mkdir(exist_ok=True)
+        sf = d / "omni_matlab_server.m"
+        if not sf.exists() or sf.read_text(encoding="utf-8") != _MATLAB_SERVER:
+            sf.write_text(_MATLAB_SERVER, encoding="utf-8")
+        return [MATLAB, "-batch", f"addpath('{str(d).replace(chr(92), '/')}'); omni_matlab_server"]
+    async def execute(self, code: str, timeout: float, keep: bool) -> Tuple[str, str, int]:
+        msg, log = await self.call("eval", timeout, code=code, keep=keep, cwd=str(WD))
+        self.runs += 1
+        out = _Capture(2000, 2000)
+        out.feed(log + (msg.get("out") or ""))
+        return out.text(), msg.get("err") or "", 0 if msg.get("ok") else 1
+    async def reset(self) -> None:
+        await self.call("reset", self.start_timeout, cwd=str(WD))
+_MATLAB_POOL = _WorkerPool(_MatlabWorker, MATLAB_SESSIONS, MATLAB_IDLE)
 @mcp.tool(name="matlab_exec")
-async def matlab_exec(script:str,timeout:int=120)->str:
+async def matlab_exec(script:str,timeout:int=120,session:str="default",
+                      keep:bool=False,warm:bool=True)->str:
     """执行MATLAB脚本
-    script: MATLAB代码(自动添加exit)
+    script: MATLAB代码(冷启动模式自动添加exit)
     常用: plot,surf,solve,eig,fft,ode45,simulink等
-    输出图片用: saveas(gcf,'output.png')"""
+    输出图片用: saveas(gcf,'output.png')
+    warm: true=发送到常驻MATLAB会话(首次调用需启动MATLAB,之后几乎即时); false=每次matlab -batch
+    session: 常驻会话名,不同名称对应不同MATLAB进程; 同时存活的会话数受OMNI_MATLAB_SESSIONS限制(默认1),
+      超出时最久未用的空闲会话被关闭, 其工作区丢失(如默认的"default"会话会被新会话名挤掉)
+    keep: true=保留上次调用的工作区变量; false=执行前清空工作区并关闭图窗"""
     try:
-        sf=WD/"omnirun.m"
-        sf.write_text(script+"\nexit;\n",encoding="utf-8")
-        mdir=str(WD).replace("\\","/")
-        cmd=[MATLAB,"-batch",f"cd('{mdir}'); run('omnirun.m')"]
-        o,e,c=_run(cmd,timeout=timeout)
+        if warm:
+            o,e,c=await _MATLAB_POOL.run(session,"execute",script,timeout,keep)
+            return J(stdout=o,stderr=e,code=c)
+        with _scratch() as sd:
+            sf=Path(sd)/"omnirun.m"
+            sf.write_text(script+"\nexit;\n",encoding="utf-8")
+            mdir=str(WD).replace("\\","/")
+            # 脚本放在私有目录并加入path,工作目录仍为WD,相对路径输出不变
+            sdir=sd.replace("\\","/")
+            cmd=[MATLAB,"-batch",f"addpath('{sdir}'); cd('{mdir}'); omnirun"]
+            o,e,c=await _run(cmd,timeout=timeout)
         return J(stdout=o,stderr=e,code=c)
     except subprocess.TimeoutExpired:
         return J(False,err=f"MATLAB超时({timeout}s)")
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="matlab_eval")
-async def matlab_eval(expr:str,timeout:int=60)->str:
+async def matlab_eval(expr:str,timeout:int=60,session:str="default",
+                      keep:bool=False,warm:bool=True)->str:
     """快速执行MATLAB表达式并返回结果
     expr: 单行或多行MATLAB表达式
-    例: "eig([1 2;3 4])" 或 "x=linspace(0,2*pi); y=sin(x); plot(x,y); saveas(gcf,'sin.png')" """
+    例: "eig([1 2;3 4])" 或 "x=linspace(0,2*pi); y=sin(x); plot(x,y); saveas(gcf,'sin.png')"
+    warm/session/keep: 同matlab_exec,默认使用常驻会话"""
     try:
+        if warm:
+            o,e,c=await _MATLAB_POOL.run(session,"execute",expr,timeout,keep)
+            return J(stdout=o,stderr=e,code=c)
         cmd=[MATLAB,"-batch",expr]
-        o,e,c=_run(cmd,timeout=timeout)
+        o,e,c=await _run(cmd,timeout=timeout)
         return J(stdout=o,stderr=e,code=c)
+    except subprocess.TimeoutExpired:
+        return J(False,err=f"MATLAB超时({timeout}s)")
+    except Exception as e:
+        return J(False,err=str(e))
+@mcp.tool(name="matlab_session")
+async def matlab_session(action:str="status",session:str="")->str:
+    """管理常驻MATLAB会话
+    action: status=列出会话 | reset=清空会话工作区并关闭图窗 | evict=关闭空闲会话(session空=全部)
+    上限/空闲回收由环境变量 OMNI_MATLAB_SESSIONS / OMNI_MATLAB_IDLE 控制"""
+    try:
+        if action=="reset":
+            await _MATLAB_POOL.run(session or "default","reset")
+        elif action=="evict":
+            n=await _MATLAB_POOL.shutdown(session or None)
+            return J(evicted=n,sessions=_MATLAB_POOL.status())
+        return J(sessions=_MATLAB_POOL.status(),max_sessions=_MATLAB_POOL.size,idle_timeout=_MATLAB_POOL.idle)
+    except subprocess.TimeoutExpired:
+        return J(False,err="MATLAB会话启动超时")
     except Exception as e:
         return J(False,err=str(e))
 # --- FFMPEG SUBSYSTEM: Media probing and transcoding ---
+_FF_DURATION = re.compile(r"Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)")
+_FF_LIMIT = re.compile(r"(?:^|\s)-t\s+(\S+)")
+_FF_PROGRESS_LINE = re.compile(r"(?:frame|fps|stream_\d+_\d+_q|bitrate|total_size|out_time(?:_us|_ms)?|"
+                               r"dup_frames|drop_frames|speed|progress)=.*\n?")
+def _ff_seconds(v: str) -> Optional[float]:
+    """ffmpeg time syntax ("90", "1:30", "00:01:30.5") to seconds; None if unparseable."""
+    try:
+        return sum(float(x) * 60 ** i for i, x in enumerate(reversed(v.strip().split(":"))))
+    except ValueError:
+        return None
+class _FFProgress:
+    """`on_line` parser for ffmpeg's `-progress` key=value blocks, forwarded as MCP progress.
+
+    Trackers sharing a `group` (the segments of one job) report combined figures. Without a
+    known duration, the first "Duration:" line ffmpeg logs for its input is used."""
+    def __init__(self, ctx: Optional[Context], duration: Optional[float] = None, stream: str = "stdout",
+                 group: Optional[list] = None) -> None:
+        self.ctx, self.duration, self.stream = ctx, duration, stream
+        self.group = group if group is not None else []
+        self.group.append(self)
+        self.block: Dict[str, str] = {}
+        self.last: Dict[str, str] = {}
+    def _num(self, key: str) -> float:
+        try:
+            return float(self.last.get(key, "").rstrip("x"))
+        except ValueError:
+            return 0.0
+    @property
+    def out_time(self) -> float:
+        return max(self._num("out_time_us") or self._num("out_time_ms"), 0) / 1e6
+    async def __call__(self, stream: str, line: str) -> None:
+        if self.duration is None and "Duration:" in line:
+            m = _FF_DURATION.search(line)
+            if m:
+                self.duration = int(m[1]) * 3600 + int(m[2]) * 60 + float(m[3])
+        if stream != self.stream:
+            return
+        k, sep, v = line.strip().partition("=")
+        if not sep:
+            return
+        self.block[k] = v.strip()
+        if k == "progress":
+            self.last, self.block = self.block, {}
+            s = self.summary()
+            msg = f"frame={s['frames']} fps={s['fps']} speed={s['speed']}x out_time={s['out_time_s']}s"
+            if s["percent"] is None:
+                await _notify(self.ctx, s["out_time_s"], None, message=msg)
+            else:
+                await _notify(self.ctx, s["percent"], 100, message=msg)
+    def summary(self) -> dict:
+        """Latest counters, summed over the group."""
+        g = self.group
+        done = sum(p.out_time for p in g)
+        size = int(sum(p._num("total_size") for p in g))
+        total = next((p.duration for p in g if p.duration), None)
+        # Rates add up across processes still running; once all are done, report their mean.
+        live = [p for p in g if p.last.get("progress") == "continue"]
+        rated = live or [p for p in g if p.last]
+        k = 1 if live else max(len(rated), 1)
+        return {"frames": int(sum(p._num("frame") for p in g)), "fps": round(sum(p._num("fps") for p in rated) / k, 2),
+                "speed": round(sum(p._num("speed") for p in rated) / k, 3), "out_time_s": round(done, 3),
+                "duration_s": total, "percent": round(min(100.0, 100 * done / total), 1) if total else None,
+                "size_bytes": size, "bitrate_kbps": round(size * 8 / done / 1000, 1) if done else None,
+                "dup_frames": int(sum(p._num("dup_frames") for p in g)),
+                "drop_frames": int(sum(p._num("drop_frames") for p in g)),
+                "finished": all(p.last.get("progress") == "end" for p in g)}
 @mcp.tool(name="ffmpeg_exec")
-async def ffmpeg_exec(args:str,timeout:int=300)->str:
+async def ffmpeg_exec(args:str,timeout:int=300,ctx:Context=None)->str:
     """执行FFmpeg命令(不含ffmpeg前缀)
     args: FFmpeg参数字符串
     例: "-i input.mp4 -ss 00:01:00 -t 30 -c copy clip.mp4"
     例: "-i video.mp4 -vf scale=1280:720 output.mp4"
-    例: "-i input.mp4 -vn -acodec libmp3lame audio.mp3" """
+    例: "-i input.mp4 -vn -acodec libmp3lame audio.mp3"
+    运行中通过MCP进度通知推送 帧数/fps/速度/已输出时长/百分比(按输入时长计算)
+    返回结构化统计(frames/fps/speed/out_time_s/percent/size_bytes...); 失败时附带stderr末尾作为log
+    ffmpeg自身写到stdout的内容(如 -version / -encoders / -h)在stdout中返回"""
     try:
-        cmd=f'"{FFMPEG}" {args}'
-        o,e,c=_run(cmd,timeout=timeout,shell=True)
-        return J(stdout=o,stderr=e[-2000:],code=c)
+        # 输出写到stdout("-"或pipe:)时, 进度改走stderr
+        piped=bool(re.search(r"(?:^|\s)(?:-|pipe:1?)(?:\s|$)",args))
+        prog=_FFProgress(ctx,stream="stderr" if piped else "stdout")
+        cmd=f'"{FFMPEG}" -progress {"pipe:2" if piped else "pipe:1"} -nostats {args}'
+        o,e,c=await _run(cmd,timeout=timeout,shell=True,on_line=prog)
+        if not piped:
+            # 去掉-progress的key=value行, 保留ffmpeg的其他输出
+            o="".join(ln for ln in o.splitlines(keepends=True) if not _FF_PROGRESS_LINE.fullmatch(ln))
+        extra={"stdout":o} if o.strip() else {}
+        if c:
+            extra["log"]=e[-2000:]
+        return J(c==0,code=c,**(prog.summary() if prog.last else {}),**extra)
     except Exception as e:
         return J(False,err=str(e))
+_MEDIA_EXTS = {".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi", ".flv", ".wmv", ".ts", ".mts", ".m2ts",
+               ".mpg", ".mpeg", ".3gp", ".mp3", ".wav", ".flac", ".aac", ".m4a", ".ogg", ".opus", ".wma"}
+class _ProbeIndex:
+    """ffprobe summaries persisted in SQLite; an entry is valid while the file's size and
+    mtime are unchanged, so edits and re-encodes are picked up without explicit eviction.
+    Rows written by an older record layout (database user_version below `version`) are
+    dropped when the database is opened, so those files are probed again."""
+    version = 1  # bump whenever _probe_summary's record gains or changes fields
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.hits = self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS probe "
+                             "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)")
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != self.version:
+                self._db.execute("DELETE FROM probe")
+                self._db.execute(f"PRAGMA user_version={int(self.version)}")
+        return self._db
+    def get(self, path: str, st: os.stat_result) -> Optional[dict]:
+        with self._lock:
+            row = self._conn().execute("SELECT size, mtime_ns, data FROM probe WHERE path=?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            self.hits += 1
+            return json.loads(row[2])
+        self.misses += 1
+        return None
+    def put(self, path: str, st: os.stat_result, data: dict) -> None:
+        with self._lock:
+            self._conn().execute("INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?)",
+                                 (path, st.st_size, st.st_mtime_ns, json.dumps(data, ensure_ascii=False)))
+_PROBES = _ProbeIndex(PROBE_DB)
+def _probe_summary(info: dict) -> dict:
+    """Condense `ffprobe -show_format -show_streams` JSON into the cached metadata record."""
+    fmt = info.get("format", {})
+    out: Dict[str, Any] = {"duration": fmt.get("duration"), "start_time": fmt.get("start_time"), "size": fmt.get("size"),
+                           "format": fmt.get("format_name"), "bitrate": fmt.get("bit_rate"),
+                           "tags": fmt.get("tags", {}), "streams": []}
+    for s in info.get("streams", []):
+        kind = s.get("codec_type")
+        st = {"index": s.get("index"), "type": kind, "codec": s.get("codec_name"), "profile": s.get("profile"),
+              "bitrate": s.get("bit_rate"), "duration": s.get("duration"),
+              "language": s.get("tags", {}).get("language")}
+        if kind == "video":
+            rot = next((d["rotation"] for d in s.get("side_data_list", []) if "rotation" in d),
+                       s.get("tags", {}).get("rotate"))
+            st.update(width=s.get("width"), height=s.get("height"), fps=s.get("r_frame_rate"),
+                      avg_fps=s.get("avg_frame_rate"), pix_fmt=s.get("pix_fmt"), frames=s.get("nb_frames"),
+                      rotation=int(float(rot)) if rot is not None else 0)
+        elif kind == "audio":
+            st.update(sample_rate=s.get("sample_rate"), channels=s.get("channels"),
+                      channel_layout=s.get("channel_layout"))
+        out["streams"].append(st)
+        # The first real stream of each kind is the summary; cover art is a video stream too.
+        if kind in ("video", "audio") and kind not in out and not s.get("disposition", {}).get("attached_pic"):
+            if kind == "video":
+                out["video"] = {"codec": st["codec"], "width": st["width"], "height": st["height"],
+                                "fps": st["fps"], "rotation": st["rotation"]}
+            else:
+                out["audio"] = {"codec": st["codec"], "sample_rate": st["sample_rate"], "channels": st["channels"]}
+    return out
+async def _keyframe_times(path: str, window: float = 0, timeout: float = 300) -> list:
+    """Sorted keyframe timestamps of the first video stream, read from packet flags (demux
+    only, nothing is decoded); `window` limits the scan to the first seconds of the file."""
+    cmd = [FFPROBE, "-v", "quiet", "-select_streams", "v:0"]
+    if window:
+        cmd += ["-read_intervals", f"%+{window}"]
+    o, _, _ = await _run(cmd + ["-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path],
+                         timeout=timeout, clamp=False)
+    ts = []
+    for line in o.splitlines():
+        t, _, flags = line.partition(",")
+        if "K" in flags and t not in ("", "N/A"):
+            ts.append(float(t))
+    return sorted(ts)
+async def _probe_keyframes(path: str, window: float = 30) -> dict:
+    """Keyframe spacing of the first video stream over the first `window` seconds
+    (None when fewer than two keyframes fall inside the window)."""
+    ts = await _keyframe_times(path, window)
+    if len(ts) < 2:
+        return {"keyframe_interval": None, "keyframe_max": None}
+    gaps = [b - a for a, b in zip(ts, ts[1:])]
+    return {"keyframe_interval": round(sum(gaps) / len(gaps), 3), "keyframe_max": round(max(gaps), 3)}
+async def _probe(path: str, refresh: bool = False, keyframes: bool = False) -> dict:
+    """ffprobe summary of one media file, served from the on-disk index when still valid.
+
+    `keyframes` adds the keyframe spacing of video files, which costs a second ffprobe
+    over the first 30 s; it is stored with the record, so only the first such call pays."""
+    st = os.stat(path)
+    data = None if refresh else await _submit("io", _PROBES.get, path, st)
+    if data is not None:
+        if not keyframes or "video" not in data or "keyframe_interval" in data:
+            return dict(data, cached=True)
+        data.update(await _probe_keyframes(path))
+        await _submit("io", _PROBES.put, path, st, data)
+        return dict(data, cached=True)
+    o, e, c = await _run([FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+                         timeout=30, clamp=False)
+    o = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\ufffd]", "", o)
+    if not o.strip():
+        raise RuntimeError(f"ffprobe failed (code {c}): {e.strip()[-300:]}")
+    data = _probe_summary(json.loads(o))
+    if keyframes and "video" in data:
+        data.update(await _probe_keyframes(path))
+    await _submit("io", _PROBES.put, path, st, data)
+    return dict(data, cached=False)
 @mcp.tool(name="ffmpeg_info")
-async def ffmpeg_info(path:str)->str:
-    """获取媒体文件信息(时长/分辨率/编码等)"""
-    try:
-        ffprobe=FFMPEG.replace("ffmpeg","ffprobe") if "ffmpeg" in FFMPEG.lower() else "ffprobe"
-        import re as _re
-        r=subprocess.run([ffprobe,"-v","quiet","-print_format","json","-show_format","-show_streams",str(R(path))],
-                         capture_output=True,text=True,timeout=30,stdin=subprocess.DEVNULL)
-        o=_re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffd]','',r.stdout or "")
-        info=json.loads(o) if o.strip() else {}
-        fmt=info.get("format",{})
-        streams=info.get("streams",[])
-        result={"duration":fmt.get("duration"),"size":fmt.get("size"),
-                "format":fmt.get("format_name"),"bitrate":fmt.get("bit_rate")}
-        for s in streams:
-            if s["codec_type"]=="video":
-                result["video"]={"codec":s.get("codec_name"),"width":s.get("width"),
-                                 "height":s.get("height"),"fps":s.get("r_frame_rate")}
-            elif s["codec_type"]=="audio":
-                result["audio"]={"codec":s.get("codec_name"),"sample_rate":s.get("sample_rate"),
-                                 "channels":s.get("channels")}
-        return J(**result)
+async def ffmpeg_info(path:str,refresh:bool=False,keyframes:bool=False)->str:
+    """获取媒体文件信息(时长/分辨率/编码等), 结果缓存在磁盘索引中(OMNI_PROBE_DB), 文件大小或修改时间变化后自动重新探测
+    返回 duration/size/format/bitrate/tags, video(首个视频流,含rotation)/audio(首个音频流),
+      streams: 全部流(编码/码率/语言/宽高/帧率/像素格式/旋转/采样率/声道布局),
+      keyframe_interval/keyframe_max: 前30秒内关键帧平均/最大间隔(秒, 仅keyframes=true时), cached: 是否命中缓存
+    refresh: 忽略缓存重新探测
+    keyframes: 同时统计视频关键帧间隔(额外运行一次ffprobe扫描前30秒, 结果随索引缓存)"""
+    try:
+        return J(**await _probe(str(R(path)),refresh,keyframes))
+    except Exception as e:
+        return J(False,err=str(e))
+@mcp.tool(name="ffmpeg_probe_batch")
+async def ffmpeg_probe_batch(path:str,recursive:bool=False,workers:int=0,refresh:bool=False,
+                             keyframes:bool=False,ctx:Context=None)->str:
+    """批量探测媒体文件信息并写入磁盘索引, 多个ffprobe进程并发, 已缓存且未变化的文件不再探测
+    path: 目录(按常见音视频扩展名筛选) 或通配符(如 'footage/**/*.mov', **递归)
+    recursive: path为目录时是否包含子目录
+    workers: 同时运行的ffprobe进程数, 0=OMNI_PROBE_WORKERS
+    keyframes: 同时统计视频关键帧间隔(同ffmpeg_info, 每个视频多一次ffprobe)
+    返回 items: 每个文件的信息(同ffmpeg_info, 另含path), 失败项为 {"path":"...","err":"..."}"""
+    try:
+        src=R(path)
+        if src.is_dir():
+            files=sorted(str(f) for f in (src.rglob("*") if recursive else src.iterdir())
+                         if f.suffix.lower() in _MEDIA_EXTS and f.is_file())
+        else:
+            files=sorted(f for f in glob.glob(str(src),recursive=True) if os.path.isfile(f))
+        if not files:
+            return J(False,err=f"无匹配文件: {path}")
+        sem=asyncio.Semaphore(max(1,workers or PROBE_WORKERS))
+        async def one(f):
+            async with sem:
+                try:
+                    return dict(await _probe(f,refresh,keyframes),path=f)
+                except Exception as e:
+                    return {"path":f,"err":str(e)}
+        t0=time.perf_counter()
+        tasks=[asyncio.ensure_future(one(f)) for f in files]
+        step=max(1,len(files)//100)
+        for done,fut in enumerate(asyncio.as_completed(tasks),1):
+            r=await fut
+            if done%step==0 or done==len(files) or "err" in r:
+                await _notify(ctx,done,len(files),[f"{r['path']}: {r['err']}"] if "err" in r else ())
+        items=[t.result() for t in tasks]
+        failed=sum(1 for r in items if "err" in r)
+        cached=sum(1 for r in items if r.get("cached"))
+        return J(failed==0,items=items,count=len(items),probed=len(items)-failed-cached,cached=cached,
+                 failed=failed,time_s=round(time.perf_counter()-t0,3))
     except Exception as e:
         return J(False,err=str(e))
+def _segment_cuts(keys: Sequence[float], duration: float, length: float) -> list:
+    """(start, end) spans for segmented encoding, each cut on the first keyframe at least
+    `length` seconds after the previous one; the last span is open-ended (end None)."""
+    cuts = [0.0]
+    for t in keys:
+        if t - cuts[-1] >= length and duration - t > 1:
+            cuts.append(t)
+    return list(zip(cuts, cuts[1:] + [None]))
+async def _ffmpeg_segmented(src: str, dst: str, options: str, length: float, workers: int,
+                            timeout: int, ctx: Optional[Context] = None) -> dict:
+    """Encode `src` as keyframe-aligned video segments on parallel ffmpeg processes plus one
+    whole-file audio pass, then join the segments with the concat demuxer and mux the audio
+    back in with stream copy. Audio is kept in one piece because per-segment encoder
+    priming would leave a gap at every join."""
+    info = await _probe(src)
+    dur = float(info.get("duration") or 0)
+    if "video" not in info or not dur:
+        raise ValueError("segmented mode needs a video input with a known duration")
+    start = float(info.get("start_time") or 0)
+    spans = _segment_cuts([t - start for t in await _keyframe_times(src, timeout=timeout)], dur, length)
+    ext = Path(dst).suffix
+    n = max(1, workers or CPU_WORKERS)
+    sem = asyncio.Semaphore(n)
+    group: list = []
+    async def enc(cmd: str, prog: Optional[_FFProgress] = None) -> None:
+        async with sem:
+            o, e, c = await _run(cmd, shell=True, timeout=timeout, on_line=prog)
+        if c:
+            raise RuntimeError(f"ffmpeg failed (code {c}): {e[-300:]}")
+    t0 = time.perf_counter()
+    with _scratch() as sd:
+        segs = [str(Path(sd) / f"seg_{k:04d}{ext}") for k in range(len(spans))]
+        audio = str(Path(sd) / f"audio{ext}") if "audio" in info else None
+        # The audio pass is the longest single job, so it is queued first.
+        jobs = [enc(f'"{FFMPEG}" -y -i "{src}" -vn -sn -dn {options} "{audio}"')] if audio else []
+        for (a, b), sp in zip(spans, segs):
+            t = f" -t {b - a:.6f}" if b is not None else ""
+            jobs.append(enc(f'"{FFMPEG}" -y -progress pipe:1 -nostats -ss {a:.6f} -i "{src}"{t} -an -sn -dn {options} "{sp}"',
+                            _FFProgress(ctx, dur, group=group)))
+        errs = [r for r in await asyncio.gather(*jobs, return_exceptions=True) if isinstance(r, BaseException)]
+        if errs:
+            raise errs[0]
+        enc_s = time.perf_counter() - t0
+        lst = Path(sd) / "concat.txt"
+        lst.write_text("".join("file '" + p.replace("'", "'\\''") + "'\n" for p in segs), encoding="utf-8")
+        mux = f' -i "{audio}" -map 0:v -map 1:a' if audio else ""
+        await enc(f'"{FFMPEG}" -y -f concat -safe 0 -i "{lst}"{mux} -c copy "{dst}"')
+    dout = float((await _probe(dst, refresh=True)).get("duration") or 0)
+    return {"ok": abs(dout - dur) <= 0.5, "path": dst, "segments": len(spans),
+            "workers": n, "duration_in": dur, "duration_out": dout,
+            "encode_s": round(enc_s, 3), "wall_s": round(time.perf_counter() - t0, 3),
+            "progress": group[0].summary() if group else None}
 @mcp.tool(name="ffmpeg_convert")
-async def ffmpeg_convert(input:str,output:str,options:str="")->str:
+async def ffmpeg_convert(input:str,output:str,options:str="",segment:float=0,workers:int=0,
+                         timeout:int=300,ctx:Context=None)->str:
     """媒体格式转换
     input: 输入文件  output: 输出文件
     options: 额外FFmpeg参数(如 "-crf 23 -preset fast")
-    支持: mp4/avi/mkv/mov/mp3/wav/flac/gif/webm等互转"""
+    支持: mp4/avi/mkv/mov/mp3/wav/flac/gif/webm等互转
+    segment: >0时分段并行转码: 按探测到的关键帧把输入切成约segment秒的片段, 多个ffmpeg进程并行编码视频,
+      音频整轨单独编码一次(避免片段接缝), 再用concat分离器无重编码拼接; 字幕/数据流不保留; 0=单进程转码
+    workers: 分段模式同时运行的ffmpeg进程数, 0=OMNI_CPU_WORKERS
+    timeout: 每个ffmpeg进程的超时(秒)
+    分段模式返回 segments/duration_in/duration_out, 输出与输入时长相差超过0.5秒时ok=false
+    运行中通过MCP进度通知推送 帧数/fps/速度/已输出时长/百分比(按探测到的输入时长计算, 分段模式为各段之和)
+    返回结构化统计(frames/fps/speed/out_time_s/percent/size_bytes...); 失败时附带stderr末尾作为log"""
     try:
-        cmd=f'"{FFMPEG}" -y -i "{R(input)}" {options} "{R(output)}"'
-        o,e,c=_run(cmd,shell=True,timeout=300)
-        return J(path=str(R(output)),code=c,log=e[-500:])
+        src,dst=str(R(input)),str(R(output))
+        if segment>0:
+            return J(**await _ffmpeg_segmented(src,dst,options,segment,workers,timeout,ctx))
+        try:
+            dur=float((await _probe(src)).get("duration") or 0) or None
+        except Exception:
+            dur=None
+        lim=_FF_LIMIT.search(options)
+        if lim and _ff_seconds(lim[1]):
+            dur=min(dur or float("inf"),_ff_seconds(lim[1]))
+        prog=_FFProgress(ctx,dur)
+        cmd=f'"{FFMPEG}" -y -progress pipe:1 -nostats -i "{src}" {options} "{dst}"'
+        o,e,c=await _run(cmd,shell=True,timeout=timeout,on_line=prog)
+        return J(c==0,path=dst,code=c,**prog.summary(),**({"log":e[-2000:]} if c else {}))
+    except subprocess.TimeoutExpired as e:
+        return J(False,err=f"超时({e.timeout}s)")
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="ffmpeg_clip")
@@ -1400,7 +3713,7 @@ async def ffmpeg_clip(input:str,output:str,start:str="00:00:00",
         elif end:
             cmd+=f" -to {end}"
         cmd+=f' -c copy "{R(output)}"'
-        o,e,c=_run(cmd,shell=True,timeout=120)
+        o,e,c=await _run(cmd,shell=True,timeout=120)
         return J(path=str(R(output)),code=c)
     except Exception as e:
         return J(False,err=str(e))
@@ -1410,18 +3723,20 @@ async def ffmpeg_screenshot(input:str,output:str="screenshot.png",
     """从视频截取帧"""
     try:
         cmd=f'"{FFMPEG}" -y -ss {time} -i "{R(input)}" -vframes 1 "{R(output)}"'
-        o,e,c=_run(cmd,shell=True,timeout=30)
+        o,e,c=await _run(cmd,shell=True,timeout=30)
         return J(path=str(R(output)),code=c)
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="ffmpeg_gif")
 async def ffmpeg_gif(input:str,output:str="output.gif",fps:int=10,
-                     width:int=480,start:str="00:00:00",duration:str="5")->str:
-    """视频转GIF"""
+                     width:int=480,start:str="00:00:00",duration:str="5",ctx:Context=None)->str:
+    """视频转GIF
+    运行中通过MCP进度通知推送进度, 返回结构化统计; 失败时附带stderr末尾作为log"""
     try:
-        cmd=f'"{FFMPEG}" -y -ss {start} -t {duration} -i "{R(input)}" -vf "fps={fps},scale={width}:-1:flags=lanczos" "{R(output)}"'
-        o,e,c=_run(cmd,shell=True,timeout=120)
-        return J(path=str(R(output)),code=c)
+        prog=_FFProgress(ctx,_ff_seconds(duration))
+        cmd=f'"{FFMPEG}" -y -progress pipe:1 -nostats -ss {start} -t {duration} -i "{R(input)}" -vf "fps={fps},scale={width}:-1:flags=lanczos" "{R(output)}"'
+        o,e,c=await _run(cmd,shell=True,timeout=120,on_line=prog)
+        return J(c==0,path=str(R(output)),code=c,**prog.summary(),**({"log":e[-2000:]} if c else {}))
     except Exception as e:
         return J(False,err=str(e))
 # --- GIMP SUBSYSTEM: Batch image scripting interface ---
@@ -1437,15 +3752,8 @@ async def gimp_exec(script:str,timeout:int=120)->str:
     try:
         cmd=[GIMP,"-i","--batch-interpreter","plug-in-script-fu-eval","-b","-"]
         full=f'{script}\n(gimp-quit 0)\n'
-        r=subprocess.run(cmd,input=full,capture_output=True,text=True,
-                         timeout=timeout,cwd=str(WD),creationflags=CF,errors="replace")
-        o=r.stdout or ""
-        e=r.stderr or ""
-        if len(o)>4000:
-            o=o[:2000]+"\n...(truncated)...\n"+o[-2000:]
-        if len(e)>2000:
-            e=e[-2000:]
-        return J(stdout=o,stderr=e,code=r.returncode)
+        o,e,c=await _run(cmd,timeout=timeout,input=full)
+        return J(stdout=o,stderr=e,code=c)
     except subprocess.TimeoutExpired:
         return J(False,err=f"GIMP超时({timeout}s)")
     except Exception as e:
@@ -1458,15 +3766,8 @@ async def gimp_python(script:str,timeout:int=120)->str:
     try:
         full=f'(python-fu-eval RUN-NONINTERACTIVE 0 "{script.replace(chr(34),chr(92)+chr(34))}")\n(gimp-quit 0)\n'
         cmd=[GIMP,"-i","--batch-interpreter","plug-in-script-fu-eval","-b","-"]
-        r=subprocess.run(cmd,input=full,capture_output=True,text=True,
-                         timeout=timeout,cwd=str(WD),creationflags=CF,errors="replace")
-        o=r.stdout or ""
-        e=r.stderr or ""
-        if len(o)>4000:
-            o=o[:2000]+"\n...(truncated)...\n"+o[-2000:]
-        if len(e)>2000:
-            e=e[-2000:]
-        return J(stdout=o,stderr=e,code=r.returncode)
+        o,e,c=await _run(cmd,timeout=timeout,input=full)
+        return J(stdout=o,stderr=e,code=c)
     except subprocess.TimeoutExpired:
         return J(False,err=f"GIMP超时({timeout}s)")
     except Exception as e:
@@ -1492,7 +3793,7 @@ async def inkscape_exec(input:str="",actions:str="",output:str="",
             cmd.extend([f"--export-type={export_type}",f"--export-filename={R(output)}"])
         elif output:
             cmd.extend([f"--export-filename={R(output)}"])
-        o,e,c=_run(cmd,timeout=120)
+        o,e,c=await _run(cmd,timeout=120)
         return J(stdout=o,stderr=e,code=c,output=str(R(output)) if output else "")
     except Exception as e:
         return J(False,err=str(e))
@@ -1504,7 +3805,7 @@ async def inkscape_convert(input:str,output:str,dpi:int=300)->str:
         ext=Path(output).suffix.lstrip(".")
         cmd=[INKSCAPE,str(R(input)),f"--export-type={ext}",
              f"--export-filename={R(output)}",f"--export-dpi={dpi}"]
-        o,e,c=_run(cmd,timeout=60)
+        o,e,c=await _run(cmd,timeout=60)
         return J(path=str(R(output)),code=c)
     except Exception as e:
         return J(False,err=str(e))
@@ -1521,15 +3822,17 @@ async def freecad_exec(script:str,timeout:int=120)->str:
       doc = FreeCAD.ActiveDocument
       doc.saveCopy('output.FCStd')"""
     try:
-        sf=WD/"_freecad.py"
-        sf.write_text(script,encoding="utf-8")
-        # FreeCADCmd.exe 直接接受Python脚本作为位置参数
-        cmd=[FREECAD,str(sf)]
-        o,e,c=_run(cmd,timeout=timeout)
+        with _scratch() as sd:
+            sf=Path(sd)/"_freecad.py"
+            sf.write_text(script,encoding="utf-8")
+            # FreeCADCmd.exe 直接接受Python脚本作为位置参数
+            cmd=[FREECAD,str(sf)]
+            o,e,c=await _run(cmd,timeout=timeout)
         return J(stdout=o,stderr=e,code=c)
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="freecad_create")
+@_cached("output")
 async def freecad_create(shape:str="box",params:str="{}",
                          output:str="model.step",fmt:str="step")->str:
     """快捷创建FreeCAD零件并导出
@@ -1537,7 +3840,8 @@ async def freecad_create(shape:str="box",params:str="{}",
     params: {"length":10,"width":10,"height":10} (box)
             {"radius":5,"height":10} (cylinder/cone)
             {"radius":5} (sphere/torus, torus额外radius2)
-    output: 输出文件  fmt: step|stl|obj|iges|brep"""
+    output: 输出文件  fmt: step|stl|obj|iges|brep
+    cache: true=参数与输入文件相同时直接复制缓存产物,跳过重新生成(统计/清理见render_cache)"""
     kw=json.loads(params) if isinstance(params,str) else params
     op=str(R(output)).replace("\\","\\\\")
     lines=["import FreeCAD, Part"]
@@ -1586,18 +3890,19 @@ async def godot_exec(project_path:str,script:str="",timeout:int=60)->str:
     无script时返回项目信息"""
     try:
         pp=str(R(project_path))
-        if script:
-            # Godot 4脚本必须extends SceneTree才能headless运行
-            if "extends" not in script:
-                script=f"extends SceneTree\nfunc _init():\n\t"+script.replace("\n","\n\t")+"\n\tquit()"
-            elif "quit()" not in script:
-                script+="\n\tquit()"
-            sf=WD/"_godot_script.gd"
-            sf.write_text(script,encoding="utf-8")
-            cmd=[GODOT,"--path",pp,"--headless","-s",str(sf)]
-        else:
-            cmd=[GODOT,"--path",pp,"--headless","--quit"]
-        o,e,c=_run(cmd,timeout=timeout)
+        with _scratch() as sd:
+            if script:
+                # Godot 4脚本必须extends SceneTree才能headless运行
+                if "extends" not in script:
+                    script=f"extends SceneTree\nfunc _init():\n\t"+script.replace("\n","\n\t")+"\n\tquit()"
+                elif "quit()" not in script:
+                    script+="\n\tquit()"
+                sf=Path(sd)/"_godot_script.gd"
+                sf.write_text(script,encoding="utf-8")
+                cmd=[GODOT,"--path",pp,"--headless","-s",str(sf)]
+            else:
+                cmd=[GODOT,"--path",pp,"--headless","--quit"]
+            o,e,c=await _run(cmd,timeout=timeout)
         return J(stdout=o,stderr=e,code=c)
     except Exception as e:
         return J(False,err=str(e))
@@ -1609,7 +3914,7 @@ async def godot_run(project_path:str,scene:str="",timeout:int=30)->str:
         cmd=[GODOT,"--path",str(R(project_path))]
         if scene:
             cmd.append(scene)
-        o,e,c=_run(cmd,timeout=timeout)
+        o,e,c=await _run(cmd,timeout=timeout)
         return J(stdout=o,stderr=e,code=c)
     except subprocess.TimeoutExpired:
         return J(ok=True,msg=f"项目运行{timeout}秒后自动退出")
@@ -1623,7 +3928,7 @@ async def godot_export(project_path:str,preset:str="",output:str="")->str:
     try:
         cmd=[GODOT,"--path",str(R(project_path)),"--headless",
              "--export-release",preset,str(R(output))]
-        o,e,c=_run(cmd,timeout=300)
+        o,e,c=await _run(cmd,timeout=300)
         return J(path=str(R(output)),code=c,stderr=e)
     except Exception as e:
         return J(False,err=str(e))
@@ -1638,7 +3943,8 @@ async def file_open(path:str)->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="file_list")
-async def file_list(dir:str="",pattern:str="",recursive:bool=False)->str:
+@_offload("io")
+def file_list(dir:str="",pattern:str="",recursive:bool=False)->str:
     """列出目录文件
     pattern: 通配符如'*.py','*.pdf'
     recursive: 是否递归子目录"""
@@ -1657,7 +3963,8 @@ async def file_list(dir:str="",pattern:str="",recursive:bool=False)->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="file_copy")
-async def file_copy(src:str,dst:str)->str:
+@_offload("io")
+def file_copy(src:str,dst:str)->str:
     """复制文件或目录"""
     try:
         s,d=str(R(src)),str(R(dst))
@@ -1669,7 +3976,8 @@ async def file_copy(src:str,dst:str)->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="file_move")
-async def file_move(src:str,dst:str)->str:
+@_offload("io")
+def file_move(src:str,dst:str)->str:
     """移动/重命名文件"""
     try:
         s,d=str(R(src)),str(R(dst))
@@ -1678,7 +3986,8 @@ async def file_move(src:str,dst:str)->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="file_delete")
-async def file_delete(path:str)->str:
+@_offload("io")
+def file_delete(path:str)->str:
     """删除文件或目录"""
     try:
         p=str(R(path))
@@ -1690,7 +3999,8 @@ async def file_delete(path:str)->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="file_read")
-async def file_read(path:str,encoding:str="utf-8",lines:str="")->str:
+@_offload("io")
+def file_read(path:str,encoding:str="utf-8",lines:str="")->str:
     """读取文本文件
     lines: "1-10" 读取指定行范围, 空=全部"""
     try:
@@ -1706,7 +4016,8 @@ async def file_read(path:str,encoding:str="utf-8",lines:str="")->str:
     except Exception as e:
         return J(False,err=str(e))
 @mcp.tool(name="file_write")
-async def file_write(path:str,content:str,encoding:str="utf-8",append:bool=False)->str:
+@_offload("io")
+def file_write(path:str,content:str,encoding:str="utf-8",append:bool=False)->str:
     """写入文本文件"""
     try:
         p=str(R(path))
@@ -1721,7 +4032,7 @@ async def run_cmd(cmd:str,timeout:int=60,cwd:str="")->str:
     """执行系统命令
     cwd: 工作目录(可选,默认临时目录)"""
     try:
-        o,e,c=_run(cmd,timeout=timeout,shell=True,cwd=str(R(cwd)) if cwd else None)
+        o,e,c=await _run(cmd,timeout=timeout,shell=True,cwd=str(R(cwd)) if cwd else None)
         return J(stdout=o,stderr=e,code=c)
     except Exception as e:
         return J(False,err=str(e))
@@ -1729,10 +4040,11 @@ async def run_cmd(cmd:str,timeout:int=60,cwd:str="")->str:
 async def run_python(script:str,timeout:int=60)->str:
     """执行Python脚本(使用系统Python)"""
     try:
-        sf=WD/"_script.py"
-        sf.write_text(script,encoding="utf-8")
         import sys
-        o,e,c=_run([sys.executable,str(sf)],timeout=timeout)
+        with _scratch() as sd:
+            sf=Path(sd)/"_script.py"
+            sf.write_text(script,encoding="utf-8")
+            o,e,c=await _run([sys.executable,str(sf)],timeout=timeout)
         return J(stdout=o,stderr=e,code=c)
     except Exception as e:
         return J(False,err=str(e))
@@ -1743,6 +4055,7 @@ async def system_info()->str:
     info={"os":platform.system(),"version":platform.version(),
           "arch":platform.architecture()[0],"python":platform.python_version(),
           "work_dir":str(WD),
+          "workers":{"io":IO_WORKERS,"cpu":CPU_WORKERS},
           "tools":{
               "blender":BLENDER,"matlab":MATLAB,"ffmpeg":FFMPEG,
               "gimp":GIMP,"inkscape":INKSCAPE,"freecad":FREECAD,"godot":GODOT
@@ -1751,6 +4064,44 @@ async def system_info()->str:
     for name,path in info["tools"].items():
         info["tools"][name]={"path":path,"found":os.path.isfile(path) if os.path.sep in path else shutil.which(path) is not None}
     return J(**info)
+@mcp.tool(name="render_cache")
+async def render_cache(action:str="stats",tool:str="")->str:
+    """生成类工具(chart_create/svg_create/pdf_create/img_create/freecad_create)的产物缓存
+    action: stats=命中/未命中次数、条目数与占用字节 | clear=清空缓存
+    tool: clear时仅清除该工具的条目,空=全部
+    缓存目录与容量上限由 OMNI_CACHE_DIR / OMNI_CACHE_MAX_MB 配置,超限时按最近最少使用淘汰"""
+    try:
+        if action=="clear":
+            return J(removed=await _submit("io",_CACHE.clear,tool))
+        return J(**await _submit("io",_CACHE.stats))
+    except Exception as e:
+        return J(False,err=str(e))
+@mcp.tool(name="doc_session")
+@_offload("io")
+def doc_session(action:str="status",path:str="",handle:str="",save:bool=True,force:bool=False)->str:
+    """Office文档会话: 文档只解析一次并常驻内存, pptx_edit/xlsx_write/xlsx_chart/docx_replace 传入handle后直接修改内存中的文档
+    action: open=打开path(.pptx/.docx/.xlsx), 返回handle(同一文件重复打开返回同一handle)
+            commit=将handle的修改写回磁盘  close=关闭会话(save=false时丢弃未提交修改)
+            status=列出打开的会话
+    force: commit时即使磁盘文件已被外部修改也覆盖写入
+    一致性: 磁盘文件被外部修改时, 无未提交修改的会话自动重新加载, 有未提交修改的会话拒绝继续编辑/提交;
+      已有未提交修改时某次编辑中途失败, 会话标记为损坏并拒绝保存, 需close(save=false)丢弃后重新打开
+    空闲超过OMNI_DOC_IDLE秒的会话自动保存并关闭, 最多同时打开OMNI_DOC_SESSIONS个文档, 进程退出前保存所有会话"""
+    try:
+        if action=="open":
+            sess=_DOCS.open(str(R(path)))
+            return J(handle=sess.handle,path=sess.path)
+        if action=="commit":
+            sess=_DOCS.get(handle)
+            with sess.lock:
+                saved=sess.save(force=force)
+            return J(handle=handle,path=sess.path,saved=saved)
+        if action=="close":
+            _DOCS.close(handle,save=save)
+            return J(handle=handle,closed=True)
+        return J(sessions=_DOCS.status())
+    except Exception as e:
+        return J(False,err=str(e))
 # --- ENTRY: MCP service bootstrap ---
 # Keep stdio transport for compatibility with VS Code MCP clients.
 if __name__ == "__main__":
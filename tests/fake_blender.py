@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Stand-in for `blender --background [file] --python script.py` used by the tests.
+
+It installs a tiny `bpy` module whose scene is a list of object names and whose
+.blend files are JSON lists, then runs the --python script like Blender would.
+Point OMNI_BLENDER (or omni_mcp.BLENDER) at this file to drive the warm-worker
+protocol without a Blender install.
+"""
+import json
+import os
+import runpy
+import sys
+import types
+
+
+class _Data:
+    def __init__(self) -> None:
+        self.filepath = ""
+        self.objects: list = []
+
+
+data = _Data()
+
+
+def _load(path: str) -> None:
+    with open(path, encoding="utf-8") as f:
+        data.objects = json.load(f)
+    data.filepath = os.path.abspath(path)
+
+
+def open_mainfile(filepath: str) -> None:
+    _load(filepath)
+
+
+def read_homefile() -> None:
+    data.filepath = ""
+    data.objects = ["Cube"]
+
+
+def revert_mainfile() -> None:
+    _load(data.filepath)
+
+
+def save_as_mainfile(filepath: str, copy: bool = False) -> None:
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(data.objects, f)
+    if not copy:
+        data.filepath = os.path.abspath(filepath)
+
+
+def add(name: str) -> None:
+    data.objects.append(name)
+    context.object = types.SimpleNamespace(name=name)
+
+
+class _Mesh:
+    """bpy.ops.mesh.primitive_<kind>_add(**kw) adds an object named <Kind>."""
+
+    def __getattr__(self, op: str):
+        return lambda **kw: add(op[len("primitive_"):-len("_add")].title())
+
+
+def render(write_still: bool = False) -> None:
+    # Like Blender, fails when the output directory does not exist.
+    with open(context.scene.render.filepath, "w", encoding="utf-8") as f:
+        f.write("image")
+
+
+context = types.SimpleNamespace(object=None, scene=types.SimpleNamespace(
+    render=types.SimpleNamespace(), cycles=types.SimpleNamespace(), frame_set=lambda frame: None))
+
+
+bpy = types.ModuleType("bpy")
+bpy.app = types.SimpleNamespace(version_string="0.0.0 (fake)")
+bpy.data = data
+bpy.context = context
+bpy.ops = types.SimpleNamespace(
+    wm=types.SimpleNamespace(open_mainfile=open_mainfile, read_homefile=read_homefile,
+                             revert_mainfile=revert_mainfile, save_as_mainfile=save_as_mainfile),
+    mesh=_Mesh(),
+    render=types.SimpleNamespace(render=render),
+    fake=types.SimpleNamespace(add=add),
+)
+sys.modules["bpy"] = bpy
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    script = args[args.index("--python") + 1]
+    files = [a for a in args[:args.index("--python")] if not a.startswith("--")]
+    if files:
+        _load(files[0])
+    else:
+        read_homefile()
+    runpy.run_path(script, run_name="__main__")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Stand-in for `matlab -batch "...; omni_matlab_server"` used by the tests.
+
+It speaks the same JSON-lines protocol as omni_matlab_server.m, but evaluates the
+request code as Python in a persistent "base workspace" dict. Point OMNI_MATLAB (or
+omni_mcp.MATLAB) at this file to drive the warm-session protocol without MATLAB.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import traceback
+
+PREFIX = "\x1e@omni "
+
+
+def reply(**kw):
+    sys.stdout.write(PREFIX + json.dumps(kw) + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    base: dict = {}
+    reply(id=0, ok=True, version="0.0 (fake)")
+    for line in sys.stdin:
+        req = json.loads(line)
+        rep = {"id": req["id"], "ok": True, "out": "", "err": ""}
+        try:
+            if req["op"] == "eval":
+                if not req["keep"]:
+                    base.clear()
+                os.chdir(req["cwd"])
+                buf = io.StringIO()
+                with contextlib.redirect_stdout(buf):
+                    exec(req["code"], base)
+                rep["out"] = buf.getvalue()
+            elif req["op"] == "reset":
+                base.clear()
+                os.chdir(req["cwd"])
+            elif req["op"] == "quit":
+                reply(**rep)
+                break
+            elif req["op"] != "ping":
+                rep.update(ok=False, err="unknown op: " + req["op"])
+        except Exception:
+            rep.update(ok=False, err=traceback.format_exc(limit=0))
+        reply(**rep)
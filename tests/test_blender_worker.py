@@ -0,0 +1,125 @@
+"""Warm Blender worker protocol, driven through tests/fake_blender.py."""
+import asyncio
+import json
+import os
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import omni_mcp  # noqa: E402
+
+FAKE = Path(__file__).with_name("fake_blender.py")
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="fake Blender is launched through its shebang")
+
+
+@pytest.fixture(autouse=True)
+def fake_blender(monkeypatch):
+    FAKE.chmod(FAKE.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(omni_mcp, "BLENDER", str(FAKE))
+
+
+def run(pool, key, script, keep=False):
+    return pool.run(key, "execute", script, 30, keep)
+
+
+async def stop(pool):
+    await pool.shutdown()
+    # let the loop collect the killed processes before asyncio.run closes it
+    await asyncio.sleep(0.2)
+
+
+def objects(out):
+    return json.loads(out.strip().splitlines()[-1])
+
+
+SHOW = "import bpy, json; print(json.dumps(bpy.data.objects))"
+
+
+def test_state_is_reset_unless_kept():
+    async def main():
+        pool = omni_mcp._WorkerPool(omni_mcp._BlenderWorker, 2, 600)
+        try:
+            await run(pool, "", "import bpy; bpy.ops.fake.add('A')")
+            o, e, c = await run(pool, "", SHOW)
+            assert (objects(o), c) == (["Cube"], 0)
+            await run(pool, "", "import bpy; bpy.ops.fake.add('B')")
+            o, _, _ = await run(pool, "", SHOW, keep=True)
+            assert objects(o) == ["Cube", "B"]
+            assert pool.status()[0]["restarts"] == 0
+        finally:
+            await stop(pool)
+    asyncio.run(main())
+
+
+def test_save_as_recycles_worker(tmp_path):
+    other = tmp_path / "other.blend"
+
+    async def main():
+        pool = omni_mcp._WorkerPool(omni_mcp._BlenderWorker, 2, 600)
+        try:
+            await run(pool, "", f"import bpy; bpy.ops.fake.add('A'); bpy.ops.wm.save_as_mainfile(filepath={str(other)!r})")
+            assert not pool.workers[""].alive
+            o, _, _ = await run(pool, "", "import bpy; print(repr(bpy.data.filepath))\n" + SHOW, keep=True)
+            assert o.splitlines()[0] == "''" and objects(o) == ["Cube"]
+            await run(pool, "", f"import bpy; bpy.ops.wm.save_as_mainfile(filepath={str(other)!r}, copy=True)")
+            assert pool.workers[""].alive
+        finally:
+            await stop(pool)
+    asyncio.run(main())
+
+
+def test_file_session_reloads_after_external_change(tmp_path):
+    blend = tmp_path / "scene.blend"
+    blend.write_text('["Cube"]')
+
+    async def main():
+        pool = omni_mcp._WorkerPool(omni_mcp._BlenderWorker, 2, 600)
+        key = str(blend)
+        try:
+            await run(pool, key, "import bpy; bpy.ops.fake.add('A')")
+            o, _, _ = await run(pool, key, SHOW, keep=True)
+            assert objects(o) == ["Cube", "A"]
+            blend.write_text('["Lamp"]')
+            os.utime(blend, (1, 1))
+            o, _, _ = await run(pool, key, SHOW, keep=True)
+            assert objects(o) == ["Lamp"]
+        finally:
+            await stop(pool)
+    asyncio.run(main())
+
+
+def test_atomic_scene_batch_rolls_back_and_rejects_early_save():
+    async def main():
+        try:
+            r = json.loads(await omni_mcp.blender_scene_batch(json.dumps([
+                {"action": "add_mesh", "mesh": "torus"}, {"action": "delete", "obj": "Nope"},
+                {"action": "add_mesh", "mesh": "cone"}])))
+            assert r["aborted"] and r["failed"] == 1 and r["skipped"] == 1
+            assert r["results"][0]["obj"] == "Torus"
+            o, _, _ = await omni_mcp._blender_run(SHOW, keep=True)
+            assert objects(o) == ["Cube"]
+            r = json.loads(await omni_mcp.blender_scene_batch(json.dumps([
+                {"action": "save", "path": "x.blend"}, {"action": "add_mesh"}])))
+            assert not r["ok"] and "save/export" in r["err"]
+        finally:
+            await stop(omni_mcp._BLENDER_POOL)
+    asyncio.run(main())
+
+
+def test_warm_render_reports_failure(tmp_path):
+    blend = tmp_path / "scene.blend"
+    blend.write_text('["Cube"]')
+
+    async def main():
+        try:
+            r = json.loads(await omni_mcp.blender_render(str(blend), str(tmp_path / "r.png")))
+            assert r["ok"] and r["code"] == 0 and "log" not in r
+            assert (tmp_path / "r.png").exists()
+            r = json.loads(await omni_mcp.blender_render(str(blend), str(tmp_path / "no" / "r.png")))
+            assert not r["ok"] and r["code"] == 1 and "FileNotFoundError" in r["log"]
+        finally:
+            await stop(omni_mcp._BLENDER_POOL)
+    asyncio.run(main())
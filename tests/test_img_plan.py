@@ -0,0 +1,68 @@
+"""img_process plan=true must produce the same pixels as running the ops one by one."""
+import inspect
+import json
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import omni_mcp  # noqa: E402
+
+img_process = inspect.unwrap(omni_mcp.img_process)
+
+
+def noise(path, mode, w, h, seed):
+    bands = {"L": 1, "RGB": 3, "RGBA": 4}[mode]
+    a = (np.random.RandomState(seed).rand(h, w, bands) * 255).astype("uint8")
+    Image.fromarray(a[:, :, 0] if mode == "L" else a, mode).save(path)
+
+
+def both(tmp_path, src, ops, **kw):
+    out = []
+    for plan in (True, False):
+        dst = tmp_path / f"out_{plan}.png"
+        r = json.loads(img_process(str(src), str(dst), json.dumps(ops), plan=plan, **kw))
+        assert r["ok"], r
+        out.append(np.asarray(Image.open(dst)))
+    return out
+
+
+def stages(src, ops):
+    return json.loads(img_process(str(src), ops=json.dumps(ops), explain=True))["plan"]
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L"])
+def test_resize_crop_matches_sequential(tmp_path, mode):
+    rs = random.Random(mode)
+    src = tmp_path / "src.png"
+    for n in range(12):
+        w, h = rs.randint(8, 120), rs.randint(8, 120)
+        if n % 2:
+            fx, fy = rs.choice([(2, 2), (3, 1), (1, 4), (5, 2)])
+            size = (w * fx, h * fy)
+        else:
+            size = (rs.randint(20, 400), rs.randint(20, 400))
+        noise(src, mode, *size, seed=n)
+        l, r = sorted(rs.sample(range(w + 1), 2))
+        t, b = sorted(rs.sample(range(h + 1), 2))
+        ops = [{"op": "resize", "w": w, "h": h}, {"op": "crop", "l": l, "t": t, "r": r, "b": b}]
+        merged = len(stages(src, ops)) == 1
+        assert merged == (size[0] % w == 0 and size[1] % h == 0 and size != (w, h))
+        a, b_ = both(tmp_path, src, ops)
+        assert np.array_equal(a, b_), (size, ops)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L"])
+def test_colour_chain_matches_sequential(tmp_path, mode):
+    src = tmp_path / "src.png"
+    noise(src, mode, 97, 61, seed=3)
+    ops = [{"op": "brightness", "f": 1.3}, {"op": "contrast", "f": 0.7},
+           {"op": "levels", "in_low": 12, "in_high": 230, "gamma": 1.4, "out_low": 5, "out_high": 250},
+           {"op": "gamma", "g": 2.2}, {"op": "contrast", "f": 1.6}]
+    assert [s["stage"] for s in stages(src, ops)] == ["lut"]
+    a, b = both(tmp_path, src, ops)
+    assert np.array_equal(a, b)
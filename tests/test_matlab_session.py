@@ -0,0 +1,56 @@
+"""Warm MATLAB session protocol, driven through tests/fake_matlab.py."""
+import asyncio
+import json
+import os
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import omni_mcp  # noqa: E402
+
+FAKE = Path(__file__).with_name("fake_matlab.py")
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="fake MATLAB is launched through its shebang")
+
+
+@pytest.fixture(autouse=True)
+def fake_matlab(monkeypatch):
+    FAKE.chmod(FAKE.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(omni_mcp, "MATLAB", str(FAKE))
+
+
+async def call(code, **kw):
+    return json.loads(await omni_mcp.matlab_exec(code, **kw))
+
+
+def test_pipe_worker_is_abstract():
+    with pytest.raises(TypeError):
+        omni_mcp._PipeWorker("x")
+
+
+def test_workspace_keep_reset_and_eviction(monkeypatch):
+    monkeypatch.setattr(omni_mcp._MATLAB_POOL, "size", 1)
+
+    async def main():
+        pool = omni_mcp._MATLAB_POOL
+        try:
+            assert (await call("x = 41"))["code"] == 0
+            r = await call("print(x + 1)", keep=True)
+            assert r["stdout"].strip() == "42"
+            r = await call("print(x)")
+            assert r["code"] == 1 and "NameError" in r["stderr"]
+            await call("y = 1")
+            assert json.loads(await omni_mcp.matlab_session("reset"))["ok"]
+            assert (await call("print(y)", keep=True))["code"] == 1
+            # with one session slot a new session name evicts "default"
+            await call("z = 1")
+            await call("print('other')", session="other")
+            assert [s["key"] for s in pool.status()] == ["other"]
+            assert (await call("print(z)", keep=True))["code"] == 1
+            assert pool.status()[0]["restarts"] == 0
+        finally:
+            await pool.shutdown()
+            await asyncio.sleep(0.2)
+    asyncio.run(main())